@@ -0,0 +1,487 @@
+"""Колоночный архив старых спинов: сегменты .npy с memory-mapped чтением.
+
+    python archive.py archive --older-than-days 90
+    python archive.py user 42 --start 2026-01-01
+    python archive.py period --start 2026-01-01 --end 2026-02-01 --group day
+
+Сегмент — каталог seg_<first_id>_<last_id> с колонками фиксированной
+ширины (id, user_id, created_at, bet/win в копейках, коды символов,
+nonce, коды сидов), индексом по user_id и meta.json со словарями и
+контрольными суммами. Колонки не сжаты поточно (иначе их нельзя
+отобразить в память), объём экономится узкими dtype и словарным
+кодированием строк. Строки удаляются из БД только после того, как
+число строк и суммы, перечитанные из файлов, совпали с БД.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+ARCHIVE_DIR = os.getenv(
+    "ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+)
+SEGMENT_ROWS = int(os.getenv("ARCHIVE_SEGMENT_ROWS", "1000000"))
+MINOR_UNITS = 100
+NO_SYMBOL = 255
+
+
+def _epoch(moment: Optional[datetime]) -> int:
+    return int((moment - datetime(1970, 1, 1)).total_seconds()) if moment else 0
+
+
+def _from_epoch(seconds: int) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(seconds=int(seconds))
+
+
+class _Dictionary:
+    """Словарное кодирование строк колонки."""
+
+    def __init__(self) -> None:
+        self.values: List[Any] = []
+        self._codes: Dict[Any, int] = {}
+
+    def code(self, value: Any) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+
+def build_segment(rows: Sequence[Any]) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Строки Spin -> колонки и meta сегмента."""
+
+    count = len(rows)
+    symbol_dict, seed_dict, client_dict = _Dictionary(), _Dictionary(), _Dictionary()
+    decoded = [json.loads(row.symbols or "[]") for row in rows]
+    width = max((len(symbols) for symbols in decoded), default=0)
+
+    columns = {
+        "id": np.empty(count, dtype=np.int64),
+        "user_id": np.empty(count, dtype=np.int64),
+        "created_at": np.empty(count, dtype=np.int64),
+        "bet": np.empty(count, dtype=np.int64),
+        "win": np.empty(count, dtype=np.int64),
+        "symbols": np.full((count, width), NO_SYMBOL, dtype=np.uint8),
+        "nonce": np.empty(count, dtype=np.int64),
+        "seed": np.empty(count, dtype=np.uint32),
+        "client_seed": np.empty(count, dtype=np.uint32),
+    }
+    for index, (row, symbols) in enumerate(zip(rows, decoded)):
+        pf = row.pf_data or {}
+        columns["id"][index] = row.id
+        columns["user_id"][index] = row.user_id or 0
+        columns["created_at"][index] = _epoch(row.created_at)
+        columns["bet"][index] = round((row.bet or 0.0) * MINOR_UNITS)
+        columns["win"][index] = round((row.win or 0.0) * MINOR_UNITS)
+        columns["symbols"][index, : len(symbols)] = [symbol_dict.code(s) for s in symbols]
+        columns["nonce"][index] = -1 if pf.get("nonce") is None else pf["nonce"]
+        columns["seed"][index] = seed_dict.code(
+            (pf.get("server_seed_hash"), pf.get("server_seed"))
+        )
+        columns["client_seed"][index] = client_dict.code(pf.get("client_seed"))
+
+    if len(symbol_dict.values) >= NO_SYMBOL:
+        raise ValueError("Too many distinct symbols for uint8 codes")
+
+    # user_id почти всегда влезает в 32 бита — экономим половину колонки
+    if count and columns["user_id"].max() < 2 ** 31:
+        columns["user_id"] = columns["user_id"].astype(np.int32)
+    if count and columns["nonce"].max() < 2 ** 31:
+        columns["nonce"] = columns["nonce"].astype(np.int32)
+
+    order = np.argsort(columns["user_id"], kind="stable")
+    user_ids, offsets = np.unique(columns["user_id"][order], return_index=True)
+    columns["user_order"] = order.astype(np.int32 if count < 2 ** 31 else np.int64)
+    columns["user_ids"] = user_ids
+    columns["user_offsets"] = np.append(offsets, count).astype(np.int64)
+
+    meta = {
+        "version": 1,
+        "count": count,
+        "first_id": int(columns["id"][0]) if count else 0,
+        "last_id": int(columns["id"][-1]) if count else 0,
+        "min_created_at": int(columns["created_at"].min()) if count else 0,
+        "max_created_at": int(columns["created_at"].max()) if count else 0,
+        "minor_units": MINOR_UNITS,
+        "symbols": symbol_dict.values,
+        "seeds": [list(pair) for pair in seed_dict.values],
+        "client_seeds": client_dict.values,
+        "checksum": _checksum(columns),
+    }
+    return columns, meta
+
+
+def _checksum(columns: Dict[str, np.ndarray]) -> Dict[str, int]:
+    return {
+        "count": int(columns["id"].shape[0]),
+        "id_sum": int(columns["id"].sum(dtype=np.int64)),
+        "bet_sum": int(columns["bet"].sum(dtype=np.int64)),
+        "win_sum": int(columns["win"].sum(dtype=np.int64)),
+    }
+
+
+def write_segment(directory: str, columns: Dict[str, np.ndarray], meta: Dict[str, Any]) -> str:
+    """Пишет сегмент во временный каталог и возвращает его путь."""
+
+    name = f"seg_{meta['first_id']:012d}_{meta['last_id']:012d}"
+    tmp = os.path.join(directory, f".tmp-{name}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for column, values in columns.items():
+        path = os.path.join(tmp, f"{column}.npy")
+        with open(path, "wb") as fh:
+            np.save(fh, values)
+            fh.flush()
+            os.fsync(fh.fileno())
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as fh:
+        json.dump(meta, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    return tmp
+
+
+class Segment:
+    """Сегмент на диске; колонки открываются через mmap по требованию."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as fh:
+            self.meta = json.load(fh)
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def column(self, name: str) -> np.ndarray:
+        values = self._columns.get(name)
+        if values is None:
+            values = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+            self._columns[name] = values
+        return values
+
+    def overlaps(self, start: Optional[int], end: Optional[int]) -> bool:
+        if start is not None and self.meta["max_created_at"] < start:
+            return False
+        if end is not None and self.meta["min_created_at"] >= end:
+            return False
+        return self.meta["count"] > 0
+
+    def user_rows(self, user_id: int) -> np.ndarray:
+        user_ids = self.column("user_ids")
+        position = int(np.searchsorted(user_ids, user_id))
+        if position >= len(user_ids) or user_ids[position] != user_id:
+            return np.empty(0, dtype=np.int64)
+        offsets = self.column("user_offsets")
+        rows = self.column("user_order")[offsets[position]:offsets[position + 1]]
+        return np.sort(rows)
+
+    def verify(self) -> bool:
+        columns = {name: self.column(name) for name in ("id", "bet", "win")}
+        return _checksum(columns) == self.meta["checksum"]
+
+
+def _time_mask(created_at: np.ndarray, start: Optional[int], end: Optional[int]) -> np.ndarray:
+    mask = np.ones(created_at.shape[0], dtype=bool)
+    if start is not None:
+        mask &= created_at >= start
+    if end is not None:
+        mask &= created_at < end
+    return mask
+
+
+class ArchiveReader:
+    def __init__(self, directory: str = ARCHIVE_DIR) -> None:
+        self.directory = directory
+        self.segments: List[Segment] = []
+        self.refresh()
+
+    def refresh(self) -> None:
+        names = sorted(
+            name
+            for name in (os.listdir(self.directory) if os.path.isdir(self.directory) else [])
+            if name.startswith("seg_")
+        )
+        self.segments = [Segment(os.path.join(self.directory, name)) for name in names]
+
+    def user_summary(
+        self,
+        user_id: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Dict[str, Any]:
+        start_ts = _epoch(start) if start else None
+        end_ts = _epoch(end) if end else None
+        spins = bet = win = 0
+        for segment in self.segments:
+            if not segment.overlaps(start_ts, end_ts):
+                continue
+            rows = segment.user_rows(user_id)
+            if rows.size == 0:
+                continue
+            mask = _time_mask(segment.column("created_at")[rows], start_ts, end_ts)
+            rows = rows[mask]
+            spins += int(rows.size)
+            bet += int(segment.column("bet")[rows].sum(dtype=np.int64))
+            win += int(segment.column("win")[rows].sum(dtype=np.int64))
+        return {
+            "user_id": user_id,
+            "spins": spins,
+            "total_bet": bet / MINOR_UNITS,
+            "total_win": win / MINOR_UNITS,
+            "rtp": win / bet if bet else 0.0,
+        }
+
+    def user_range_totals(self, low: int, high: int) -> Dict[int, Tuple[int, int, int]]:
+        """{user_id: (spins, bet, win)} в копейках для user_id из [low, high)."""
+
+        totals: Dict[int, Tuple[int, int, int]] = {}
+        for segment in self.segments:
+            user_ids = segment.column("user_ids")
+            first, last = np.searchsorted(user_ids, [low, high])
+            if first >= last:
+                continue
+            offsets = segment.column("user_offsets")
+            rows = segment.column("user_order")[offsets[first]:offsets[last]]
+            counts = np.diff(offsets[first:last + 1])
+            groups = np.repeat(np.arange(last - first), counts)
+            width = last - first
+            bets = np.bincount(groups, weights=segment.column("bet")[rows], minlength=width)
+            wins = np.bincount(groups, weights=segment.column("win")[rows], minlength=width)
+            for user_id, spins, bet, win in zip(
+                user_ids[first:last].tolist(), counts.tolist(), bets.tolist(), wins.tolist()
+            ):
+                prev = totals.get(user_id, (0, 0, 0))
+                totals[user_id] = (prev[0] + spins, prev[1] + int(bet), prev[2] + int(win))
+        return totals
+
+    def period_summary(
+        self,
+        start: datetime,
+        end: datetime,
+        group: str = "day",
+    ) -> List[Dict[str, Any]]:
+        step = {"hour": 3600, "day": 86400}[group]
+        start_ts = _epoch(start) // step * step
+        end_ts = _epoch(end)
+        buckets = max((end_ts - start_ts + step - 1) // step, 0)
+        spins = np.zeros(buckets, dtype=np.int64)
+        bet = np.zeros(buckets, dtype=np.int64)
+        win = np.zeros(buckets, dtype=np.int64)
+        users: List[set] = [set() for _ in range(buckets)]
+
+        for segment in self.segments:
+            if not segment.overlaps(start_ts, end_ts):
+                continue
+            created_at = segment.column("created_at")
+            rows = np.flatnonzero(_time_mask(created_at, start_ts, end_ts))
+            if rows.size == 0:
+                continue
+            index = (created_at[rows] - start_ts) // step
+            spins += np.bincount(index, minlength=buckets)
+            for total, column in ((bet, "bet"), (win, "win")):
+                total += np.bincount(
+                    index, weights=segment.column(column)[rows], minlength=buckets
+                ).astype(np.int64)
+            user_ids = segment.column("user_id")[rows]
+            for bucket in np.unique(index):
+                users[bucket].update(np.unique(user_ids[index == bucket]).tolist())
+
+        return [
+            {
+                "bucket_start": _from_epoch(start_ts + i * step).isoformat(),
+                "spins": int(spins[i]),
+                "total_bet": int(bet[i]) / MINOR_UNITS,
+                "total_win": int(win[i]) / MINOR_UNITS,
+                "ggr": int(bet[i] - win[i]) / MINOR_UNITS,
+                "active_users": len(users[i]),
+            }
+            for i in range(buckets)
+            if spins[i]
+        ]
+
+    def iter_rows(
+        self,
+        after_id: int = 0,
+        user_id: Optional[int] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Декодированные строки по возрастанию id (для аудита и выгрузок)."""
+
+        start_ts = _epoch(start) if start else None
+        end_ts = _epoch(end) if end else None
+        for segment in self.segments:
+            if segment.meta["last_id"] <= after_id or not segment.overlaps(start_ts, end_ts):
+                continue
+            meta = segment.meta
+            ids = segment.column("id")
+            rows = segment.user_rows(user_id) if user_id is not None else np.arange(ids.shape[0])
+            rows = rows[ids[rows] > after_id]
+            if start_ts is not None or end_ts is not None:
+                rows = rows[_time_mask(segment.column("created_at")[rows], start_ts, end_ts)]
+            user_ids, created_at = segment.column("user_id"), segment.column("created_at")
+            bets, wins = segment.column("bet"), segment.column("win")
+            symbols, nonces = segment.column("symbols"), segment.column("nonce")
+            seeds, client_seeds = segment.column("seed"), segment.column("client_seed")
+            for row in rows.tolist():
+                seed_hash, server_seed = meta["seeds"][seeds[row]]
+                nonce = int(nonces[row])
+                yield {
+                    "spin_id": int(ids[row]),
+                    "user_id": int(user_ids[row]),
+                    "created_at": _from_epoch(created_at[row]).isoformat(),
+                    "bet": int(bets[row]) / MINOR_UNITS,
+                    "win": int(wins[row]) / MINOR_UNITS,
+                    "symbols": [
+                        meta["symbols"][code]
+                        for code in symbols[row].tolist()
+                        if code != NO_SYMBOL
+                    ],
+                    "server_seed_hash": seed_hash,
+                    "server_seed": server_seed,
+                    "client_seed": meta["client_seeds"][client_seeds[row]],
+                    "nonce": nonce if nonce >= 0 else None,
+                }
+
+
+def _drop_unfinished(db: Any, directory: str) -> None:
+    # Сегмент, чьи строки всё ещё в БД, остался от прогона, упавшего до DELETE
+    from models import Spin
+
+    for segment in ArchiveReader(directory).segments:
+        first_id = segment.meta["first_id"]
+        if db.query(Spin.id).filter(Spin.id == first_id).first() is not None:
+            shutil.rmtree(segment.path, ignore_errors=True)
+
+
+def archive_spins(
+    db: Any,
+    cutoff: datetime,
+    directory: str = ARCHIVE_DIR,
+    segment_rows: int = SEGMENT_ROWS,
+) -> List[Dict[str, Any]]:
+    """Переносит спины старше cutoff в сегменты, пока они есть.
+
+    Для каждого сегмента: запись во временный каталог, перечитывание
+    через mmap, сверка count/сумм с БД, атомарный rename и только потом
+    DELETE с проверкой rowcount в той же транзакции. Спины без created_at
+    (записанные до появления колонки) не архивируются: их возраст неизвестен.
+    """
+
+    from sqlalchemy import func
+
+    from models import Spin
+
+    os.makedirs(directory, exist_ok=True)
+    _drop_unfinished(db, directory)
+    old = Spin.created_at < cutoff
+    written = []
+
+    while True:
+        rows = db.query(Spin).filter(old).order_by(Spin.id).limit(segment_rows).all()
+        if not rows:
+            return written
+
+        columns, meta = build_segment(rows)
+        tmp = write_segment(directory, columns, meta)
+        segment = Segment(tmp)
+        if not segment.verify():
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise RuntimeError(f"Segment {tmp} failed read-back verification")
+
+        in_range = (Spin.id >= meta["first_id"], Spin.id <= meta["last_id"], old)
+        count, id_sum, bet_sum, win_sum = (
+            db.query(
+                func.count(Spin.id),
+                func.coalesce(func.sum(Spin.id), 0),
+                func.coalesce(func.sum(Spin.bet), 0.0),
+                func.coalesce(func.sum(Spin.win), 0.0),
+            )
+            .filter(*in_range)
+            .one()
+        )
+        checksum = meta["checksum"]
+        # Суммы float в БД против копеек в архиве: допускаем только ошибку округления
+        tolerance = 0.5 * count + 1
+        if (
+            count != checksum["count"]
+            or int(id_sum) != checksum["id_sum"]
+            or abs(float(bet_sum) * MINOR_UNITS - checksum["bet_sum"]) > tolerance
+            or abs(float(win_sum) * MINOR_UNITS - checksum["win_sum"]) > tolerance
+        ):
+            shutil.rmtree(tmp, ignore_errors=True)
+            db.rollback()
+            raise RuntimeError(
+                f"Checksum mismatch for spins {meta['first_id']}..{meta['last_id']}"
+            )
+
+        final = os.path.join(directory, os.path.basename(tmp)[len(".tmp-"):])
+        os.rename(tmp, final)
+
+        deleted = db.query(Spin).filter(*in_range).delete(synchronize_session=False)
+        if deleted != checksum["count"]:
+            db.rollback()
+            shutil.rmtree(final, ignore_errors=True)
+            raise RuntimeError(
+                f"Deleted {deleted} rows, archived {checksum['count']}; rolled back"
+            )
+        db.commit()
+        db.expunge_all()
+        written.append({"segment": final, **checksum})
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default=ARCHIVE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive_cmd = commands.add_parser("archive")
+    archive_cmd.add_argument("--older-than-days", type=int, default=90)
+    archive_cmd.add_argument("--segment-rows", type=int, default=SEGMENT_ROWS)
+
+    user_cmd = commands.add_parser("user")
+    user_cmd.add_argument("user_id", type=int)
+    user_cmd.add_argument("--start", type=_parse_date)
+    user_cmd.add_argument("--end", type=_parse_date)
+
+    period_cmd = commands.add_parser("period")
+    period_cmd.add_argument("--start", type=_parse_date, required=True)
+    period_cmd.add_argument("--end", type=_parse_date, required=True)
+    period_cmd.add_argument("--group", choices=("hour", "day"), default="day")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "archive":
+        from database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            result = archive_spins(
+                db,
+                datetime.utcnow() - timedelta(days=args.older_than_days),
+                args.dir,
+                args.segment_rows,
+            )
+        finally:
+            db.close()
+    elif args.command == "user":
+        result = ArchiveReader(args.dir).user_summary(args.user_id, args.start, args.end)
+    else:
+        result = ArchiveReader(args.dir).period_summary(args.start, args.end, args.group)
+
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,609 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from bonus_rules import (
+    MAX_TRIGGERS_PER_SPIN,
+    SESSION_GAP_SECONDS,
+    BonusRule,
+    is_small_win,
+    load_bonus_rules,
+)
+from database import SessionLocal
+from games import DEFAULT_GAME_ID
+from models import BonusMeter
+
+
+logger = logging.getLogger(__name__)
+
+RedisLike = Any
+
+STATE_TTL_SECONDS = int(os.getenv("BONUS_STATE_TTL_SECONDS", str(30 * 24 * 3600)))
+FLUSH_INTERVAL_SECONDS = float(os.getenv("BONUS_FLUSH_INTERVAL_SECONDS", "30"))
+FLUSH_BATCH_SIZE = int(os.getenv("BONUS_FLUSH_BATCH_SIZE", "500"))
+
+STATE_KEY = "bonus:{user_id}"
+# Очередь фриспинов игры: по элементу на спин, у каждого своя ставка и множитель
+FREE_SPINS_KEY = "bonus:{user_id}:free:{game_id}"
+# Сколько фриспинов уже дала текущая серия (для max_total)
+FREE_SERIES_KEY = "bonus:{user_id}:free:{game_id}:given"
+# Общая очередь без игры; остаток доигрывается в игре по умолчанию
+LEGACY_FREE_SPINS_KEY = "bonus:{user_id}:free"
+DIRTY_KEY = "bonus:dirty"
+
+
+class BonusAward:
+    __slots__ = ("rule", "free_spins", "bet", "game_id", "multiplier")
+
+    def __init__(
+        self,
+        rule: str,
+        free_spins: int,
+        bet: float,
+        game_id: str = DEFAULT_GAME_ID,
+        multiplier: float = 1.0,
+    ) -> None:
+        self.rule = rule
+        self.free_spins = free_spins
+        self.bet = bet
+        self.game_id = game_id
+        self.multiplier = multiplier
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rule": self.rule,
+            "free_spins": self.free_spins,
+            "bet": self.bet,
+            "game_id": self.game_id,
+            "multiplier": self.multiplier,
+        }
+
+
+# Обновляет счётчики за один вызов и возвращает состояние целиком.
+# time_meter хранится в секундах (time_seconds), в БД пишется в минутах.
+_RECORD_LUA = """
+local existed = redis.call('EXISTS', KEYS[1])
+local now = tonumber(ARGV[3])
+local last = tonumber(redis.call('HGET', KEYS[1], 'last_spin_ts') or '0')
+if last > 0 and now > last and now - last <= tonumber(ARGV[4]) then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'time_seconds', now - last)
+end
+redis.call('HSET', KEYS[1], 'last_spin_ts', ARGV[3])
+redis.call('HINCRBYFLOAT', KEYS[1], 'bet_total_meter', ARGV[1])
+if ARGV[2] == '1' then
+    redis.call('HINCRBY', KEYS[1], 'small_win_meter', 1)
+end
+-- Окна средних ставок правил без фиксированной ставки фриспина
+for i = 7, #ARGV do
+    redis.call('HINCRBYFLOAT', KEYS[1], 'stake:' .. ARGV[i], ARGV[1])
+    redis.call('HINCRBY', KEYS[1], 'spins:' .. ARGV[i], 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('SADD', KEYS[2], ARGV[6])
+local state = redis.call('HGETALL', KEYS[1])
+table.insert(state, 'existed')
+table.insert(state, existed)
+return state
+"""
+
+# KEYS[1] — очередь игры; для игры по умолчанию ещё старая общая очередь
+# и хэш состояния со старым счётчиком free_spins.
+_TAKE_FREE_SPIN_LUA = """
+for i = 1, math.min(#KEYS, 2) do
+    local entry = redis.call('LPOP', KEYS[i])
+    if entry then
+        return entry
+    end
+end
+if #KEYS < 3 then
+    return false
+end
+-- Фриспины, начисленные до очереди: общий счётчик и одна ставка
+local left = tonumber(redis.call('HGET', KEYS[3], 'free_spins') or '0')
+if left <= 0 then
+    return false
+end
+redis.call('HINCRBY', KEYS[3], 'free_spins', -1)
+return redis.call('HGET', KEYS[3], 'free_spin_bet')
+"""
+
+# Начисление с лимитом серии: ARGV = элемент, число, max_total (0 — без
+# лимита), '1' для повторного срабатывания внутри серии, TTL.
+_AWARD_FREE_SPINS_LUA = """
+local given = 0
+if ARGV[4] == '1' then
+    given = tonumber(redis.call('GET', KEYS[2]) or '0')
+end
+local count = tonumber(ARGV[2])
+local cap = tonumber(ARGV[3])
+if cap > 0 then
+    count = math.min(count, cap - given)
+end
+if count <= 0 then
+    return 0
+end
+for i = 1, count do
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('SET', KEYS[2], given + count, 'EX', ARGV[5])
+return count
+"""
+
+
+def _meter_value(state: Dict[str, float], meter: str) -> float:
+    if meter == "time_meter":
+        return state.get("time_seconds", 0.0) / 60.0
+    return state.get(meter, 0.0)
+
+
+def _meter_field(meter: str) -> str:
+    return "time_seconds" if meter == "time_meter" else meter
+
+
+def _meter_scale(meter: str) -> float:
+    return 60.0 if meter == "time_meter" else 1.0
+
+
+def _free_spin_entry(award: "BonusAward") -> str:
+    return json.dumps(
+        {"bet": award.bet, "rule": award.rule, "multiplier": award.multiplier}
+    )
+
+
+def _free_spin(raw: Any, game_id: str) -> "BonusAward":
+    """Один фриспин из очереди; старые записи хранили только ставку числом."""
+
+    value = json.loads(raw)
+    if not isinstance(value, dict):
+        return BonusAward("legacy", 1, float(value), game_id)
+    return BonusAward(
+        value.get("rule", "legacy"),
+        1,
+        float(value["bet"]),
+        game_id,
+        float(value.get("multiplier", 1.0)),
+    )
+
+
+def _meter_delta(state: Dict[str, float], synced: Dict[str, float]) -> Dict[str, float]:
+    """Прирост счётчиков с последней записи в bonus_meters (время — в целых минутах)."""
+
+    return {
+        "small_win_meter": int(state.get("small_win_meter", 0))
+        - int(synced.get("small_win_meter", 0)),
+        "bet_total_meter": state.get("bet_total_meter", 0.0)
+        - synced.get("bet_total_meter", 0.0),
+        "time_meter": int(state.get("time_seconds", 0.0) // 60)
+        - int(synced.get("time_seconds", 0.0) // 60),
+    }
+
+
+class BonusEngine:
+    """Горячие бонусные счётчики в Redis (или в памяти процесса без Redis).
+
+    Спин не пишет в БД ни одной лишней строки: изменённые счётчики
+    помечаются «грязными» и сбрасываются в bonus_meters пачками (flush).
+    bonus_meters живёт в основной БД (туда пишет flush), поэтому и
+    читается через SessionLocal, а не через сессию шарда игрока.
+
+    Без Redis у каждого процесса своё состояние: при первом обращении оно
+    подтягивается из bonus_meters, а flush прибавляет к строке только
+    прирост с прошлой записи — воркеры не затирают счётчики друг друга.
+    Триггеры при этом видят лишь долю процесса; точные общие счётчики
+    на нескольких воркерах — только с Redis.
+    """
+
+    def __init__(self, rules: List[BonusRule]) -> None:
+        self.rules = rules
+        self._scripts: Dict[str, Any] = {}
+        self._local: Dict[int, Dict[str, float]] = {}
+        self._local_dirty: set = set()
+        # Значения, уже учтённые в bonus_meters, — база для прироста при flush
+        self._local_synced: Dict[int, Dict[str, float]] = {}
+        self._local_free: Dict[Tuple[int, str], Deque[BonusAward]] = {}
+        self._local_series: Dict[Tuple[int, str], int] = {}
+        self._local_lock = threading.Lock()
+
+    def _script(self, redis_client: RedisLike, name: str, source: str):
+        script = self._scripts.get(name)
+        if script is None:
+            script = redis_client.register_script(source)
+            self._scripts[name] = script
+        return script
+
+    def _window_rules(self) -> List[str]:
+        return [rule.name for rule in self.rules if rule.stake is None]
+
+    def _check_triggers(
+        self, state: Dict[str, float], game_id: str = DEFAULT_GAME_ID
+    ) -> List[BonusAward]:
+        """Срабатывания правил; state меняется на месте (счётчики и окна ставок).
+
+        Не больше MAX_TRIGGERS_PER_SPIN наград на правило за спин — остаток
+        счётчика сверх лимита сгорает, а ставка фриспинов не зависит от
+        ставки спина, на котором сработал порог. Фриспины достаются игре
+        спина, на котором сработал порог, без множителя её фичи.
+        """
+
+        awards: List[BonusAward] = []
+        for rule in self.rules:
+            times = int(_meter_value(state, rule.meter) // rule.threshold)
+            if times <= 0:
+                continue
+            stake_field, spins_field = f"stake:{rule.name}", f"spins:{rule.name}"
+            stake = rule.award_stake(state.get(stake_field, 0.0), state.get(spins_field, 0.0))
+            state[stake_field] = state[spins_field] = 0.0
+            field = _meter_field(rule.meter)
+            state[field] = state.get(field, 0.0) - (
+                rule.threshold * _meter_scale(rule.meter) * times
+            )
+            if stake > 0:
+                awards.append(
+                    BonusAward(
+                        rule.name,
+                        rule.free_spins * min(times, MAX_TRIGGERS_PER_SPIN),
+                        stake,
+                        game_id,
+                    )
+                )
+        return awards
+
+    def _push_free_spins(
+        self,
+        redis_client: Optional[RedisLike],
+        user_id: int,
+        award: BonusAward,
+        max_total: int = 0,
+        retrigger: bool = False,
+    ) -> int:
+        """Кладёт фриспины награды в очередь её игры; возвращает, сколько вошло."""
+
+        if redis_client is None:
+            slot = (user_id, award.game_id)
+            with self._local_lock:
+                given = self._local_series.get(slot, 0) if retrigger else 0
+                count = award.free_spins
+                if max_total:
+                    count = min(count, max_total - given)
+                if count <= 0:
+                    return 0
+                queue = self._local_free.setdefault(slot, deque())
+                queue.extend(
+                    BonusAward(award.rule, 1, award.bet, award.game_id, award.multiplier)
+                    for _ in range(count)
+                )
+                self._local_series[slot] = given + count
+            return count
+
+        script = self._script(redis_client, "award", _AWARD_FREE_SPINS_LUA)
+        return int(
+            script(
+                keys=[
+                    FREE_SPINS_KEY.format(user_id=user_id, game_id=award.game_id),
+                    FREE_SERIES_KEY.format(user_id=user_id, game_id=award.game_id),
+                ],
+                args=[
+                    _free_spin_entry(award),
+                    award.free_spins,
+                    max_total,
+                    "1" if retrigger else "0",
+                    STATE_TTL_SECONDS,
+                ],
+            )
+        )
+
+    def take_free_spin(
+        self, redis_client: Optional[RedisLike], user_id: int, game_id: str
+    ) -> Optional[BonusAward]:
+        """Списывает один фриспин игры. Возвращает его (ставка, множитель) или None."""
+
+        if redis_client is not None:
+            keys = [FREE_SPINS_KEY.format(user_id=user_id, game_id=game_id)]
+            if game_id == DEFAULT_GAME_ID:
+                keys += [
+                    LEGACY_FREE_SPINS_KEY.format(user_id=user_id),
+                    STATE_KEY.format(user_id=user_id),
+                ]
+            try:
+                script = self._script(redis_client, "take", _TAKE_FREE_SPIN_LUA)
+                raw = script(keys=keys)
+                return _free_spin(raw, game_id) if raw is not None else None
+            except Exception as exc:  # pragma: no cover
+                logger.warning("Failed to take free spin: %s", exc)
+                return None
+
+        with self._local_lock:
+            queue = self._local_free.get((user_id, game_id))
+            return queue.popleft() if queue else None
+
+    def return_free_spin(
+        self, redis_client: Optional[RedisLike], user_id: int, spin: BonusAward
+    ) -> None:
+        """Возвращает фриспин в начало очереди, если спин не удалось закоммитить."""
+
+        if redis_client is not None:
+            try:
+                redis_client.lpush(
+                    FREE_SPINS_KEY.format(user_id=user_id, game_id=spin.game_id),
+                    _free_spin_entry(spin),
+                )
+            except Exception as exc:  # pragma: no cover
+                logger.warning("Failed to return free spin: %s", exc)
+            return
+
+        with self._local_lock:
+            self._local_free.setdefault((user_id, spin.game_id), deque()).appendleft(spin)
+
+    def award_free_spins(
+        self,
+        redis_client: Optional[RedisLike],
+        user_id: int,
+        game_id: str,
+        free_spins: int,
+        bet: float,
+        multiplier: float = 1.0,
+        max_total: int = 0,
+        retrigger: bool = False,
+        rule: str = "scatter",
+    ) -> List[BonusAward]:
+        """Начисляет фриспины из фич игры (скаттеры) в очередь этой игры.
+
+        retrigger — скаттеры выпали на фриспине: начисление продолжает
+        серию, и вместе с ним серия не превышает max_total (0 — без лимита).
+        """
+
+        if free_spins <= 0:
+            return []
+        award = BonusAward(rule, free_spins, bet, game_id, multiplier)
+        try:
+            award.free_spins = self._push_free_spins(
+                redis_client, user_id, award, max_total, retrigger
+            )
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Failed to award free spins: %s", exc)
+            return []
+        return [award] if award.free_spins else []
+
+    def record_spin(
+        self,
+        redis_client: Optional[RedisLike],
+        user_id: int,
+        bet: float,
+        win: float,
+        now: Optional[float] = None,
+        game_id: str = DEFAULT_GAME_ID,
+    ) -> List[BonusAward]:
+        """Обновляет счётчики после платного спина и начисляет фриспины в game_id."""
+
+        now = now if now is not None else time.time()
+        small_win = is_small_win(bet, win)
+
+        if redis_client is None:
+            return self._record_local(user_id, bet, small_win, now, game_id)
+
+        key = STATE_KEY.format(user_id=user_id)
+        try:
+            script = self._script(redis_client, "record", _RECORD_LUA)
+            raw = script(
+                keys=[key, DIRTY_KEY],
+                args=[
+                    bet,
+                    "1" if small_win else "0",
+                    now,
+                    SESSION_GAP_SECONDS,
+                    STATE_TTL_SECONDS,
+                    user_id,
+                    *self._window_rules(),
+                ],
+            )
+            state = {
+                raw[i]: float(raw[i + 1]) for i in range(0, len(raw), 2)
+            }
+            if not state.pop("existed", 1):
+                state = self._seed_from_db(redis_client, user_id, state)
+
+            before = dict(state)
+            awards = self._check_triggers(state, game_id)
+            if state != before:
+                pipe = redis_client.pipeline(transaction=False)
+                for field, value in state.items():
+                    if value == before.get(field, 0.0):
+                        continue
+                    if field.startswith(("stake:", "spins:")):
+                        # Окно начинается заново; spins должен остаться целым для HINCRBY
+                        pipe.hset(key, field, 0)
+                    else:
+                        pipe.hincrbyfloat(key, field, value - before.get(field, 0.0))
+                pipe.execute()
+            for award in awards:
+                self._push_free_spins(redis_client, user_id, award)
+            return awards
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Failed to update bonus meters: %s", exc)
+            return []
+
+    @staticmethod
+    def _load_meter(user_id: int) -> Optional[Dict[str, float]]:
+        """Последний flush счётчиков игрока из основной БД."""
+
+        db = SessionLocal()
+        try:
+            row = db.query(BonusMeter).filter(BonusMeter.user_id == user_id).first()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        return {
+            "small_win_meter": float(row.small_win_meter or 0),
+            "bet_total_meter": float(row.bet_total_meter or 0.0),
+            "time_seconds": float(row.time_meter or 0) * 60.0,
+        }
+
+    def _seed_from_db(
+        self,
+        redis_client: RedisLike,
+        user_id: int,
+        state: Dict[str, float],
+    ) -> Dict[str, float]:
+        # Redis потерял состояние (рестарт/TTL) — подтягиваем последний flush
+        seeded = self._load_meter(user_id)
+        if seeded is None:
+            return state
+
+        pipe = redis_client.pipeline(transaction=False)
+        for field, value in seeded.items():
+            if value:
+                pipe.hincrbyfloat(STATE_KEY.format(user_id=user_id), field, value)
+                state[field] = state.get(field, 0.0) + value
+        pipe.execute()
+        return state
+
+    def _local_state(self, user_id: int) -> Dict[str, float]:
+        """Состояние игрока без Redis; при первом обращении — из bonus_meters."""
+
+        state = self._local.get(user_id)
+        if state is not None:
+            return state
+        try:
+            seeded = self._load_meter(user_id) or {}
+        except Exception as exc:  # pragma: no cover
+            # Прирост всё равно допишется к строке при flush, а не затрёт её
+            logger.warning("Failed to load bonus meters for user %s: %s", user_id, exc)
+            seeded = {}
+        with self._local_lock:
+            state = self._local.get(user_id)
+            if state is None:
+                state = self._local[user_id] = dict(seeded)
+                self._local_synced[user_id] = dict(seeded)
+        return state
+
+    def _record_local(
+        self, user_id: int, bet: float, small_win: bool, now: float, game_id: str
+    ) -> List[BonusAward]:
+        state = self._local_state(user_id)
+        with self._local_lock:
+            last = state.get("last_spin_ts", 0.0)
+            if last > 0 and 0 < now - last <= SESSION_GAP_SECONDS:
+                state["time_seconds"] = state.get("time_seconds", 0.0) + (now - last)
+            state["last_spin_ts"] = now
+            state["bet_total_meter"] = state.get("bet_total_meter", 0.0) + bet
+            if small_win:
+                state["small_win_meter"] = state.get("small_win_meter", 0.0) + 1
+            for name in self._window_rules():
+                state[f"stake:{name}"] = state.get(f"stake:{name}", 0.0) + bet
+                state[f"spins:{name}"] = state.get(f"spins:{name}", 0.0) + 1
+            awards = self._check_triggers(state, game_id)
+            self._local_dirty.add(user_id)
+        for award in awards:
+            self._push_free_spins(None, user_id, award)
+        return awards
+
+    def _pop_dirty(
+        self, redis_client: RedisLike, batch_size: int
+    ) -> Dict[int, Dict[str, float]]:
+        user_ids = [int(uid) for uid in redis_client.spop(DIRTY_KEY, batch_size) or []]
+        if not user_ids:
+            return {}
+        pipe = redis_client.pipeline(transaction=False)
+        for uid in user_ids:
+            pipe.hgetall(STATE_KEY.format(user_id=uid))
+        return {
+            uid: {field: float(value) for field, value in raw.items()}
+            for uid, raw in zip(user_ids, pipe.execute())
+        }
+
+    def _mark_dirty(self, redis_client: Optional[RedisLike], user_ids: List[int]) -> None:
+        if not user_ids:
+            return
+        if redis_client is None:
+            with self._local_lock:
+                self._local_dirty.update(user_ids)
+            return
+        try:
+            redis_client.sadd(DIRTY_KEY, *user_ids)
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Failed to re-queue dirty bonus meters: %s", exc)
+
+    def flush(
+        self,
+        db: Session,
+        redis_client: Optional[RedisLike],
+        batch_size: int = FLUSH_BATCH_SIZE,
+    ) -> int:
+        """Пишет пачку изменённых счётчиков в bonus_meters одной транзакцией."""
+
+        if redis_client is None:
+            return self._flush_local(db, batch_size)
+
+        states = self._pop_dirty(redis_client, batch_size)
+        if not states:
+            return 0
+
+        try:
+            rows = {
+                row.user_id: row
+                for row in db.query(BonusMeter)
+                .filter(BonusMeter.user_id.in_(list(states)))
+                .all()
+            }
+            for user_id, state in states.items():
+                row = rows.get(user_id)
+                if row is None:
+                    row = BonusMeter(user_id=user_id)
+                    db.add(row)
+                row.small_win_meter = int(state.get("small_win_meter", 0))
+                row.bet_total_meter = float(state.get("bet_total_meter", 0.0))
+                row.time_meter = int(state.get("time_seconds", 0.0) // 60)
+            db.commit()
+        except Exception:
+            db.rollback()
+            self._mark_dirty(redis_client, list(states))
+            raise
+
+        return len(states)
+
+    def _flush_local(self, db: Session, batch_size: int) -> int:
+        with self._local_lock:
+            user_ids = list(self._local_dirty)[:batch_size]
+            self._local_dirty.difference_update(user_ids)
+            states = {uid: dict(self._local.get(uid, {})) for uid in user_ids}
+        if not states:
+            return 0
+
+        try:
+            rows = {
+                row.user_id: row
+                for row in db.query(BonusMeter)
+                .filter(BonusMeter.user_id.in_(list(states)))
+                .all()
+            }
+            for user_id, state in states.items():
+                delta = _meter_delta(state, self._local_synced.get(user_id, {}))
+                row = rows.get(user_id)
+                if row is None:
+                    row = BonusMeter(user_id=user_id)
+                    db.add(row)
+                row.small_win_meter = int(row.small_win_meter or 0) + delta["small_win_meter"]
+                row.bet_total_meter = float(row.bet_total_meter or 0.0) + delta["bet_total_meter"]
+                row.time_meter = int(row.time_meter or 0) + delta["time_meter"]
+            db.commit()
+        except Exception:
+            db.rollback()
+            self._mark_dirty(None, user_ids)
+            raise
+
+        with self._local_lock:
+            self._local_synced.update(states)
+        return len(states)
+
+
+bonus_engine = BonusEngine(load_bonus_rules())
@@ -0,0 +1,90 @@
+"""Правила бонусных триггеров. Модуль без зависимостей от БД — его
+использует и живой BonusEngine, и simulator.py."""
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+
+METER_FIELDS = ("small_win_meter", "bet_total_meter", "time_meter")
+
+# Выигрыш больше нуля, но не больше bet * SMALL_WIN_MAX_MULTIPLIER — «мелкий»
+SMALL_WIN_MAX_MULTIPLIER = float(os.getenv("BONUS_SMALL_WIN_MAX_MULTIPLIER", "3"))
+# Пауза между спинами дольше этого не засчитывается в time_meter
+SESSION_GAP_SECONDS = int(os.getenv("BONUS_SESSION_GAP_SECONDS", "300"))
+# Сколько раз правило может сработать за один спин; накопленное сверх
+# этого сгорает, иначе одна крупная ставка давала бы пачку наград
+MAX_TRIGGERS_PER_SPIN = int(os.getenv("BONUS_MAX_TRIGGERS_PER_SPIN", "1"))
+
+
+class BonusRule:
+    """Когда meter достигает threshold — начисляем free_spins фриспинов.
+
+    Ставка фриспинов — фиксированная stake или, если она не задана, средняя
+    ставка платных спинов с прошлого срабатывания правила. Ставку спина,
+    на котором сработал триггер, брать нельзя: её можно поднять ровно
+    перед порогом. Для bet_total_meter ставка должна быть фиксированной —
+    сам счётчик уже растёт со ставкой.
+    """
+
+    __slots__ = ("name", "meter", "threshold", "free_spins", "stake")
+
+    def __init__(
+        self,
+        name: str,
+        meter: str,
+        threshold: float,
+        free_spins: int,
+        stake: Optional[float] = None,
+    ) -> None:
+        if meter not in METER_FIELDS:
+            raise ValueError(f"Unknown bonus meter: {meter}")
+        if threshold <= 0 or free_spins <= 0:
+            raise ValueError("Bonus threshold and free_spins must be positive")
+        if stake is not None and stake <= 0:
+            raise ValueError("Bonus stake must be positive")
+        if meter == "bet_total_meter" and stake is None:
+            raise ValueError(f"Bonus rule {name}: bet_total_meter needs a fixed stake")
+        self.name = name
+        self.meter = meter
+        self.threshold = float(threshold)
+        self.free_spins = int(free_spins)
+        self.stake = float(stake) if stake is not None else None
+
+    def award_stake(self, window_stake: float, window_spins: float) -> float:
+        if self.stake is not None:
+            return self.stake
+        return window_stake / window_spins if window_spins > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "meter": self.meter,
+            "threshold": self.threshold,
+            "free_spins": self.free_spins,
+            "stake": self.stake,
+        }
+
+
+DEFAULT_BONUS_RULES = [
+    {"name": "small_wins", "meter": "small_win_meter", "threshold": 25, "free_spins": 5},
+    {"name": "turnover", "meter": "bet_total_meter", "threshold": 500, "free_spins": 10, "stake": 1.0},
+    {"name": "loyalty", "meter": "time_meter", "threshold": 60, "free_spins": 5},
+]
+
+
+def load_bonus_rules(raw: Optional[str] = None) -> List[BonusRule]:
+    """Правила из BONUS_RULES (JSON-список) или DEFAULT_BONUS_RULES."""
+
+    raw = raw if raw is not None else os.getenv("BONUS_RULES")
+    items = json.loads(raw) if raw else DEFAULT_BONUS_RULES
+    return [
+        BonusRule(
+            item["name"], item["meter"], item["threshold"], item["free_spins"], item.get("stake")
+        )
+        for item in items
+    ]
+
+
+def is_small_win(bet: float, win: float) -> bool:
+    return 0 < win <= bet * SMALL_WIN_MAX_MULTIPLIER
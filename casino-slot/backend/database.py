@@ -1,18 +1,75 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./slot.db")
+# Реплика для read-only эндпоинтов (история, статистика, отчёты).
+# Без неё чтения идут в primary, но через отдельный пул — чтобы спины
+# не стояли в очереди за тяжёлыми отчётами.
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL, connect_args={"check_same_thread": False}
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, "1" if default else "0").lower() in ("1", "true", "yes", "on")
+
+
+def _set_sqlite_pragmas(dbapi_connection, _connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={os.getenv('SQLITE_JOURNAL_MODE', 'WAL')}")
+    cursor.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={_env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)}")
+    cursor.execute(f"PRAGMA cache_size=-{_env_int('SQLITE_CACHE_KB', 20000)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def build_engine(url: str, prefix: str = "DB", read_only: bool = False):
+    """Создаёт engine с настройками пула из переменных окружения.
+
+    prefix позволяет настраивать пулы независимо: DB_POOL_SIZE для
+    primary, DB_READ_POOL_SIZE для чтений и т.д.
+    """
+
+    if url.startswith("sqlite"):
+        sqlite_engine = create_engine(url, connect_args={"check_same_thread": False})
+        if ":memory:" not in url:
+            event.listen(sqlite_engine, "connect", _set_sqlite_pragmas)
+        return sqlite_engine
+
+    options = []
+    statement_timeout = _env_int(f"{prefix}_STATEMENT_TIMEOUT_MS", 0)
+    if statement_timeout > 0:
+        options.append(f"-c statement_timeout={statement_timeout}")
+    if read_only:
+        options.append("-c default_transaction_read_only=on")
+
+    return create_engine(
+        url,
+        pool_size=_env_int(f"{prefix}_POOL_SIZE", 10),
+        max_overflow=_env_int(f"{prefix}_MAX_OVERFLOW", 10),
+        pool_timeout=_env_int(f"{prefix}_POOL_TIMEOUT", 30),
+        pool_recycle=_env_int(f"{prefix}_POOL_RECYCLE", 1800),
+        pool_pre_ping=_env_bool(f"{prefix}_POOL_PRE_PING", True),
+        connect_args={"options": " ".join(options)} if options else {},
     )
+
+
+engine = build_engine(DATABASE_URL)
+
+if DATABASE_REPLICA_URL:
+    read_engine = build_engine(DATABASE_REPLICA_URL, "DB_READ", read_only=True)
+elif DATABASE_URL.startswith("sqlite"):
+    read_engine = engine
 else:
-    engine = create_engine(DATABASE_URL)
+    read_engine = build_engine(DATABASE_URL, "DB_READ", read_only=True)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
 def get_db():
@@ -20,4 +77,12 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import time
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Spin
+
+
+logger = logging.getLogger(__name__)
+
+RedisLike = Any
+
+STATS_KEY = "exp:{tag}"
+FIRST_SEEN_KEY = "exp:{tag}:first_seen"
+RETENTION_DAYS = (1, 7, 30)
+
+
+def arm_tag(experiment: str, arm: str) -> str:
+    return f"{experiment}:{arm}"
+
+
+class ExperimentConfig:
+    """Активный эксперимент: плечи с весами и детерминированное распределение.
+
+    Плечо зависит только от sha256(salt:user_id), поэтому игрок всегда
+    попадает в одно и то же плечо на любом воркере без обращения к БД/Redis.
+    """
+
+    __slots__ = ("name", "salt", "arms", "_cumulative", "_total")
+
+    def __init__(self, name: str, salt: str, arms: Sequence[Dict[str, Any]]) -> None:
+        self.name = name
+        self.salt = salt
+        self.arms: Tuple[str, ...] = tuple(str(arm["name"]) for arm in arms)
+        cumulative: List[int] = []
+        total = 0
+        for arm in arms:
+            total += max(int(arm.get("weight", 1)), 0)
+            cumulative.append(total)
+        if total <= 0:
+            raise ValueError(f"Experiment {name} has no arm with positive weight")
+        self._cumulative = tuple(cumulative)
+        self._total = total
+
+    def assign(self, user_id: int) -> str:
+        digest = hashlib.sha256(f"{self.salt}:{user_id}".encode("utf-8")).digest()
+        point = int.from_bytes(digest[:8], byteorder="big") % self._total
+        return self.arms[bisect_right(self._cumulative, point)]
+
+    def tag(self, user_id: int) -> str:
+        return arm_tag(self.name, self.assign(user_id))
+
+
+# Один вызов на спин: счётчики плеча и удержание по дню первого спина.
+# ARGV: bet, win, номер дня (UTC), user_id, дни удержания...
+_RECORD_LUA = """
+redis.call('HINCRBY', KEYS[1], 'spins', 1)
+redis.call('HINCRBYFLOAT', KEYS[1], 'total_bet', ARGV[1])
+redis.call('HINCRBYFLOAT', KEYS[1], 'total_win', ARGV[2])
+if tonumber(ARGV[2]) > 0 then
+    redis.call('HINCRBY', KEYS[1], 'hits', 1)
+end
+local day = tonumber(ARGV[3])
+local first = redis.call('HGET', KEYS[2], ARGV[4])
+if not first then
+    redis.call('HSET', KEYS[2], ARGV[4], day)
+    redis.call('HINCRBY', KEYS[1], 'users', 1)
+    redis.call('HINCRBY', KEYS[1], 'cohort:' .. day, 1)
+    return 0
+end
+local offset = day - tonumber(first)
+for i = 5, #ARGV do
+    if offset == tonumber(ARGV[i]) then
+        if redis.call('SADD', KEYS[1] .. ':d' .. ARGV[i], ARGV[4]) == 1 then
+            redis.call('HINCRBY', KEYS[1], 'retained_d' .. ARGV[i], 1)
+        end
+    end
+end
+return 0
+"""
+
+_scripts: Dict[str, Any] = {}
+
+
+def record_arm_spin(
+    redis_client: Optional[RedisLike],
+    tag: str,
+    user_id: int,
+    bet: float,
+    win: float,
+    now: Optional[float] = None,
+) -> None:
+    """Инкрементальная статистика плеча; вызывается после коммита спина."""
+
+    if redis_client is None:
+        return
+    day = int((now if now is not None else time.time()) // 86400)
+    try:
+        script = _scripts.get("record")
+        if script is None:
+            script = _scripts["record"] = redis_client.register_script(_RECORD_LUA)
+        script(
+            keys=[STATS_KEY.format(tag=tag), FIRST_SEEN_KEY.format(tag=tag)],
+            args=[bet, win, day, user_id, *RETENTION_DAYS],
+        )
+    except Exception as exc:  # pragma: no cover
+        logger.warning("Failed to record experiment stats: %s", exc)
+
+
+def _summary(spins: int, total_bet: float, total_win: float, hits: int) -> Dict[str, Any]:
+    return {
+        "spins": spins,
+        "total_bet": total_bet,
+        "total_win": total_win,
+        "rtp": total_win / total_bet if total_bet else 0.0,
+        "hit_rate": hits / spins if spins else 0.0,
+    }
+
+
+def arm_stats(
+    redis_client: Optional[RedisLike],
+    db: Session,
+    experiment: str,
+    arms: Sequence[str],
+    now: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Статистика по плечам из Redis; без Redis — RTP и hit rate из spins.arm."""
+
+    today = int((now if now is not None else time.time()) // 86400)
+    result: Dict[str, Any] = {}
+
+    if redis_client is not None:
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for arm in arms:
+                pipe.hgetall(STATS_KEY.format(tag=arm_tag(experiment, arm)))
+            raw_stats = pipe.execute()
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Failed to read experiment stats: %s", exc)
+            raw_stats = None
+
+        if raw_stats is not None:
+            for arm, raw in zip(arms, raw_stats):
+                stats = _summary(
+                    int(raw.get("spins", 0)),
+                    float(raw.get("total_bet", 0.0)),
+                    float(raw.get("total_win", 0.0)),
+                    int(raw.get("hits", 0)),
+                )
+                cohorts = {
+                    int(field.split(":", 1)[1]): int(value)
+                    for field, value in raw.items()
+                    if field.startswith("cohort:")
+                }
+                stats["users"] = int(raw.get("users", 0))
+                retention = {}
+                for days in RETENTION_DAYS:
+                    # В знаменателе только игроки, у которых прошло уже N дней
+                    eligible = sum(n for day, n in cohorts.items() if day <= today - days)
+                    retained = int(raw.get(f"retained_d{days}", 0))
+                    retention[f"d{days}"] = retained / eligible if eligible else None
+                stats["retention"] = retention
+                result[arm] = stats
+            return {"experiment": experiment, "source": "redis", "arms": result}
+
+    tags = [arm_tag(experiment, arm) for arm in arms]
+    rows = (
+        db.query(
+            Spin.arm,
+            func.count(Spin.id),
+            func.coalesce(func.sum(Spin.bet), 0.0),
+            func.coalesce(func.sum(Spin.win), 0.0),
+            func.count(Spin.id).filter(Spin.win > 0),
+            func.count(func.distinct(Spin.user_id)),
+        )
+        .filter(Spin.arm.in_(tags))
+        .group_by(Spin.arm)
+        .all()
+    )
+    by_tag = {row[0]: row for row in rows}
+    for arm, tag in zip(arms, tags):
+        _, spins, total_bet, total_win, hits, users = by_tag.get(
+            tag, (tag, 0, 0.0, 0.0, 0, 0)
+        )
+        stats = _summary(int(spins), float(total_bet), float(total_win), int(hits))
+        stats["users"] = int(users)
+        result[arm] = stats
+    return {"experiment": experiment, "source": "db", "arms": result}
@@ -0,0 +1,330 @@
+"""Потоковая выгрузка спинов с provably-fair данными для регулятора.
+
+    python export.py --start 2026-01-01 --end 2026-02-01 --out spins.ndjson.gz
+    python export.py --start 2026-01-01 --end 2026-02-01 --format csv --out spins.csv.gz
+    python export.py ... --source all --archive-dir ./archive   # БД + архивные сегменты
+
+Строки читаются серверным курсором кусками по EXPORT_CHUNK_ROWS и сразу
+кодируются и сжимаются, поэтому память не зависит от объёма выгрузки.
+Чтение идёт с реплики (или шардовых реплик) через отдельный пул EXPORT,
+пул спинов не задействован. Выгрузка возобновляема: в HTTP — параметром
+after_id (последний полученный spin_id), в CLI — по файлу <out>.offset;
+gzip пишется отдельными членами на каждый чекпойнт, так что оборванный
+хвост отрезается и дописывается заново. Серверный сид не выгружается —
+только его хэш.
+"""
+
+import argparse
+import csv
+import heapq
+import io
+import json
+import logging
+import os
+import sys
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import select
+
+from models import Spin
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_CHECKPOINT_ROWS = int(os.getenv("EXPORT_CHECKPOINT_ROWS", "200000"))
+FORMATS = ("ndjson", "csv")
+SOURCES = ("db", "archive", "all")
+COLUMNS = (
+    "spin_id",
+    "user_id",
+    "created_at",
+    "bet",
+    "win",
+    "symbols",
+    "server_seed_hash",
+    "client_seed",
+    "nonce",
+    "game_id",
+)
+
+_export_engine = None
+
+
+def _engines() -> List[Any]:
+    global _export_engine
+    from sharding import router
+
+    if router.enabled:
+        return [shard.read_engine for shard in router.shards]
+    if _export_engine is None:
+        from database import DATABASE_REPLICA_URL, DATABASE_URL, build_engine
+
+        _export_engine = build_engine(
+            DATABASE_REPLICA_URL or DATABASE_URL, "EXPORT", read_only=True
+        )
+    return [_export_engine]
+
+
+def _db_rows(
+    engine: Any,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    after_id: int,
+    user_id: Optional[int],
+) -> Iterator[Dict[str, Any]]:
+    query = (
+        select(
+            Spin.id,
+            Spin.user_id,
+            Spin.created_at,
+            Spin.bet,
+            Spin.win,
+            Spin.symbols,
+            Spin.pf_data,
+            Spin.game_id,
+        )
+        .where(Spin.id > after_id)
+        .order_by(Spin.id)
+    )
+    if start is not None:
+        query = query.where(Spin.created_at >= start)
+    if end is not None:
+        query = query.where(Spin.created_at < end)
+    if user_id is not None:
+        query = query.where(Spin.user_id == user_id)
+
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=EXPORT_CHUNK_ROWS
+        ).execute(query)
+        for partition in result.partitions():
+            for spin_id, owner, created_at, bet, win, symbols, pf_data, game_id in partition:
+                pf = pf_data or {}
+                yield {
+                    "spin_id": spin_id,
+                    "user_id": owner,
+                    "created_at": created_at.isoformat() if created_at else None,
+                    "bet": bet,
+                    "win": win,
+                    "symbols": json.loads(symbols) if symbols else [],
+                    "server_seed_hash": pf.get("server_seed_hash"),
+                    "client_seed": pf.get("client_seed"),
+                    "nonce": pf.get("nonce"),
+                    "game_id": game_id,
+                }
+
+
+def _archive_rows(
+    directory: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    after_id: int,
+    user_id: Optional[int],
+) -> Iterator[Dict[str, Any]]:
+    from archive import ArchiveReader
+
+    for row in ArchiveReader(directory).iter_rows(after_id, user_id, start, end):
+        row.pop("server_seed", None)
+        # Архивные сегменты игру не хранят
+        row.setdefault("game_id", None)
+        yield row
+
+
+def iter_spins(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    after_id: int = 0,
+    user_id: Optional[int] = None,
+    source: str = "db",
+    archive_dir: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Спины по возрастанию id со всех источников (шарды и архив сливаются по id)."""
+
+    if source not in SOURCES:
+        raise ValueError(f"Unknown source: {source}")
+    streams: List[Iterator[Dict[str, Any]]] = []
+    if source in ("archive", "all"):
+        from archive import ARCHIVE_DIR
+
+        streams.append(_archive_rows(archive_dir or ARCHIVE_DIR, start, end, after_id, user_id))
+    if source in ("db", "all"):
+        streams.extend(_db_rows(engine, start, end, after_id, user_id) for engine in _engines())
+    if len(streams) == 1:
+        return streams[0]
+    return heapq.merge(*streams, key=lambda row: row["spin_id"])
+
+
+def encode_rows(rows: Sequence[Dict[str, Any]], fmt: str) -> bytes:
+    if fmt == "ndjson":
+        lines = [json.dumps(row, separators=(",", ":")) for row in rows]
+        return ("\n".join(lines) + "\n").encode("utf-8")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        writer.writerow(
+            [
+                " ".join(row[name]) if name == "symbols" else row[name]
+                for name in COLUMNS
+            ]
+        )
+    return buffer.getvalue().encode("utf-8")
+
+
+def csv_header() -> bytes:
+    return (",".join(COLUMNS) + "\n").encode("utf-8")
+
+
+def _chunks(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk: List[Dict[str, Any]] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_export(
+    rows: Iterable[Dict[str, Any]],
+    fmt: str = "ndjson",
+    compress: bool = True,
+    header: bool = True,
+    chunk_rows: int = EXPORT_CHUNK_ROWS,
+) -> Iterator[bytes]:
+    """Байты выгрузки кусками; gzip с Z_SYNC_FLUSH, чтобы клиент видел прогресс."""
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def emit(data: bytes) -> bytes:
+        if compressor is None:
+            return data
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    if header and fmt == "csv":
+        yield emit(csv_header())
+    for chunk in _chunks(rows, chunk_rows):
+        yield emit(encode_rows(chunk, fmt))
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def _load_offset(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _save_offset(path: str, state: Dict[str, Any]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh)
+    os.replace(tmp, path)
+
+
+def export_to_file(
+    out: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    fmt: str = "ndjson",
+    compress: bool = True,
+    user_id: Optional[int] = None,
+    source: str = "db",
+    archive_dir: Optional[str] = None,
+    checkpoint_rows: int = EXPORT_CHECKPOINT_ROWS,
+) -> Dict[str, Any]:
+    """Пишет выгрузку в файл с чекпойнтами; повторный запуск продолжает с last_id."""
+
+    offset_path = f"{out}.offset"
+    state = _load_offset(offset_path)
+    params = {
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+        "format": fmt,
+        "gzip": compress,
+        "user_id": user_id,
+        "source": source,
+    }
+    if state and state.get("params") != params:
+        raise ValueError(f"{offset_path} belongs to an export with different parameters")
+    if not state:
+        state = {"params": params, "last_id": 0, "rows": 0, "bytes": 0}
+
+    rows = iter_spins(start, end, state["last_id"], user_id, source, archive_dir)
+    with open(out, "ab") as fh:
+        # Хвост после последнего чекпойнта — от прерванного запуска
+        fh.truncate(state["bytes"])
+        # Отдельный gzip-член на чекпойнт: склейка членов — валидный gzip
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+        def write(data: bytes) -> None:
+            fh.write(compressor.compress(data) if compressor else data)
+
+        def checkpoint(last_id: int, count: int) -> None:
+            nonlocal compressor
+            if compressor is not None:
+                fh.write(compressor.flush())
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            fh.flush()
+            os.fsync(fh.fileno())
+            state["last_id"] = last_id
+            state["rows"] += count
+            state["bytes"] = fh.tell()
+            _save_offset(offset_path, state)
+
+        if state["bytes"] == 0 and fmt == "csv":
+            write(csv_header())
+        since_checkpoint, last_id = 0, state["last_id"]
+        for chunk in _chunks(rows, EXPORT_CHUNK_ROWS):
+            write(encode_rows(chunk, fmt))
+            since_checkpoint += len(chunk)
+            last_id = chunk[-1]["spin_id"]
+            if since_checkpoint >= checkpoint_rows:
+                checkpoint(last_id, since_checkpoint)
+                logger.info("Exported %s rows, last spin %s", state["rows"], last_id)
+                since_checkpoint = 0
+        checkpoint(last_id, since_checkpoint)
+    state["complete"] = True
+    _save_offset(offset_path, state)
+    return state
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--start", type=_parse_date)
+    parser.add_argument("--end", type=_parse_date)
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--no-gzip", action="store_true")
+    parser.add_argument("--user-id", type=int)
+    parser.add_argument("--source", choices=SOURCES, default="db")
+    parser.add_argument("--archive-dir")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    state = export_to_file(
+        args.out,
+        args.start,
+        args.end,
+        args.format,
+        not args.no_gzip,
+        args.user_id,
+        args.source,
+        args.archive_dir,
+    )
+    print(json.dumps(state, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,379 @@
+"""Каскады (tumbling reels) и фриспины по скаттерам для игр из games.json.
+
+    python features.py --game cascade --rounds 1000000 --seed 1
+    python features.py --game cascade --rounds 200000 --no-free-spins
+
+Окна спинов — массивы кодов формы (n, барабаны, ряды), ряд 0 сверху.
+Выигрыш по линиям, удаление выигравших позиций, падение символов и
+досыпка считаются масками NumPy сразу для всех окон, поэтому один и тот
+же код играет живой спин (n = 1) и миллионы раундов для сертификации.
+
+Досыпка в живом спине provably fair: символ с курсором c выводится из
+sha256("server:client:nonce:refill:c"), курсор растёт от 0 по порядку
+барабан -> ряд сверху вниз, шаг за шагом каскада. В симуляции те же
+64-битные числа берутся из numpy Generator.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from slot_engine import GameEngine
+
+
+# Источник случайности досыпки: count -> массив uint64 длины count
+Draws = Callable[[int], np.ndarray]
+
+DEFAULT_MAX_CASCADES = 20
+
+
+def provably_fair_draws(server_seed: str, client_seed: str, nonce: int) -> Draws:
+    """Досыпка живого спина: курсор продолжает нонс после исходного окна."""
+
+    prefix = f"{server_seed}:{client_seed}:{nonce}:refill:"
+    cursor = 0
+
+    def draw(count: int) -> np.ndarray:
+        nonlocal cursor
+        out = np.empty(count, dtype=np.uint64)
+        for index in range(count):
+            digest = hashlib.sha256(f"{prefix}{cursor + index}".encode("utf-8")).digest()
+            out[index] = int.from_bytes(digest[:8], byteorder="big")
+        cursor += count
+        return out
+
+    return draw
+
+
+def random_draws(rng: np.random.Generator) -> Draws:
+    def draw(count: int) -> np.ndarray:
+        return rng.integers(
+            0, np.iinfo(np.uint64).max, size=count, dtype=np.uint64, endpoint=True
+        )
+
+    return draw
+
+
+class FeatureEngine:
+    """GameEngine в виде массивов плюс правила каскадов и фриспинов.
+
+    features игры:
+        "cascade": {"multipliers": [1, 2, 3, 5], "max_cascades": 20}
+        "free_spins": {"scatter": "S", "awards": {"3": 10, "4": 15},
+                       "multiplier": 2, "retrigger": true, "max_total": 100}
+    Множитель каскада берётся по номеру шага (последний повторяется);
+    скаттеры считаются по исходному окну раунда.
+    """
+
+    def __init__(self, game: GameEngine) -> None:
+        self.game = game
+        symbols: List[str] = []
+        for reel_symbols, _, _ in game.reels.reels:
+            for symbol in reel_symbols:
+                if symbol not in symbols:
+                    symbols.append(symbol)
+        for symbol in game.pays:
+            if symbol not in symbols:
+                symbols.append(symbol)
+        features = game.features
+        scatter = (features.get("free_spins") or {}).get("scatter")
+        if scatter is not None and scatter not in symbols:
+            symbols.append(scatter)
+        self.symbols = symbols
+        self.index = {symbol: code for code, symbol in enumerate(symbols)}
+
+        self.reel_count = game.reel_count
+        self.rows = game.rows
+        self.codes: List[np.ndarray] = []
+        self.cumulative: List[np.ndarray] = []
+        self.totals = np.empty(self.reel_count, dtype=np.uint64)
+        for reel_index, (reel_symbols, cumulative, total) in enumerate(game.reels.reels):
+            self.codes.append(np.array([self.index[s] for s in reel_symbols], dtype=np.int16))
+            if cumulative is None:
+                cumulative = tuple(range(1, len(reel_symbols) + 1))
+            self.cumulative.append(np.array(cumulative, dtype=np.uint64))
+            self.totals[reel_index] = total
+
+        self.lines = np.array(game.lines, dtype=np.int64)
+        # pays[код, длина серии] — множитель ставки на линию
+        self.pays = np.zeros((len(symbols), self.reel_count + 1))
+        for symbol, table in game.pays.items():
+            width = min(len(table), self.reel_count + 1)
+            self.pays[self.index[symbol], :width] = table[:width]
+        self.wild = self.index.get(game.wild, -1) if game.wild is not None else -1
+
+        cascade = features.get("cascade")
+        self.cascade = cascade is not None
+        cascade = cascade or {}
+        self.multipliers = np.array(
+            [float(m) for m in cascade.get("multipliers", [1.0])] or [1.0]
+        )
+        self.max_cascades = int(cascade.get("max_cascades", DEFAULT_MAX_CASCADES))
+
+        free = features.get("free_spins")
+        self.scatter = self.index[scatter] if scatter is not None else -1
+        self.free_awards = np.zeros(self.reel_count * self.rows + 1, dtype=np.int64)
+        self.free_multiplier = 1.0
+        self.retrigger = True
+        self.free_max_total = 0
+        if free:
+            awards = sorted(
+                (int(count), int(spins)) for count, spins in free.get("awards", {}).items()
+            )
+            for count, spins in awards:
+                self.free_awards[min(count, len(self.free_awards) - 1) :] = spins
+            self.free_multiplier = float(free.get("multiplier", 1.0))
+            self.retrigger = bool(free.get("retrigger", True))
+            self.free_max_total = int(free.get("max_total", 0))
+
+    # --- кодирование -----------------------------------------------------
+
+    def encode(self, flat: Sequence[str]) -> np.ndarray:
+        codes = np.array([self.index[symbol] for symbol in flat], dtype=np.int16)
+        return codes.reshape(1, self.reel_count, self.rows)
+
+    def decode(self, grid: np.ndarray) -> List[str]:
+        return [self.symbols[code] for code in grid.reshape(-1)]
+
+    def _symbols_for(self, reels: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """uint64 -> коды символов по весам барабанов reels (та же схема, что CompiledReels)."""
+
+        out = np.empty(len(values), dtype=np.int16)
+        targets = values % self.totals[reels]
+        for reel_index in range(self.reel_count):
+            selected = reels == reel_index
+            if selected.any():
+                positions = np.searchsorted(
+                    self.cumulative[reel_index], targets[selected], side="right"
+                )
+                out[selected] = self.codes[reel_index][positions]
+        return out
+
+    def draw_grids(self, count: int, draws: Draws) -> np.ndarray:
+        reels = np.broadcast_to(
+            np.arange(self.reel_count)[None, :, None], (count, self.reel_count, self.rows)
+        ).reshape(-1)
+        values = draws(count * self.reel_count * self.rows)
+        return self._symbols_for(reels, values).reshape(count, self.reel_count, self.rows)
+
+    # --- оценка и каскад --------------------------------------------------
+
+    def evaluate(self, grids: np.ndarray, line_bets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Выигрыш по линиям и маска выигравших позиций формы окон."""
+
+        count = len(grids)
+        reel_axis = np.arange(self.reel_count)
+        # (n, линии, барабаны)
+        on_lines = grids[:, reel_axis[None, :], self.lines]
+        is_wild = on_lines == self.wild
+        plain = ~is_wild
+        first = plain.argmax(axis=2)
+        target = np.take_along_axis(on_lines, first[..., None], axis=2)[..., 0]
+        target = np.where(plain.any(axis=2), target, self.wild)
+        run = np.cumprod((on_lines == target[..., None]) | is_wild, axis=2)
+        multipliers = self.pays[target, run.sum(axis=2)]
+        wins = (multipliers * line_bets[:, None]).sum(axis=1)
+
+        paying = run.astype(bool) & (multipliers > 0)[..., None]
+        mask = np.zeros((count, self.reel_count, self.rows), dtype=bool)
+        for line_index, line in enumerate(self.lines):
+            mask[:, reel_axis, line] |= paying[:, line_index]
+        return wins, mask
+
+    def collapse(self, grids: np.ndarray, mask: np.ndarray, draws: Draws) -> np.ndarray:
+        """Убирает позиции mask, опускает оставшиеся символы и досыпает сверху."""
+
+        # Стабильная сортировка: удалённые наверх, выжившие вниз в прежнем порядке
+        order = np.argsort(~mask, axis=2, kind="stable")
+        fallen = np.take_along_axis(grids, order, axis=2)
+        removed = mask.sum(axis=2)
+        refill = np.arange(self.rows)[None, None, :] < removed[..., None]
+        # nonzero идёт по окну, барабану, ряду — это и есть порядок курсора
+        _, reels, _ = np.nonzero(refill)
+        fallen[refill] = self._symbols_for(reels, draws(len(reels)))
+        return fallen
+
+    def play(
+        self,
+        grids: np.ndarray,
+        bets: np.ndarray,
+        draws: Draws,
+        multiplier: float = 1.0,
+        history: Optional[List[np.ndarray]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Раунд с каскадами для всех окон; возвращает (выигрыши, число каскадов).
+
+        grids меняется на месте. history (для n = 1) получает окна после
+        каждой досыпки.
+        """
+
+        count = len(grids)
+        line_bets = bets / len(self.lines)
+        totals = np.zeros(count)
+        steps = np.zeros(count, dtype=np.int64)
+        active = np.arange(count)
+        step = 0
+        while len(active):
+            wins, mask = self.evaluate(grids[active], line_bets[active])
+            factor = self.multipliers[min(step, len(self.multipliers) - 1)] * multiplier
+            totals[active] += wins * factor
+            if not self.cascade or step >= self.max_cascades:
+                break
+            hit = wins > 0
+            active, mask = active[hit], mask[hit]
+            if not len(active):
+                break
+            grids[active] = self.collapse(grids[active], mask, draws)
+            steps[active] += 1
+            if history is not None:
+                history.append(grids[0].copy())
+            step += 1
+        return totals, steps
+
+    def free_spins_awarded(self, grids: np.ndarray) -> np.ndarray:
+        if self.scatter < 0:
+            return np.zeros(len(grids), dtype=np.int64)
+        scatters = (grids == self.scatter).sum(axis=(1, 2))
+        return self.free_awards[scatters]
+
+    # --- симуляция --------------------------------------------------------
+
+    def simulate_chunk(
+        self, rounds: int, bet: float, rng: np.random.Generator, free_spins: bool = True
+    ) -> Dict[str, float]:
+        """rounds платных раундов с каскадами и полными сериями фриспинов -> суммы."""
+
+        draws = random_draws(rng)
+        grids = self.draw_grids(rounds, draws)
+        awarded = self.free_spins_awarded(grids) if free_spins else np.zeros(rounds, np.int64)
+        base_wins, cascades = self.play(grids, np.full(rounds, bet), draws)
+
+        free_wins = np.zeros(rounds)
+        left = awarded.copy()
+        given = awarded.copy()
+        free_played = 0
+        while True:
+            active = np.nonzero(left > 0)[0]
+            if not len(active):
+                break
+            left[active] -= 1
+            free_played += len(active)
+            grids = self.draw_grids(len(active), draws)
+            if self.retrigger:
+                extra = self.free_spins_awarded(grids)
+                if self.free_max_total:
+                    extra = np.minimum(extra, self.free_max_total - given[active])
+                left[active] += extra
+                given[active] += extra
+            wins, _ = self.play(grids, np.full(len(active), bet), draws, self.free_multiplier)
+            free_wins[active] += wins
+
+        multiples = (base_wins + free_wins) / bet
+        return {
+            "rounds": rounds,
+            "base": float(base_wins.sum()),
+            "free": float(free_wins.sum()),
+            "hits": int((multiples > 0).sum()),
+            "cascades": int(cascades.sum()),
+            "max_cascades": int(cascades.max()) if rounds else 0,
+            "triggers": int((awarded > 0).sum()),
+            "free_spins_played": free_played,
+            "sum_sq": float((multiples ** 2).sum()),
+            "max_multiplier": float(multiples.max()) if rounds else 0.0,
+        }
+
+    def simulate(
+        self,
+        rounds: int,
+        bet: float = 1.0,
+        seed: Optional[int] = None,
+        free_spins: bool = True,
+        chunk: int = 200_000,
+    ) -> Dict[str, Any]:
+        """Отчёт сертификации; раунды идут кусками по chunk, память от rounds не зависит."""
+
+        rng = np.random.default_rng(seed)
+        sums: Dict[str, float] = {}
+        done = 0
+        while done < rounds:
+            part = self.simulate_chunk(min(chunk, rounds - done), bet, rng, free_spins)
+            for key, value in part.items():
+                if key.startswith("max_"):
+                    sums[key] = max(sums.get(key, 0), value)
+                else:
+                    sums[key] = sums.get(key, 0) + value
+            done += part["rounds"]
+
+        if not done:
+            return {"rounds": 0, "bet": bet}
+        staked = bet * done
+        rtp = (sums["base"] + sums["free"]) / staked
+        return {
+            "rounds": done,
+            "bet": bet,
+            "rtp_base": sums["base"] / staked,
+            "rtp_free_spins": sums["free"] / staked,
+            "rtp_total": rtp,
+            "hit_rate": sums["hits"] / done,
+            "std_dev": float(np.sqrt(max(sums["sum_sq"] / done - rtp ** 2, 0.0))),
+            "avg_cascades": sums["cascades"] / done,
+            "max_cascades": sums["max_cascades"],
+            "free_spin_trigger_rate": sums["triggers"] / done,
+            "free_spins_played": sums["free_spins_played"],
+            "max_multiplier": sums["max_multiplier"],
+        }
+
+
+def play_spin(
+    engine: FeatureEngine,
+    symbols: Sequence[str],
+    bet: float,
+    server_seed: str,
+    client_seed: str,
+    nonce: int,
+    multiplier: float = 1.0,
+) -> Tuple[float, List[List[str]], int]:
+    """Живой спин: (выигрыш, окна после каждой досыпки, фриспины по скаттерам)."""
+
+    grid = engine.encode(symbols)
+    free_spins = int(engine.free_spins_awarded(grid)[0])
+    history: List[np.ndarray] = []
+    wins, _ = engine.play(
+        grid,
+        np.array([bet], dtype=float),
+        provably_fair_draws(server_seed, client_seed, nonce),
+        multiplier,
+        history,
+    )
+    return float(wins[0]), [engine.decode(item) for item in history], free_spins
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    from games import GAMES_FILE, compile_games
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--game", required=True)
+    parser.add_argument("--games-file", default=GAMES_FILE)
+    parser.add_argument("--rounds", type=int, default=1_000_000)
+    parser.add_argument("--chunk", type=int, default=200_000)
+    parser.add_argument("--bet", type=float, default=1.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--no-free-spins", action="store_true")
+    args = parser.parse_args(argv)
+
+    with open(args.games_file, "r", encoding="utf-8") as fh:
+        _, games = compile_games(json.load(fh))
+    engine = FeatureEngine(games[args.game])
+    report = engine.simulate(
+        args.rounds, args.bet, args.seed, not args.no_free_spins, args.chunk
+    )
+    print(json.dumps({"game": args.game, **report}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from slot_engine import DEFAULT_COMPILED_REELS, SYMBOL_PAYOUTS, CompiledReels, GameEngine
+
+
+logger = logging.getLogger(__name__)
+
+GAMES_FILE = os.getenv(
+    "GAMES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "games.json")
+)
+# Как часто воркер смотрит на mtime файла игр
+GAMES_RELOAD_INTERVAL = float(os.getenv("GAMES_RELOAD_INTERVAL", "5"))
+# Игра запросов без game_id; на ней же работают тиры ReelWeights и эксперименты
+DEFAULT_GAME_ID = "classic"
+
+
+class UnknownGame(LookupError):
+    pass
+
+
+def builtin_game() -> GameEngine:
+    """Исходная 3-барабанная игра — на случай отсутствующего или битого файла."""
+
+    return GameEngine(
+        DEFAULT_GAME_ID,
+        "builtin",
+        DEFAULT_COMPILED_REELS,
+        rows=1,
+        lines=((0, 0, 0),),
+        pays={symbol: (0.0, 0.0, 0.0, float(mult)) for symbol, mult in SYMBOL_PAYOUTS.items()},
+    )
+
+
+def compile_game(game_id: str, spec: Dict[str, Any]) -> GameEngine:
+    """Проверяет описание игры и собирает GameEngine; ошибки — ValueError."""
+
+    try:
+        reels = CompiledReels(spec["reels"])
+        rows = int(spec.get("rows", 1))
+        lines = tuple(tuple(int(row) for row in line) for line in spec["lines"])
+        pays: Dict[str, Tuple[float, ...]] = {}
+        for symbol, table in spec["pays"].items():
+            by_count = {int(count): float(mult) for count, mult in table.items()}
+            pays[symbol] = tuple(by_count.get(count, 0.0) for count in range(max(by_count) + 1))
+    except (KeyError, TypeError, ValueError, AttributeError) as exc:
+        raise ValueError(f"Game {game_id}: {exc!r}") from exc
+
+    reel_count = len(reels.reels)
+    if not reel_count or rows < 1:
+        raise ValueError(f"Game {game_id}: empty reel window")
+    if not lines:
+        raise ValueError(f"Game {game_id}: no lines")
+    for line in lines:
+        if len(line) != reel_count or not all(0 <= row < rows for row in line):
+            raise ValueError(f"Game {game_id}: line {list(line)} does not fit {reel_count}x{rows}")
+    game = GameEngine(
+        game_id,
+        str(spec.get("version", "1")),
+        reels,
+        rows,
+        lines,
+        pays,
+        wild=spec.get("wild"),
+        features=spec.get("features"),
+    )
+    if game.has_features:
+        # Массивы каскадов/фриспинов собираются при загрузке, а не на первом спине
+        try:
+            game.feature_engine()
+        except (ImportError, KeyError, TypeError, ValueError, AttributeError) as exc:
+            raise ValueError(f"Game {game_id} features: {exc!r}") from exc
+    return game
+
+
+def compile_games(config: Dict[str, Any]) -> Tuple[str, Dict[str, GameEngine]]:
+    games = {
+        str(game_id): compile_game(str(game_id), spec)
+        for game_id, spec in config["games"].items()
+    }
+    default = str(config.get("default", DEFAULT_GAME_ID))
+    if default not in games:
+        raise ValueError(f"Default game {default} is not defined")
+    return default, games
+
+
+class GameRegistry:
+    """Скомпилированные игры воркера с горячей перезагрузкой из файла.
+
+    Файл разбирается один раз на версию (по mtime); запросы получают
+    готовые неизменяемые GameEngine. Новое состояние подменяется одним
+    присваиванием, поэтому спин видит либо старый набор игр, либо новый.
+    Битый файл не ломает воркер: остаются ранее загруженные игры.
+    """
+
+    def __init__(self, path: str, reload_interval: float = 5.0) -> None:
+        self.path = path
+        self.reload_interval = reload_interval
+        self._state: Tuple[str, Dict[str, GameEngine]] = (
+            DEFAULT_GAME_ID,
+            {DEFAULT_GAME_ID: builtin_game()},
+        )
+        self._mtime: Optional[float] = None
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def default_id(self) -> str:
+        return self._state[0]
+
+    def ids(self) -> Tuple[str, ...]:
+        return tuple(self._state[1])
+
+    def load(self) -> int:
+        """Перечитывает файл, если он изменился; возвращает число игр."""
+
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            if self._mtime is None:
+                logger.warning("Games file %s not found, using builtin game", self.path)
+                self._mtime = 0.0
+            return len(self._state[1])
+        if mtime == self._mtime:
+            return len(self._state[1])
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                state = compile_games(json.load(fh))
+        except (OSError, KeyError, TypeError, ValueError, AttributeError) as exc:
+            logger.warning("Games file %s rejected, keeping previous games: %s", self.path, exc)
+        else:
+            self._state = state
+            logger.info("Loaded %s games from %s", len(state[1]), self.path)
+        # Битый файл тоже запоминаем, чтобы не разбирать его на каждом запросе
+        self._mtime = mtime
+        return len(self._state[1])
+
+    def maybe_reload(self) -> None:
+        if (
+            self._checked_at is None
+            or time.monotonic() - self._checked_at > self.reload_interval
+        ):
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.load()
+                finally:
+                    self._lock.release()
+
+    def get(self, game_id: Optional[str] = None) -> GameEngine:
+        self.maybe_reload()
+        default, games = self._state
+        game = games.get(game_id or default)
+        if game is None:
+            raise UnknownGame(game_id)
+        return game
+
+
+registry = GameRegistry(GAMES_FILE, GAMES_RELOAD_INTERVAL)
+
+
+def get_game(game_id: Optional[str] = None) -> GameEngine:
+    return registry.get(game_id)
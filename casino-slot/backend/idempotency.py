@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+RedisLike = Any
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+IDEMPOTENCY_LOCAL_MAX = int(os.getenv("IDEMPOTENCY_LOCAL_MAX", "10000"))
+# Сколько держим маркер «в обработке», если воркер умер посреди спина
+PENDING_TTL_SECONDS = 30
+WAIT_TIMEOUT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "10"))
+POLL_INTERVAL_SECONDS = 0.05
+
+KEY_PREFIX = "idem:"
+PENDING = "__pending__"
+
+
+class IdempotencyConflict(Exception):
+    """Ключ уже использован с другими параметрами запроса."""
+
+
+class IdempotencyPending(Exception):
+    """Запрос с этим ключом ещё выполняется или не завершился."""
+
+
+class IdempotencyStore:
+    """Кэш завершённых ответов по ключу идемпотентности.
+
+    Повтор запроса отдаётся из Redis (или из ограниченного LRU в памяти
+    процесса), конкурентные дубли ждут результат первого запроса вместо
+    того, чтобы выполнять спин ещё раз. Ошибки не кэшируются — после
+    неудачи клиент может повторить запрос с тем же ключом.
+    """
+
+    def __init__(self, ttl_seconds: int, max_local_entries: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_local_entries = max_local_entries
+        self._local: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def _get_local(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, record = entry
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return record
+
+    def _put_local(self, key: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.ttl_seconds, record)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
+
+    def _get_remote(self, redis_client: RedisLike, key: str) -> Optional[str]:
+        try:
+            return redis_client.get(KEY_PREFIX + key)
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Idempotency lookup failed: %s", exc)
+            return None
+
+    def _claim_remote(self, redis_client: RedisLike, key: str) -> bool:
+        try:
+            return bool(
+                redis_client.set(KEY_PREFIX + key, PENDING, nx=True, ex=PENDING_TTL_SECONDS)
+            )
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Idempotency claim failed: %s", exc)
+            return True
+
+    def _wait_remote(self, redis_client: RedisLike, key: str) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + WAIT_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            raw = self._get_remote(redis_client, key)
+            if raw is None:
+                return None
+            if raw != PENDING:
+                return json.loads(raw)
+            time.sleep(POLL_INTERVAL_SECONDS)
+        raise IdempotencyPending("Request with this idempotency key is still in progress")
+
+    @staticmethod
+    def _check(record: Dict[str, Any], fingerprint: str) -> Dict[str, Any]:
+        if record.get("fingerprint") != fingerprint:
+            raise IdempotencyConflict("Idempotency key reused with different parameters")
+        return record["response"]
+
+    def run(
+        self,
+        redis_client: Optional[RedisLike],
+        key: str,
+        fingerprint: str,
+        fn: Callable[[], Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        record = self._get_local(key)
+        if record is not None:
+            return self._check(record, fingerprint)
+
+        with self._lock:
+            event = self._in_flight.get(key)
+            owner = event is None
+            if owner:
+                event = threading.Event()
+                self._in_flight[key] = event
+
+        if not owner:
+            # Дубль в этом же процессе — ждём первый запрос
+            event.wait(WAIT_TIMEOUT_SECONDS)
+            record = self._get_local(key)
+            if record is None:
+                raise IdempotencyPending("Request with this idempotency key did not complete")
+            return self._check(record, fingerprint)
+
+        try:
+            if redis_client is not None:
+                raw = self._get_remote(redis_client, key)
+                if raw == PENDING or (raw is None and not self._claim_remote(redis_client, key)):
+                    # Дубль обрабатывается другим воркером
+                    record = self._wait_remote(redis_client, key)
+                    if record is None:
+                        return self._run_unclaimed(redis_client, key, fingerprint, fn)
+                    self._put_local(key, record)
+                    return self._check(record, fingerprint)
+                if raw is not None:
+                    record = json.loads(raw)
+                    self._put_local(key, record)
+                    return self._check(record, fingerprint)
+
+            return self._execute(redis_client, key, fingerprint, fn)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    def _run_unclaimed(
+        self,
+        redis_client: RedisLike,
+        key: str,
+        fingerprint: str,
+        fn: Callable[[], Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        # Первый запрос завершился ошибкой и снял маркер — пробуем сами
+        if not self._claim_remote(redis_client, key):
+            raise IdempotencyPending("Request with this idempotency key is still in progress")
+        return self._execute(redis_client, key, fingerprint, fn)
+
+    def _execute(
+        self,
+        redis_client: Optional[RedisLike],
+        key: str,
+        fingerprint: str,
+        fn: Callable[[], Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        try:
+            response = fn()
+        except Exception:
+            if redis_client is not None:
+                try:
+                    redis_client.delete(KEY_PREFIX + key)
+                except Exception:  # pragma: no cover
+                    pass
+            raise
+
+        record = {"fingerprint": fingerprint, "response": response}
+        self._put_local(key, record)
+        if redis_client is not None:
+            try:
+                redis_client.set(KEY_PREFIX + key, json.dumps(record), ex=self.ttl_seconds)
+            except Exception as exc:  # pragma: no cover
+                logger.warning("Failed to store idempotent response: %s", exc)
+        return response
+
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LOCAL_MAX)
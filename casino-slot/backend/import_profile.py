@@ -0,0 +1,147 @@
+"""Отчёт о времени импорта и проверка бюджетов холодного старта.
+
+    python import_profile.py                 # отчёт + проверка бюджетов
+    python import_profile.py --json          # машиночитаемый отчёт
+    python import_profile.py --module main   # профиль произвольного модуля
+
+Код возврата 1, если какой-то бюджет превышен — удобно для CI.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Бюджеты в миллисекундах: модуль -> лимит на кумулятивный импорт
+IMPORT_BUDGETS_MS: Dict[str, float] = {
+    "slot_engine": 10.0,
+}
+# Импорт main + create_app(), без сетевого прогрева
+APP_BOOT_BUDGET_MS = 1000.0
+
+_APP_BOOT_SNIPPET = (
+    "import time; started = time.perf_counter(); "
+    "import main; main.create_app(); "
+    "print((time.perf_counter() - started) * 1000)"
+)
+
+
+def _run_python(args: List[str]) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Строки `-X importtime` -> [(module, self_us, cumulative_us)]."""
+
+    rows: List[Tuple[str, int, int]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            rows.append((name.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return rows
+
+
+def profile_module(module: str, repeat: int = 3, top: int = 10) -> Dict[str, object]:
+    best_us = None
+    best_rows: List[Tuple[str, int, int]] = []
+    for _ in range(repeat):
+        proc = _run_python(["-X", "importtime", "-c", f"import {module}"])
+        if proc.returncode != 0:
+            return {"module": module, "error": proc.stderr.strip().splitlines()[-1:]}
+        rows = parse_importtime(proc.stderr)
+        total = next((cum for name, _, cum in rows if name == module), None)
+        if total is not None and (best_us is None or total < best_us):
+            best_us, best_rows = total, rows
+
+    heaviest = sorted(best_rows, key=lambda row: row[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "cumulative_ms": round((best_us or 0) / 1000, 3),
+        "heaviest_self": [
+            {"module": name, "self_ms": round(self_us / 1000, 3)}
+            for name, self_us, _ in heaviest
+        ],
+    }
+
+
+def measure_app_boot(repeat: int = 3) -> Dict[str, object]:
+    timings: List[float] = []
+    for _ in range(repeat):
+        proc = _run_python(["-c", _APP_BOOT_SNIPPET])
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1:]}
+        timings.append(float(proc.stdout.strip().splitlines()[-1]))
+    return {"boot_ms": round(min(timings), 3)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", action="append", default=[])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--skip-app", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    modules = args.module or list(IMPORT_BUDGETS_MS)
+    report: Dict[str, object] = {"modules": [], "violations": []}
+
+    for module in modules:
+        result = profile_module(module, args.repeat, args.top)
+        report["modules"].append(result)  # type: ignore[union-attr]
+        budget = IMPORT_BUDGETS_MS.get(module)
+        if "error" in result:
+            report["violations"].append(f"{module}: import failed")  # type: ignore[union-attr]
+        elif budget is not None and result["cumulative_ms"] > budget:
+            report["violations"].append(  # type: ignore[union-attr]
+                f"{module}: {result['cumulative_ms']} ms > {budget} ms"
+            )
+
+    if not args.skip_app:
+        boot = measure_app_boot(args.repeat)
+        report["app"] = boot
+        if "error" in boot:
+            report["violations"].append("app: boot failed")  # type: ignore[union-attr]
+        elif boot["boot_ms"] > APP_BOOT_BUDGET_MS:
+            report["violations"].append(  # type: ignore[union-attr]
+                f"app: {boot['boot_ms']} ms > {APP_BOOT_BUDGET_MS} ms"
+            )
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        for result in report["modules"]:  # type: ignore[union-attr]
+            if "error" in result:
+                print(f"{result['module']}: ERROR {result['error']}")
+                continue
+            print(f"{result['module']}: {result['cumulative_ms']} ms")
+            for row in result["heaviest_self"]:
+                print(f"    {row['self_ms']:>9.3f} ms  {row['module']}")
+        if "app" in report:
+            print(f"app boot: {report['app']}")
+        for violation in report["violations"]:  # type: ignore[union-attr]
+            print(f"BUDGET EXCEEDED: {violation}")
+
+    return 1 if report["violations"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
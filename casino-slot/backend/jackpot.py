@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+RedisLike = Any
+
+JACKPOT_CONTRIBUTION_RATE = float(os.getenv("JACKPOT_CONTRIBUTION_RATE", "0.01"))
+JACKPOT_SHARDS = int(os.getenv("JACKPOT_SHARDS", "16"))
+# Шанс выигрыша растёт со ставкой до JACKPOT_REFERENCE_BET: один выигрыш
+# на JACKPOT_HIT_ODDS платных спинов при ставке не ниже опорной
+JACKPOT_REFERENCE_BET = float(os.getenv("JACKPOT_REFERENCE_BET", "10"))
+JACKPOT_HIT_ODDS = float(os.getenv("JACKPOT_HIT_ODDS", "1000000"))
+# Стартовый пул — доля взносов, ожидаемых между двумя выигрышами. Оператор
+# доплачивает его при каждом сбросе, и RTP джекпота получается
+# JACKPOT_CONTRIBUTION_RATE * (1 + JACKPOT_SEED_SHARE)
+JACKPOT_SEED_SHARE = float(os.getenv("JACKPOT_SEED_SHARE", "0.1"))
+JACKPOT_SEED = float(
+    os.getenv(
+        "JACKPOT_SEED",
+        str(JACKPOT_SEED_SHARE * JACKPOT_CONTRIBUTION_RATE * JACKPOT_REFERENCE_BET * JACKPOT_HIT_ODDS),
+    )
+)
+JACKPOT_BROADCAST_INTERVAL = float(os.getenv("JACKPOT_BROADCAST_INTERVAL", "1"))
+JACKPOT_COMPACT_INTERVAL = float(os.getenv("JACKPOT_COMPACT_INTERVAL", "60"))
+AWARD_RECORD_TTL = 7 * 24 * 3600
+
+# Суммы в Redis храним в копейках (целые INCRBY), наружу — в единицах ставки.
+MINOR_UNITS = 100
+
+# Общий hash tag, чтобы все ключи пула жили в одном слоте Redis Cluster
+# и Lua-скрипты могли трогать их атомарно.
+BASE_KEY = "jackpot:{pool}:base"
+SHARD_KEY = "jackpot:{pool}:shard:%d"
+AWARD_KEY = "jackpot:{pool}:award:%s"
+
+
+def _to_minor(amount: float) -> int:
+    return int(round(amount * MINOR_UNITS))
+
+
+def _from_minor(amount: int) -> float:
+    return amount / MINOR_UNITS
+
+
+# Переносит накопленное в шардах в базовый ключ
+_COMPACT_LUA = """
+local moved = 0
+for i = 2, #KEYS do
+    local value = tonumber(redis.call('GET', KEYS[i]) or '0')
+    if value ~= 0 then
+        redis.call('DECRBY', KEYS[i], value)
+        moved = moved + value
+    end
+end
+if moved ~= 0 then
+    redis.call('INCRBY', KEYS[1], moved)
+end
+return moved
+"""
+
+# Выплата пула ровно один раз на award_id: повторный вызов вернёт ту же сумму
+_AWARD_LUA = """
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    return tonumber(existing)
+end
+local total = tonumber(redis.call('GET', KEYS[2]) or '0')
+for i = 3, #KEYS do
+    total = total + tonumber(redis.call('GET', KEYS[i]) or '0')
+    redis.call('SET', KEYS[i], 0)
+end
+redis.call('SET', KEYS[2], ARGV[1])
+redis.call('SET', KEYS[1], total, 'EX', ARGV[2])
+return total
+"""
+
+
+class Jackpot:
+    """Прогрессивный джекпот на шардированных счётчиках Redis.
+
+    Каждый спин делает один INCRBY в шард, выбранный по user_id, поэтому
+    взносы не сериализуются на одном ключе. Значение пула — сумма базового
+    ключа и шардов; шарды периодически сворачиваются в базу (compact).
+    Без Redis джекпот отключён.
+
+    Выигрыш — отдельный provably-fair розыгрыш, не зависящий от символов,
+    с вероятностью, пропорциональной ставке: взнос и шанс растут вместе,
+    поэтому доля джекпота в RTP одинакова для любой ставки до опорной.
+    """
+
+    def __init__(
+        self,
+        shards: int,
+        contribution_rate: float,
+        seed: float,
+        reference_bet: float,
+        hit_odds: float,
+    ) -> None:
+        self.shards = shards
+        self.contribution_rate = contribution_rate
+        self.seed = seed
+        self.reference_bet = reference_bet
+        self.hit_odds = hit_odds
+        self._scripts: dict = {}
+        self._cached_value: Optional[float] = None
+        self._cached_at = 0.0
+        self._lock = threading.Lock()
+
+    def _keys(self) -> List[str]:
+        return [BASE_KEY] + [SHARD_KEY % index for index in range(self.shards)]
+
+    def _script(self, redis_client: RedisLike, name: str, source: str):
+        script = self._scripts.get(name)
+        if script is None:
+            script = redis_client.register_script(source)
+            self._scripts[name] = script
+        return script
+
+    def shard_for(self, user_id: int) -> int:
+        return user_id % self.shards
+
+    def hit_probability(self, bet: float) -> float:
+        if bet <= 0:
+            return 0.0
+        return min(bet / self.reference_bet, 1.0) / self.hit_odds
+
+    def is_hit(self, server_seed: str, client_seed: str, nonce: int, bet: float) -> bool:
+        """Розыгрыш из sha256("{server}:{client}:{nonce}:jackpot"), проверяемый игроком."""
+
+        threshold = int(self.hit_probability(bet) * 2 ** 64)
+        if threshold <= 0:
+            return False
+        digest = hashlib.sha256(
+            f"{server_seed}:{client_seed}:{nonce}:jackpot".encode("utf-8")
+        ).digest()
+        return int.from_bytes(digest[:8], byteorder="big") < threshold
+
+    def expected_pool(self) -> float:
+        """Средний пул в момент выигрыша: стартовый плюс взносы между выигрышами.
+
+        Точно, пока ставки не выше опорной; более крупные ставки только
+        увеличивают пул и снижают свою долю RTP.
+        """
+
+        return self.seed + self.contribution_rate * self.reference_bet * self.hit_odds
+
+    def expected_rtp(self, bet: float) -> float:
+        """Доля джекпота в RTP при ставке bet — для симулятора и оптимизатора."""
+
+        if bet <= 0:
+            return 0.0
+        return self.hit_probability(bet) * self.expected_pool() / bet
+
+    def contribute(self, redis_client: Optional[RedisLike], user_id: int, bet: float) -> None:
+        amount = _to_minor(bet * self.contribution_rate)
+        if redis_client is None or amount <= 0:
+            return
+        try:
+            redis_client.incrby(SHARD_KEY % self.shard_for(user_id), amount)
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Jackpot contribution failed: %s", exc)
+
+    def ensure_seeded(self, redis_client: Optional[RedisLike]) -> None:
+        if redis_client is None:
+            return
+        try:
+            redis_client.set(BASE_KEY, _to_minor(self.seed), nx=True)
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Jackpot seed failed: %s", exc)
+
+    def value(self, redis_client: Optional[RedisLike], max_age: float = 0.5) -> float:
+        """Текущий пул; результат кэшируется на max_age секунд."""
+
+        if redis_client is None:
+            return 0.0
+        now = time.monotonic()
+        if self._cached_value is not None and now - self._cached_at < max_age:
+            return self._cached_value
+        try:
+            raw = redis_client.mget(self._keys())
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Jackpot read failed: %s", exc)
+            return self._cached_value or 0.0
+        value = _from_minor(sum(int(item or 0) for item in raw))
+        with self._lock:
+            self._cached_value, self._cached_at = value, now
+        return value
+
+    def compact(self, redis_client: Optional[RedisLike]) -> float:
+        if redis_client is None:
+            return 0.0
+        try:
+            moved = self._script(redis_client, "compact", _COMPACT_LUA)(keys=self._keys())
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Jackpot compaction failed: %s", exc)
+            return 0.0
+        return _from_minor(int(moved or 0))
+
+    def award(self, redis_client: Optional[RedisLike], award_id: Any) -> float:
+        """Атомарно забирает весь пул под award_id (обычно id спина)."""
+
+        if redis_client is None:
+            return 0.0
+        try:
+            script = self._script(redis_client, "award", _AWARD_LUA)
+            total = script(
+                keys=[AWARD_KEY % award_id] + self._keys(),
+                args=[_to_minor(self.seed), AWARD_RECORD_TTL],
+            )
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Jackpot award failed: %s", exc)
+            return 0.0
+        self._cached_value = None
+        return _from_minor(int(total or 0))
+
+    def refund(self, redis_client: Optional[RedisLike], award_id: Any, amount: float) -> None:
+        """Возвращает пул, если транзакцию спина с выплатой не удалось закоммитить."""
+
+        if redis_client is None or amount <= 0:
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.incrby(BASE_KEY, _to_minor(amount) - _to_minor(self.seed))
+            pipe.delete(AWARD_KEY % award_id)
+            pipe.execute()
+        except Exception as exc:  # pragma: no cover
+            logger.error("Jackpot refund of %s for award %s failed: %s", amount, award_id, exc)
+
+
+jackpot = Jackpot(
+    JACKPOT_SHARDS,
+    JACKPOT_CONTRIBUTION_RATE,
+    JACKPOT_SEED,
+    JACKPOT_REFERENCE_BET,
+    JACKPOT_HIT_ODDS,
+)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+RedisLike = Any
+
+KEY_PREFIX = "lb"
+BIGWIN_FEED_KEY = f"{KEY_PREFIX}:feed:bigwins"
+
+BIGWIN_MULTIPLIER = float(os.getenv("LEADERBOARD_BIGWIN_MULTIPLIER", "10"))
+BIGWIN_FEED_SIZE = int(os.getenv("LEADERBOARD_FEED_SIZE", "100"))
+# Минимальный оборот, после которого игрок попадает в рейтинг по RTP —
+# иначе один удачный спин даёт RTP 1000% и занимает первое место.
+RTP_MIN_BET_TOTAL = float(os.getenv("LEADERBOARD_RTP_MIN_BET_TOTAL", "100"))
+MAX_PAGE_SIZE = 100
+
+
+def _day_bucket(ts: datetime) -> str:
+    return ts.strftime("%Y%m%d")
+
+
+def _week_bucket(ts: datetime) -> str:
+    year, week, _ = ts.isocalendar()
+    return f"{year}W{week:02d}"
+
+
+# period -> (функция бакета, TTL ключей в секундах)
+PERIODS: Dict[str, Tuple[Callable[[datetime], str], int]] = {
+    "day": (_day_bucket, int(timedelta(days=2).total_seconds())),
+    "week": (_week_bucket, int(timedelta(days=8).total_seconds())),
+}
+
+BOARDS = ("wins", "rtp")
+
+
+# Одним вызовом обновляет суммы ставок/выигрышей игрока за период и,
+# если оборот достаточный, его позицию в рейтинге по RTP.
+_RTP_LUA = """
+local bet_total = tonumber(redis.call('HINCRBYFLOAT', KEYS[1], ARGV[1] .. ':bet', ARGV[2]))
+local win_total = tonumber(redis.call('HINCRBYFLOAT', KEYS[1], ARGV[1] .. ':win', ARGV[3]))
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+if bet_total >= tonumber(ARGV[4]) and bet_total > 0 then
+    redis.call('ZADD', KEYS[2], win_total / bet_total, ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[5])
+end
+return 1
+"""
+
+_rtp_script = None
+
+
+def _get_rtp_script(redis_client: RedisLike):
+    global _rtp_script
+    if _rtp_script is None:
+        _rtp_script = redis_client.register_script(_RTP_LUA)
+    return _rtp_script
+
+
+def board_key(board: str, period: str, bucket: str) -> str:
+    return f"{KEY_PREFIX}:{board}:{period}:{bucket}"
+
+
+def _sums_key(period: str, bucket: str) -> str:
+    return f"{KEY_PREFIX}:sums:{period}:{bucket}"
+
+
+def _parse_timestamp(value: Optional[str]) -> datetime:
+    if not value:
+        return datetime.utcnow()
+    try:
+        return datetime.fromisoformat(value.rstrip("Z"))
+    except ValueError:
+        return datetime.utcnow()
+
+
+def is_big_win(bet: float, win: float) -> bool:
+    return bet > 0 and win >= bet * BIGWIN_MULTIPLIER
+
+
+def record_spin_event(
+    redis_client: Optional[RedisLike], event: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """Инкрементально обновляет лидерборды по событию spin_performed.
+
+    Все записи идут одним pipeline. Возвращает запись для ленты крупных
+    выигрышей, если спин в неё попал, иначе None.
+    """
+
+    if redis_client is None or event.get("type") != "spin_performed":
+        return None
+
+    user_id = event["user_id"]
+    bet = float(event["bet"])
+    win = float(event["win"])
+    ts = _parse_timestamp(event.get("timestamp"))
+    member = str(user_id)
+
+    big_win: Optional[Dict[str, Any]] = None
+    if is_big_win(bet, win):
+        big_win = {
+            "spin_id": event.get("spin_id"),
+            "user_id": user_id,
+            "bet": bet,
+            "win": win,
+            "multiplier": round(win / bet, 2),
+            "symbols": event.get("symbols"),
+            "timestamp": event.get("timestamp"),
+        }
+
+    try:
+        script = _get_rtp_script(redis_client)
+        pipe = redis_client.pipeline(transaction=False)
+        for period, (bucket_fn, ttl) in PERIODS.items():
+            bucket = bucket_fn(ts)
+            if win > 0:
+                wins_key = board_key("wins", period, bucket)
+                pipe.zadd(wins_key, {member: win}, gt=True)
+                pipe.expire(wins_key, ttl)
+            script(
+                keys=[_sums_key(period, bucket), board_key("rtp", period, bucket)],
+                args=[member, bet, win, RTP_MIN_BET_TOTAL, ttl],
+                client=pipe,
+            )
+        if big_win is not None:
+            pipe.lpush(BIGWIN_FEED_KEY, json.dumps(big_win))
+            pipe.ltrim(BIGWIN_FEED_KEY, 0, BIGWIN_FEED_SIZE - 1)
+        pipe.execute()
+    except Exception as exc:  # pragma: no cover
+        logger.warning("Failed to update leaderboards: %s", exc)
+
+    return big_win
+
+
+def _clamp_page(offset: int, limit: int) -> Tuple[int, int]:
+    return max(offset, 0), min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def get_leaderboard(
+    redis_client: Optional[RedisLike],
+    board: str,
+    period: str,
+    offset: int = 0,
+    limit: int = 20,
+    at: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Страница лидерборда: ZREVRANGE, O(log N + limit), без обращения к БД."""
+
+    if board not in BOARDS:
+        raise ValueError(f"Unknown leaderboard: {board}")
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+
+    offset, limit = _clamp_page(offset, limit)
+    bucket = PERIODS[period][0](at or datetime.utcnow())
+    page: Dict[str, Any] = {
+        "board": board,
+        "period": period,
+        "bucket": bucket,
+        "offset": offset,
+        "limit": limit,
+        "total": 0,
+        "entries": [],
+    }
+    if redis_client is None:
+        return page
+
+    key = board_key(board, period, bucket)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zcard(key)
+        pipe.zrevrange(key, offset, offset + limit - 1, withscores=True)
+        total, rows = pipe.execute()
+    except Exception as exc:  # pragma: no cover
+        logger.warning("Failed to read leaderboard %s: %s", key, exc)
+        return page
+
+    page["total"] = int(total)
+    page["entries"] = [
+        {"rank": offset + index + 1, "user_id": int(member), "score": float(score)}
+        for index, (member, score) in enumerate(rows)
+    ]
+    return page
+
+
+def get_bigwin_feed(
+    redis_client: Optional[RedisLike], offset: int = 0, limit: int = 20
+) -> List[Dict[str, Any]]:
+    if redis_client is None:
+        return []
+
+    offset, limit = _clamp_page(offset, limit)
+    try:
+        raw = redis_client.lrange(BIGWIN_FEED_KEY, offset, offset + limit - 1)
+    except Exception as exc:  # pragma: no cover
+        logger.warning("Failed to read big-win feed: %s", exc)
+        return []
+
+    feed: List[Dict[str, Any]] = []
+    for item in raw:
+        try:
+            feed.append(json.loads(item))
+        except json.JSONDecodeError:
+            continue
+    return feed
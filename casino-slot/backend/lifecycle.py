@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Iterator, List
+
+from sqlalchemy import inspect, text
+
+from bonus import FLUSH_INTERVAL_SECONDS, bonus_engine
+from database import Base, SessionLocal, engine, read_engine
+from games import registry
+from integrations import get_rabbitmq_channel, get_redis
+from rollups import ROLLUP_INTERVAL_SECONDS, run_until_caught_up
+from jackpot import JACKPOT_BROADCAST_INTERVAL, JACKPOT_COMPACT_INTERVAL, jackpot
+from sharding import router
+from slot_services import reel_cache
+from wallet import WALLET_COMPACT_INTERVAL, wallet
+from ws_hub import hub
+
+
+logger = logging.getLogger(__name__)
+
+# Выставляется production-раннером после create_all в мастер-процессе,
+# чтобы воркеры не гонялись за DDL.
+SCHEMA_READY_ENV = "SCHEMA_READY"
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "2"))
+DRAIN_TIMEOUT = float(os.getenv("SPIN_DRAIN_TIMEOUT", "10"))
+
+
+def migrate_schema(bind) -> List[str]:
+    """Догоняет существующие таблицы до моделей: create_all их не трогает.
+
+    Недостающие колонки добавляются через ALTER TABLE ... ADD COLUMN
+    (всегда NULL-able — значения по умолчанию у моделей на стороне Python),
+    недостающие индексы создаются. Повторный запуск ничего не делает.
+    Возвращает список выполненных изменений.
+    """
+
+    inspector = inspect(bind)
+    preparer = bind.dialect.identifier_preparer
+    changes: List[str] = []
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        f"ADD COLUMN {preparer.format_column(column)} {column_type}"
+                    )
+                )
+                changes.append(f"{table.name}.{column.name}")
+
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+                    changes.append(f"index {index.name}")
+    return changes
+
+
+def init_schema(force: bool = False) -> None:
+    if not force and os.getenv(SCHEMA_READY_ENV) == "1":
+        return
+    import models  # noqa: F401  регистрирует таблицы в Base.metadata
+
+    targets = [engine]
+    if router.enabled:
+        targets.extend(shard.engine for shard in router.shards)
+    for target in targets:
+        Base.metadata.create_all(bind=target)
+        changes = migrate_schema(target)
+        if changes:
+            logger.info("Schema migrated on %s: %s", target.url, ", ".join(changes))
+
+
+def preload_reel_tables() -> int:
+    return reel_cache.reload()
+
+
+def warm_up_worker() -> None:
+    """Открывает пулы и прогревает кэши до того, как воркер примет трафик."""
+
+    started = time.perf_counter()
+
+    connections = []
+    try:
+        targets = [engine]
+        if router.enabled:
+            targets.extend(shard.engine for shard in router.shards)
+        for target in targets:
+            for _ in range(WARMUP_DB_CONNECTIONS):
+                connections.append(target.connect())
+    except Exception as exc:  # pragma: no cover
+        logger.warning("DB warm-up failed: %s", exc)
+    finally:
+        for connection in connections:
+            connection.close()
+
+    try:
+        tiers = preload_reel_tables()
+    except Exception as exc:  # pragma: no cover
+        logger.warning("Reel table preload failed: %s", exc)
+        tiers = 0
+
+    games = registry.load()
+
+    redis_client = get_redis()
+    redis_ok = redis_client is not None
+    jackpot.ensure_seeded(redis_client)
+    broker_ok = get_rabbitmq_channel() is not None
+
+    logger.info(
+        "Worker %s warmed up in %.0f ms (reel tiers=%s, games=%s, redis=%s, broker=%s)",
+        os.getpid(),
+        (time.perf_counter() - started) * 1000,
+        tiers,
+        games,
+        redis_ok,
+        broker_ok,
+    )
+
+
+class InFlightCounter:
+    """Счётчик спинов в обработке — чтобы воркер дождался их при остановке."""
+
+    def __init__(self) -> None:
+        self._count = 0
+        self._cond = threading.Condition()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @contextlib.contextmanager
+    def track(self) -> Iterator[None]:
+        with self._cond:
+            self._count += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._count -= 1
+                if self._count == 0:
+                    self._cond.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._count == 0, timeout=timeout)
+
+
+in_flight_spins = InFlightCounter()
+
+
+def flush_bonus_meters() -> int:
+    db = SessionLocal()
+    try:
+        return bonus_engine.flush(db, get_redis())
+    except Exception as exc:  # pragma: no cover
+        logger.warning("Bonus meter flush failed: %s", exc)
+        return 0
+    finally:
+        db.close()
+
+
+async def _bonus_flush_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+        await loop.run_in_executor(None, flush_bonus_meters)
+
+
+def run_rollups() -> int:
+    try:
+        return sum(router.scatter(run_until_caught_up, read=False))
+    except Exception as exc:  # pragma: no cover
+        logger.warning("Rollup pass failed: %s", exc)
+        return 0
+
+
+async def _rollup_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(ROLLUP_INTERVAL_SECONDS)
+        await loop.run_in_executor(None, run_rollups)
+
+
+def compact_wallets() -> int:
+    try:
+        return sum(router.scatter(wallet.compact_until_caught_up, read=False))
+    except Exception as exc:  # pragma: no cover
+        logger.warning("Wallet compaction failed: %s", exc)
+        return 0
+
+
+async def _wallet_compact_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(WALLET_COMPACT_INTERVAL)
+        await loop.run_in_executor(None, compact_wallets)
+
+
+async def _jackpot_compact_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(JACKPOT_COMPACT_INTERVAL)
+        await loop.run_in_executor(None, lambda: jackpot.compact(get_redis()))
+
+
+async def _jackpot_broadcast_loop() -> None:
+    # Не чаще раза в интервал и только при изменении пула
+    loop = asyncio.get_running_loop()
+    last_value = None
+    while True:
+        await asyncio.sleep(JACKPOT_BROADCAST_INTERVAL)
+        if not hub.subscriber_count("jackpot"):
+            continue
+        value = await loop.run_in_executor(None, lambda: jackpot.value(get_redis()))
+        if value != last_value:
+            last_value = value
+            await hub.broadcast("jackpot", {"type": "jackpot", "payload": {"value": value}})
+
+
+_background_tasks: List["asyncio.Task[None]"] = []
+
+
+def start_background_tasks() -> None:
+    """Фоновые задачи воркера; вызывается из async startup-хука."""
+    _background_tasks.append(asyncio.create_task(_bonus_flush_loop()))
+    # Подписка переподключается сама — запускаем и при недоступном Redis
+    _background_tasks.append(asyncio.create_task(hub.run_subscriber()))
+    _background_tasks.append(asyncio.create_task(_rollup_loop()))
+    _background_tasks.append(asyncio.create_task(_wallet_compact_loop()))
+    _background_tasks.append(asyncio.create_task(_jackpot_compact_loop()))
+    _background_tasks.append(asyncio.create_task(_jackpot_broadcast_loop()))
+
+
+def drain_worker() -> None:
+    if not in_flight_spins.wait_idle(DRAIN_TIMEOUT):
+        logger.warning(
+            "Worker %s shutting down with %s spins still in flight",
+            os.getpid(),
+            in_flight_spins.count,
+        )
+    for task in _background_tasks:
+        task.cancel()
+    _background_tasks.clear()
+    while flush_bonus_meters():
+        pass
+    engine.dispose()
+    read_engine.dispose()
+    if router.enabled:
+        router.dispose()
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from datetime import datetime
 from typing import List
@@ -5,22 +6,43 @@ import os
 import hashlib
 import secrets
 
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, status, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
-from database import Base, engine, get_db, SessionLocal
-from models import User, Spin, SessionData, ProvablyFairState
-from slot_engine import provably_fair_spin_reels, calculate_win
+from database import engine, get_db, get_read_db, read_engine
+from models import User, Spin, SessionData, ProvablyFairState, Experiment, UserDirectory
 from slot_services import (
-    get_reels_matrix_for_bet,
+    get_compiled_reels_for_user,
     acquire_spin_lock,
     release_spin_lock,
 )
+from lifecycle import (
+    drain_worker,
+    in_flight_spins,
+    init_schema,
+    start_background_tasks,
+    warm_up_worker,
+)
 from integrations import get_redis, publish_spin_event
+from static_assets import AssetStore, StaticAsset, asset_response
+from leaderboards import get_bigwin_feed, get_leaderboard, record_spin_event
+from ws_hub import hub
+from bonus import bonus_engine
+from jackpot import jackpot
+from experiments import arm_stats, record_arm_spin
+from rollups import active_users_report, ggr_report, merge_active_users, merge_ggr, user_report
+from sharding import get_user_db, get_user_read_db, router
+from idempotency import IdempotencyConflict, IdempotencyPending, idempotency_store
+from export import FORMATS as EXPORT_FORMATS, SOURCES as EXPORT_SOURCES, iter_spins, stream_export
+from ratelimit import RateLimitMiddleware
+from timing import ServerTimingMiddleware, instrument_engine, profiler, stage
+from wallet import InsufficientFunds, from_minor, to_minor, wallet
+from games import DEFAULT_GAME_ID, UnknownGame, get_game
+from serialization import FastJSONResponse, Frame, encode_model, frame, model_response, send_encoded
 
 # Password hashing
 def hash_password(password: str) -> str:
@@ -30,38 +52,84 @@ def verify_password(password: str, hashed: str) -> bool:
     return hash_password(password) == hashed
 
 
-Base.metadata.create_all(bind=engine)
+CORS_ORIGINS = [
+    origin.strip() for origin in os.getenv("CORS_ORIGINS", "*").split(",") if origin.strip()
+]
+# Без ADMIN_TOKEN служебные эндпоинты выключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-app = FastAPI(title="Casino Slot Backend", version="0.1.0")
 
+def _default_dir(*candidates: str) -> str:
+    for candidate in candidates:
+        if os.path.isdir(candidate):
+            return candidate
+    return candidates[0]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-app.mount(
-    "/app",
-    StaticFiles(directory="static", html=True),
-    name="frontend",
+# В контейнере бэкенд лежит в /app рядом со static/ и music/,
+# при локальном запуске — берём каталоги из репозитория.
+STATIC_DIR = os.getenv(
+    "STATIC_DIR",
+    _default_dir(
+        os.path.join(BASE_DIR, "static"),
+        os.path.join(BASE_DIR, "..", "frontend"),
+    ),
 )
-
-app.mount(
-    "/music",
-    StaticFiles(directory="/app/music"),
-    name="music",
+MUSIC_DIR = os.getenv(
+    "MUSIC_DIR",
+    _default_dir(
+        os.path.join(BASE_DIR, "music"),
+        os.path.join(BASE_DIR, "..", "..", "music"),
+    ),
 )
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+LANDING_MAX_AGE = int(os.getenv("LANDING_MAX_AGE", "86400"))
+
+frontend_assets = AssetStore(STATIC_DIR, STATIC_MAX_AGE, html=True)
+music_assets = AssetStore(MUSIC_DIR, STATIC_MAX_AGE)
+
+LANDING_CACHE_CONTROL = f"public, max-age={LANDING_MAX_AGE}"
+landing_page: StaticAsset | None = None
+
+
+def load_landing_page() -> StaticAsset:
+    global landing_page
+    if landing_page is None:
+        with open(os.path.join(BASE_DIR, "landing.html"), "rb") as fh:
+            landing_page = StaticAsset(fh.read(), "text/html; charset=utf-8")
+    return landing_page
+
+
+def start_worker() -> None:
+    init_schema()
+    load_landing_page()
+    frontend_assets.load()
+    music_assets.load()
+    warm_up_worker()
+
+
+def stop_worker() -> None:
+    drain_worker()
+
+
+async def frontend_root(request: Request) -> Response:
+    return RedirectResponse(str(request.url.replace(path="/app/")), status_code=307)
+
+
+async def frontend_file(path: str, request: Request) -> Response:
+    return frontend_assets.response(path, request)
+
+
+async def music_file(path: str, request: Request) -> Response:
+    return music_assets.response(path, request)
 
 
-@app.get("/debug/music")
 async def debug_music():
     """Debug endpoint to check music files"""
     import os
-    music_dir = "/app/music"
+    music_dir = MUSIC_DIR
     files = []
     if os.path.exists(music_dir):
         for file in os.listdir(music_dir):
@@ -85,404 +153,8 @@ async def debug_music():
     }
 
 
-@app.get("/", response_class=HTMLResponse)
-async def root_page() -> HTMLResponse:
-    return HTMLResponse(
-        """
-        <!DOCTYPE html>
-        <html lang="ru">
-        <head>
-          <meta charset="UTF-8" />
-          <title>Dazino Casino</title>
-          <meta name="viewport" content="width=device-width, initial-scale=1.0" />
-          <style>
-            * {
-              box-sizing: border-box;
-              margin: 0;
-              padding: 0;
-            }
-            
-            body {
-              font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
-              background: linear-gradient(135deg, #1e3a8a 0%, #312e81 50%, #1e1b4b 100%);
-              min-height: 100vh;
-              display: flex;
-              align-items: center;
-              justify-content: center;
-              padding: 20px;
-              color: white;
-            }
-            
-            .auth-container {
-              display: flex;
-              justify-content: center;
-              align-items: center;
-              min-height: 100vh;
-              width: 100%;
-            }
-
-            .auth-card {
-              background: rgba(30, 41, 59, 0.95);
-              backdrop-filter: blur(20px);
-              border-radius: 24px;
-              padding: 48px;
-              box-shadow: 0 20px 60px rgba(0, 0, 0, 0.4);
-              border: 1px solid rgba(148, 163, 184, 0.2);
-              width: 100%;
-              max-width: 420px;
-            }
-            
-            .auth-card h2 {
-              text-align: center;
-              margin-bottom: 32px;
-              font-size: 36px;
-              font-weight: 700;
-              color: #f1f5f9;
-              text-shadow: 0 2px 4px rgba(0, 0, 0, 0.3);
-            }
-            
-            .form-group {
-              margin-bottom: 24px;
-            }
-            
-            .form-group label {
-              display: block;
-              margin-bottom: 8px;
-              font-weight: 600;
-              font-size: 15px;
-              color: #e2e8f0;
-            }
-            
-            .auth-input {
-              width: 100%;
-              padding: 16px 20px;
-              border: 2px solid rgba(148, 163, 184, 0.3);
-              border-radius: 16px;
-              background: rgba(15, 23, 42, 0.8);
-              color: #f1f5f9;
-              font-size: 16px;
-              outline: none;
-              transition: all 0.3s ease;
-            }
-            
-            .auth-input:focus {
-              border-color: #3b82f6;
-              background: rgba(15, 23, 42, 0.9);
-              box-shadow: 0 0 0 3px rgba(59, 130, 246, 0.2);
-            }
-            
-            .auth-input::placeholder {
-              color: #94a3b8;
-            }
-            
-            .auth-button {
-              width: 100%;
-              padding: 18px 24px;
-              background: linear-gradient(135deg, #3b82f6, #2563eb);
-              border: none;
-              border-radius: 16px;
-              color: white;
-              font-size: 18px;
-              font-weight: 700;
-              cursor: pointer;
-              transition: all 0.3s ease;
-              text-transform: uppercase;
-              letter-spacing: 1.5px;
-              margin-bottom: 20px;
-              box-shadow: 0 10px 30px rgba(59, 130, 246, 0.3);
-            }
-            
-            .auth-button:hover:not(:disabled) {
-              transform: translateY(-2px);
-              box-shadow: 0 15px 40px rgba(59, 130, 246, 0.4);
-              background: linear-gradient(135deg, #2563eb, #1d4ed8);
-            }
-            
-            .auth-button:disabled {
-              opacity: 0.5;
-              cursor: not-allowed;
-              transform: none;
-            }
-            
-            .auth-switch {
-              width: 100%;
-              padding: 16px;
-              background: transparent;
-              border: 2px solid rgba(148, 163, 184, 0.3);
-              border-radius: 16px;
-              color: #e2e8f0;
-              font-size: 15px;
-              cursor: pointer;
-              transition: all 0.3s ease;
-              font-weight: 600;
-            }
-            
-            .auth-switch:hover {
-              background: rgba(59, 130, 246, 0.1);
-              border-color: rgba(59, 130, 246, 0.5);
-            }
-            
-            .error {
-              color: #ef4444;
-              font-size: 15px;
-              text-align: center;
-              margin-top: 12px;
-              padding: 12px 16px;
-              background: rgba(239, 68, 68, 0.15);
-              border-radius: 12px;
-              border: 1px solid rgba(239, 68, 68, 0.3);
-              display: none;
-              font-weight: 500;
-            }
-            
-            .success {
-              color: #10b981;
-              font-size: 15px;
-              text-align: center;
-              margin-top: 12px;
-              padding: 12px 16px;
-              background: rgba(16, 185, 129, 0.15);
-              border-radius: 12px;
-              border: 1px solid rgba(16, 185, 129, 0.3);
-              display: none;
-              font-weight: 500;
-            }
-            
-            .mode-toggle {
-              text-align: center;
-              margin-bottom: 24px;
-              font-size: 15px;
-              color: #cbd5e1;
-            }
-            
-            .mode-toggle button {
-              background: none;
-              border: none;
-              color: #3b82f6;
-              text-decoration: underline;
-              cursor: pointer;
-              font-size: 15px;
-              font-weight: 600;
-              transition: color 0.3s ease;
-            }
-            
-            .mode-toggle button:hover {
-              color: #2563eb;
-            }
-            
-            .password-input {
-              position: relative;
-            }
-            
-            .toggle-password {
-              position: absolute;
-              right: 16px;
-              top: 50%;
-              transform: translateY(-50%);
-              background: none;
-              border: none;
-              color: #94a3b8;
-              cursor: pointer;
-              font-size: 14px;
-              padding: 4px;
-            }
-            
-            .toggle-password:hover {
-              color: #e2e8f0;
-            }
-          </style>
-        </head>
-        <body>
-          <div class="auth-container">
-            <div class="auth-card">
-              <div class="mode-toggle">
-                <span id="mode-text">Нет аккаунта? </span>
-                <button id="toggle-mode">Зарегистрироваться</button>
-              </div>
-              <h2 id="form-title" style="color: white;">Вход</h2>
-              <form id="auth-form">
-                <div class="form-group">
-                  <label for="username">Логин</label>
-                  <input id="username" class="auth-input" type="text" required placeholder="Введите логин" />
-                </div>
-                <div class="form-group">
-                  <label for="password">Пароль</label>
-                  <div class="password-input">
-                    <input id="password" class="auth-input" type="password" required placeholder="Введите пароль" />
-                    <button type="button" class="toggle-password" id="toggle-password">👁️</button>
-                  </div>
-                </div>
-                <div class="form-group" id="balance-group" style="display: none;">
-                  <label for="balance">Начальный баланс</label>
-                  <input id="balance" class="auth-input" type="number" min="1" step="1" value="100" placeholder="100" />
-                </div>
-                <button id="submit-btn" class="auth-button" type="submit">Войти</button>
-                <div id="error" class="error"></div>
-                <div id="success" class="success"></div>
-              </form>
-            </div>
-          </div>
-          
-          <script>
-            const form = document.getElementById('auth-form');
-            const errorEl = document.getElementById('error');
-            const successEl = document.getElementById('success');
-            const submitBtn = document.getElementById('submit-btn');
-            const toggleBtn = document.getElementById('toggle-mode');
-            const modeText = document.getElementById('mode-text');
-            const formTitle = document.getElementById('form-title');
-            const balanceGroup = document.getElementById('balance-group');
-            const usernameInput = document.getElementById('username');
-            const passwordInput = document.getElementById('password');
-            const balanceInput = document.getElementById('balance');
-            const togglePasswordBtn = document.getElementById('toggle-password');
-            
-            let isLogin = true; // Start with login screen
-            
-            // Initialize login screen
-            function switchToLogin() {
-              isLogin = true;
-              formTitle.textContent = 'Вход';
-              submitBtn.textContent = 'Войти';
-              modeText.innerHTML = 'Нет аккаунта? <button id="toggle-mode">Зарегистрироваться</button>';
-              balanceGroup.style.display = 'none';
-              passwordInput.placeholder = 'Введите пароль';
-              usernameInput.placeholder = 'Введите логин';
-              errorEl.style.display = 'none';
-            }
-            
-            function switchToRegister() {
-              isLogin = false;
-              formTitle.textContent = 'Регистрация';
-              submitBtn.textContent = 'Зарегистрироваться';
-              modeText.innerHTML = 'Уже есть аккаунт? <button id="toggle-mode">Войти</button>';
-              balanceGroup.style.display = 'block';
-              passwordInput.placeholder = 'Введите пароль (минимум 4 символа)';
-              usernameInput.placeholder = 'Введите логин';
-              errorEl.style.display = 'none';
-            }
-            
-            // Initialize with login screen
-            switchToLogin();
-            
-            // Toggle password visibility
-            togglePasswordBtn.addEventListener('click', () => {
-              const type = passwordInput.type === 'password' ? 'text' : 'password';
-              passwordInput.type = type;
-              togglePasswordBtn.textContent = type === 'password' ? '👁️' : '👁️‍🗨️';
-            });
-            
-            // Toggle between login and register
-            toggleBtn.addEventListener('click', () => {
-              if (isLogin) {
-                switchToRegister();
-              } else {
-                switchToLogin();
-              }
-            });
-            
-            form.addEventListener('submit', async (e) => {
-              e.preventDefault();
-              errorEl.style.display = 'none';
-              successEl.style.display = 'none';
-              
-              const username = usernameInput.value.trim();
-              const password = passwordInput.value.trim();
-              const balanceRaw = balanceInput.value;
-              const initial_balance = parseFloat(balanceRaw || '100') || 100;
-              
-              if (!username) {
-                errorEl.textContent = 'Имя пользователя обязательно';
-                errorEl.style.display = 'block';
-                return;
-              }
-              
-              if (!password) {
-                errorEl.textContent = 'Пароль обязателен';
-                errorEl.style.display = 'block';
-                return;
-              }
-              
-              if (!isLogin && password.length < 4) {
-                errorEl.textContent = 'Пароль должен содержать минимум 4 символа';
-                errorEl.style.display = 'block';
-                return;
-              }
-              
-              submitBtn.disabled = true;
-              submitBtn.textContent = isLogin ? 'Вход...' : 'Регистрация...';
-              
-              const endpoint = isLogin ? '/login' : '/register';
-              const body = JSON.stringify({
-                username: username,
-                password: password,
-                initial_balance: initial_balance
-              });
-              
-              console.log('Password length:', password.length);
-              console.log('Initial balance:', initial_balance);
-              console.log('Request body:', body);
-              
-              const resp = await fetch(endpoint, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: body
-              });
-              
-              console.log('Response status:', resp.status);
-              console.log('Response ok:', resp.ok);
-              
-              const responseText = await resp.text();
-              console.log('Response text:', responseText);
-              
-              let data;
-              try {
-                data = JSON.parse(responseText);
-              } catch (e) {
-                console.log('Failed to parse JSON:', e);
-                data = {};
-              }
-
-              if (!resp.ok) {
-                let errorMessage = data.detail || (isLogin ? 'Ошибка входа' : 'Ошибка регистрации');
-                
-                // Special handling for login errors
-                if (isLogin && data.detail === 'User not found') {
-                  errorMessage = 'Пройдите регистрацию';
-                  // Auto-switch to registration after 2 seconds
-                  setTimeout(() => {
-                    switchToRegister();
-                  }, 2000);
-                } else if (isLogin && data.detail === 'Invalid password') {
-                  errorMessage = 'Неверный пароль';
-                } else if (!isLogin && data.detail === 'Username already taken') {
-                  errorMessage = 'Пользователь с таким логином уже существует';
-                }
-                
-                errorEl.textContent = errorMessage;
-                errorEl.style.display = 'block';
-                submitBtn.disabled = false;
-                submitBtn.textContent = isLogin ? 'Войти' : 'Зарегистрироваться';
-                return;
-              }
-              
-              successEl.textContent = isLogin ? 'Вход выполнен успешно!' : 'Регистрация прошла успешно!';
-              successEl.style.display = 'block';
-              
-              // Redirect to slot game after 1.5 seconds
-              setTimeout(() => {
-                window.location.href = '/app?' + new URLSearchParams({
-                  user_id: data.user_id,
-                  username: data.username
-                });
-              }, 1500);
-              
-            });
-          </script>
-        </body>
-        </html>
-        """
-    )
+async def root_page(request: Request) -> Response:
+    return asset_response(load_landing_page(), request, LANDING_CACHE_CONTROL)
 
 class HealthResponse(BaseModel):
     status: str
@@ -492,6 +164,8 @@ class SpinRequest(BaseModel):
     user_id: int
     bet: float
     client_seed: str | None = None
+    idempotency_key: str | None = None
+    game_id: str | None = None
 
 
 class SpinResponse(BaseModel):
@@ -502,7 +176,13 @@ class SpinResponse(BaseModel):
     server_seed_hash: str
     client_seed: str
     nonce: int
+    # Живой server_seed не отдаётся: раскрывается только при ротации (/pf/rotate)
     server_seed: str | None = None
+    free_spin: bool = False
+    free_spins_awarded: int = 0
+    jackpot_win: float = 0.0
+    game_id: str | None = None
+    cascades: List[List[str]] = []
 
 
 class RegisterRequest(BaseModel):
@@ -529,17 +209,97 @@ class PFRotationResponse(BaseModel):
     new_server_seed_hash: str
 
 
+class SpinHistoryItem(BaseModel):
+    spin_id: int
+    bet: float
+    win: float
+    symbols: List[str]
+    server_seed_hash: str | None = None
+    client_seed: str | None = None
+    nonce: int | None = None
+    game_id: str | None = None
+
+
+class SpinHistoryResponse(BaseModel):
+    user_id: int
+    items: List[SpinHistoryItem]
+    next_before_id: int | None = None
+
+
+class UserStatsResponse(BaseModel):
+    user_id: int
+    spin_count: int
+    total_bets: float
+    total_wins: float
+    current_rtp: float
+    loss_streak: int
+
+
 def process_spin(
-    user_id: int, bet: float, db: Session, client_seed: str | None = None
+    user_id: int,
+    bet: float,
+    db: Session,
+    client_seed: str | None = None,
+    game_id: str | None = None,
+) -> SpinResponse:
+    with in_flight_spins.track():
+        return _process_spin(user_id, bet, db, client_seed, game_id)
+
+
+def process_spin_idempotent(
+    user_id: int,
+    bet: float,
+    db: Session,
+    client_seed: str | None = None,
+    idempotency_key: str | None = None,
+    game_id: str | None = None,
 ) -> SpinResponse:
+    """Повтор с тем же ключом возвращает сохранённый ответ, а не новый спин."""
+
+    if not idempotency_key:
+        return process_spin(user_id, bet, db, client_seed, game_id)
+
+    try:
+        payload = idempotency_store.run(
+            get_redis(),
+            f"spin:{user_id}:{idempotency_key}",
+            f"{bet}:{client_seed or ''}:{game_id or ''}",
+            lambda: process_spin(user_id, bet, db, client_seed, game_id).dict(),
+        )
+    except IdempotencyConflict as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
+    except IdempotencyPending as exc:
+        raise HTTPException(status_code=status.HTTP_425_TOO_EARLY, detail=str(exc))
+    # Сохранённый ответ уже прошёл валидацию при первом спине
+    return SpinResponse.construct(**payload)
+
+
+def _process_spin(
+    user_id: int,
+    bet: float,
+    db: Session,
+    client_seed: str | None = None,
+    game_id: str | None = None,
+) -> SpinResponse:
+    try:
+        game = get_game(game_id)
+    except UnknownGame:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown game: {game_id}",
+        )
+
     redis_client = get_redis()
-    locked = acquire_spin_lock(redis_client, user_id)
+    with stage("redis"):
+        locked = acquire_spin_lock(redis_client, user_id)
     if not locked:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail="Spin already in progress",
         )
 
+    # Изменение кэша кошелька; откатывается в finally, если спин не закоммитился
+    cache_delta, committed = 0, False
     try:
         client_seed = client_seed or "default-client-seed"
 
@@ -555,10 +315,15 @@ def process_spin(
                 id=user_id,
                 username=f"user_{user_id}",
                 balance=1000.0,
+                initial_balance=1000.0,
             )
             db.add(user)
+            db.flush()
+            wallet.open_account(db, user.id, to_minor(user.balance))
             db.commit()
             db.refresh(user)
+        else:
+            wallet.ensure_account(db, user)
 
         pf_state = (
             db.query(ProvablyFairState)
@@ -578,37 +343,90 @@ def process_spin(
             )
             db.add(pf_state)
 
-        if user.balance < bet:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Insufficient balance",
-            )
-
-        user.balance -= bet
-
-        reels_matrix = get_reels_matrix_for_bet(db, bet, redis_client)
+        # Фриспин играется в своей игре по ставке и множителю, с которыми
+        # был выигран, и не списывает баланс
+        with stage("redis"):
+            free_spin = bonus_engine.take_free_spin(redis_client, user.id, game.game_id)
+        is_free_spin = free_spin is not None
+        stake = 0.0 if is_free_spin else bet
+        play_bet = free_spin.bet if is_free_spin else bet
+
+        # Резерв ставки — атомарная проверка по кэшу кошелька; строку users не трогаем
+        stake_minor = to_minor(stake)
+        with stage("wallet"):
+            if stake_minor:
+                try:
+                    balance_minor = wallet.debit(redis_client, db, user.id, stake_minor)
+                except InsufficientFunds:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Insufficient balance",
+                    )
+            else:
+                balance_minor = wallet.balance(redis_client, db, user.id) or 0
+        cache_delta = -stake_minor
+
+        # Тиры ReelWeights и эксперименты настроены под исходную игру;
+        # остальные игры крутятся на барабанах из своего описания
+        reels, arm = None, None
+        if game.game_id == DEFAULT_GAME_ID:
+            reels, arm = get_compiled_reels_for_user(play_bet, user.id)
+            if len(reels.reels) != game.reel_count:
+                reels = None
         current_nonce = pf_state.nonce or 0
-        symbols = provably_fair_spin_reels(
-            reels_matrix, pf_state.server_seed, client_seed, current_nonce
-        )
-        win = calculate_win(symbols, bet)
-        user.balance += win
+        with stage("rng"):
+            outcome = game.play(
+                pf_state.server_seed,
+                client_seed,
+                current_nonce,
+                play_bet,
+                reels,
+                free_spin.multiplier if is_free_spin else 1.0,
+            )
+        symbols, win = outcome.symbols, outcome.win
 
         pf_state.nonce = current_nonce + 1
 
         spin_record = Spin(
             user_id=user.id,
-            bet=bet,
+            bet=stake,
             win=win,
             symbols=json.dumps(symbols),
+            arm=arm,
+            game_id=game.game_id,
             pf_data={
                 "server_seed_hash": pf_state.server_seed_hash,
                 "server_seed": pf_state.server_seed,
                 "client_seed": client_seed,
                 "nonce": current_nonce,
+                "game_version": game.version,
             },
         )
         db.add(spin_record)
+        # id спина нужен записям кошелька и выплате джекпота
+        db.flush()
+
+        # Джекпот только на платных спинах; выплата привязана к id спина
+        jackpot_win = 0.0
+        if not is_free_spin and jackpot.is_hit(
+            pf_state.server_seed, client_seed, current_nonce, stake
+        ):
+            jackpot_win = jackpot.award(redis_client, spin_record.id)
+            spin_record.win = win + jackpot_win
+        total_win = win + jackpot_win
+
+        win_minor, jackpot_minor = to_minor(win), to_minor(jackpot_win)
+        wallet.append(
+            db,
+            user.id,
+            (("bet", -stake_minor), ("win", win_minor), ("jackpot", jackpot_minor)),
+            spin_id=spin_record.id,
+        )
+        balance_minor = wallet.credit(
+            redis_client, user.id, win_minor + jackpot_minor, balance_minor
+        )
+        cache_delta += win_minor + jackpot_minor
+        balance = from_minor(balance_minor)
 
         session_data = (
             db.query(SessionData).filter(SessionData.user_id == user.id).first()
@@ -625,31 +443,68 @@ def process_spin(
             db.add(session_data)
 
         session_data.spin_count += 1
-        session_data.total_bets += bet
-        session_data.total_wins += win
+        session_data.total_bets += stake
+        session_data.total_wins += total_win
 
         if session_data.total_bets > 0:
             session_data.current_rtp = session_data.total_wins / session_data.total_bets
         else:
             session_data.current_rtp = 0.0
 
-        if win <= 0:
+        if total_win <= 0:
             session_data.loss_streak += 1
         else:
             session_data.loss_streak = 0
 
-        db.commit()
-        db.refresh(user)
+        try:
+            db.commit()
+            committed = True
+        except Exception:
+            if is_free_spin:
+                bonus_engine.return_free_spin(redis_client, user.id, free_spin)
+            if jackpot_win:
+                jackpot.refund(redis_client, spin_record.id, jackpot_win)
+            raise
         db.refresh(spin_record)
         db.refresh(session_data)
 
+        awards = []
+        with stage("redis"):
+            if not is_free_spin:
+                awards = bonus_engine.record_spin(
+                    redis_client, user.id, bet, win, game_id=game.game_id
+                )
+                jackpot.contribute(redis_client, user.id, stake)
+            # Скаттеры на фриспине продлевают серию, только если игра это разрешает
+            free_config = game.free_spin_config
+            if outcome.free_spins and (
+                not is_free_spin or free_config.get("retrigger", True)
+            ):
+                awards += bonus_engine.award_free_spins(
+                    redis_client,
+                    user.id,
+                    game.game_id,
+                    outcome.free_spins,
+                    play_bet,
+                    float(free_config.get("multiplier", 1.0)),
+                    int(free_config.get("max_total", 0)),
+                    retrigger=is_free_spin,
+                )
+            if arm is not None:
+                record_arm_spin(redis_client, arm, user.id, stake, total_win)
+
         event = {
             "type": "spin_performed",
             "user_id": user.id,
-            "bet": bet,
-            "win": win,
+            "bet": stake,
+            "win": total_win,
+            "jackpot_win": jackpot_win,
             "symbols": symbols,
-            "balance_after": user.balance,
+            "cascades": outcome.cascades,
+            "game_id": game.game_id,
+            "free_spin": is_free_spin,
+            "bonus_awards": [award.to_dict() for award in awards],
+            "balance_after": balance,
             "spin_id": spin_record.id,
             "timestamp": datetime.utcnow().isoformat() + "Z",
             "pf": {
@@ -658,28 +513,68 @@ def process_spin(
                 "nonce": current_nonce,
             },
         }
-        publish_spin_event(event)
+        with stage("publish"):
+            publish_spin_event(event)
+
+            big_win = record_spin_event(redis_client, event)
+            if big_win is not None:
+                hub.publish_threadsafe("bigwins", {"type": "big_win", "payload": big_win})
+            if jackpot_win:
+                hub.publish_threadsafe(
+                    "jackpot",
+                    {
+                        "type": "jackpot_won",
+                        "payload": {
+                            "user_id": user.id,
+                            "amount": jackpot_win,
+                            "spin_id": spin_record.id,
+                        },
+                    },
+                )
+            # Остальные вкладки игрока (на любом воркере) узнают новый баланс
+            hub.publish_to_user(
+                user.id,
+                {
+                    "type": "balance",
+                    "payload": {
+                        "balance": balance,
+                        "spin_id": spin_record.id,
+                        "free_spins_awarded": sum(award.free_spins for award in awards),
+                    },
+                },
+                coalesce=True,
+            )
 
-        return SpinResponse(
+        # Поля собраны сервером и уже нужных типов — без повторной валидации
+        return SpinResponse.construct(
             symbols=symbols,
-            win=win,
-            balance=user.balance,
+            win=total_win,
+            balance=balance,
             spin_id=spin_record.id,
             server_seed_hash=pf_state.server_seed_hash,
             client_seed=client_seed,
             nonce=current_nonce,
-            server_seed=pf_state.server_seed,
+            free_spin=is_free_spin,
+            free_spins_awarded=sum(award.free_spins for award in awards),
+            jackpot_win=jackpot_win,
+            game_id=game.game_id,
+            cascades=outcome.cascades,
         )
     finally:
+        if not committed:
+            wallet.revert(redis_client, user_id, cache_delta)
         release_spin_lock(redis_client, user_id)
 
 
-@app.get("/health", response_model=HealthResponse)
+async def bind_ws_hub() -> None:
+    hub.bind_loop(asyncio.get_running_loop())
+    start_background_tasks()
+
+
 async def health() -> HealthResponse:
     return HealthResponse(status="ok")
 
 
-@app.post("/register", response_model=RegisterResponse)
 def register_user(request: RegisterRequest, db: Session = Depends(get_db)) -> RegisterResponse:
     print(f"Registration request: {request}")
     username = request.username.strip()
@@ -697,7 +592,8 @@ def register_user(request: RegisterRequest, db: Session = Depends(get_db)) -> Re
             detail="Password must be at least 4 characters",
         )
 
-    existing = db.query(User).filter(User.username == username).first()
+    lookup = UserDirectory if router.enabled else User
+    existing = db.query(lookup).filter(lookup.username == username).first()
     if existing is not None:
         print(f"Username '{username}' already taken")
         raise HTTPException(
@@ -706,17 +602,44 @@ def register_user(request: RegisterRequest, db: Session = Depends(get_db)) -> Re
         )
 
     hashed_password = hash_password(password)
-    user = User(username=username, password=hashed_password, balance=request.initial_balance)
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    user = User(
+        username=username,
+        password=hashed_password,
+        balance=request.initial_balance,
+        initial_balance=request.initial_balance,
+    )
+    if router.enabled:
+        # Глобальный id и уникальность имени даёт каталог в основной БД
+        entry = UserDirectory(username=username)
+        db.add(entry)
+        db.commit()
+        user.id = entry.user_id
+        shard_db = router.session(user.id)
+        try:
+            shard_db.add(user)
+            shard_db.flush()
+            wallet.open_account(shard_db, user.id, to_minor(request.initial_balance))
+            shard_db.commit()
+            shard_db.refresh(user)
+        except Exception:
+            shard_db.rollback()
+            db.delete(entry)
+            db.commit()
+            raise
+        finally:
+            shard_db.close()
+    else:
+        db.add(user)
+        db.flush()
+        wallet.open_account(db, user.id, to_minor(request.initial_balance))
+        db.commit()
+        db.refresh(user)
     
     print(f"User created: {user.id}, {user.username}, balance: {user.balance}")
 
     return RegisterResponse(user_id=user.id, username=user.username, balance=user.balance)
 
 
-@app.post("/login", response_model=RegisterResponse)
 def login_user(request: LoginRequest, db: Session = Depends(get_db)) -> RegisterResponse:
     username = request.username.strip()
     password = request.password
@@ -733,29 +656,251 @@ def login_user(request: LoginRequest, db: Session = Depends(get_db)) -> Register
             detail="Password is required",
         )
 
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
+    user_db = db
+    if router.enabled:
+        entry = db.query(UserDirectory).filter(UserDirectory.username == username).first()
+        if entry is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="User not found",
+            )
+        user_db = router.session(entry.user_id)
+
+    try:
+        user = user_db.query(User).filter(User.username == username).first()
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="User not found",
+            )
+
+        if not verify_password(password, user.password):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid password",
+            )
+
+        balance_minor = wallet.balance(get_redis(), user_db, user.id)
+    finally:
+        if user_db is not db:
+            user_db.close()
+
+    balance = user.balance if balance_minor is None else from_minor(balance_minor)
+    return RegisterResponse(user_id=user.id, username=user.username, balance=balance)
+
+
+def spin_slot(
+    request: SpinRequest,
+    idempotency_key: str | None = Header(None),
+) -> Response:
+    # Сессия на шарде игрока; user_id приходит в теле, поэтому не через Depends
+    db = router.session(request.user_id)
+    try:
+        result = process_spin_idempotent(
+            request.user_id,
+            request.bet,
+            db,
+            request.client_seed,
+            request.idempotency_key or idempotency_key,
+            request.game_id,
+        )
+        # response_model остаётся для схемы OpenAPI, ответ кодируется напрямую
+        return model_response(result)
+    finally:
+        db.close()
+
+
+def spin_history(
+    user_id: int,
+    before_id: int | None = None,
+    limit: int = 50,
+    db: Session = Depends(get_user_read_db),
+) -> SpinHistoryResponse:
+    limit = min(max(limit, 1), 200)
+    query = db.query(Spin).filter(Spin.user_id == user_id)
+    if before_id is not None:
+        query = query.filter(Spin.id < before_id)
+    rows = query.order_by(Spin.id.desc()).limit(limit).all()
+
+    items = []
+    for row in rows:
+        pf_data = row.pf_data or {}
+        items.append(
+            SpinHistoryItem(
+                spin_id=row.id,
+                bet=row.bet,
+                win=row.win,
+                symbols=json.loads(row.symbols or "[]"),
+                server_seed_hash=pf_data.get("server_seed_hash"),
+                client_seed=pf_data.get("client_seed"),
+                nonce=pf_data.get("nonce"),
+                game_id=row.game_id,
+            )
+        )
+
+    next_before_id = rows[-1].id if len(rows) == limit else None
+    return SpinHistoryResponse(user_id=user_id, items=items, next_before_id=next_before_id)
+
+
+def user_stats(user_id: int, db: Session = Depends(get_user_read_db)) -> UserStatsResponse:
+    session_data = (
+        db.query(SessionData).filter(SessionData.user_id == user_id).first()
+    )
+    if session_data is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No stats for user",
+        )
+
+    return UserStatsResponse(
+        user_id=user_id,
+        spin_count=session_data.spin_count or 0,
+        total_bets=session_data.total_bets or 0.0,
+        total_wins=session_data.total_wins or 0.0,
+        current_rtp=session_data.current_rtp or 0.0,
+        loss_streak=session_data.loss_streak or 0,
+    )
+
+
+def leaderboard(board: str, period: str = "day", offset: int = 0, limit: int = 20) -> dict:
+    try:
+        return get_leaderboard(get_redis(), board, period, offset, limit)
+    except ValueError as exc:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User not found",
+            detail=str(exc),
         )
-    
-    if not verify_password(password, user.password):
+
+
+def bigwin_feed(offset: int = 0, limit: int = 20) -> dict:
+    return {"offset": offset, "items": get_bigwin_feed(get_redis(), offset, limit)}
+
+
+def _report(build, *args, **kwargs) -> dict:
+    try:
+        return {"items": build(*args, **kwargs)}
+    except ValueError as exc:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid password",
+            detail=str(exc),
         )
 
-    return RegisterResponse(user_id=user.id, username=user.username, balance=user.balance)
 
+def ggr_rollup(
+    period: str = "day",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    bet_amount: float | None = None,
+) -> dict:
+    # У каждого шарда свои агрегаты — собираем со всех и сливаем
+    return _report(
+        lambda: merge_ggr(
+            router.scatter(lambda db: ggr_report(db, period, start, end, bet_amount))
+        )
+    )
+
+
+def active_users_rollup(
+    period: str = "day",
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> dict:
+    return _report(
+        lambda: merge_active_users(
+            router.scatter(lambda db: active_users_report(db, period, start, end))
+        )
+    )
+
+
+def user_rollup(
+    user_id: int,
+    period: str = "day",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    db: Session = Depends(get_user_read_db),
+) -> dict:
+    return _report(user_report, db, user_id, period, start, end)
+
+
+def experiment_stats(name: str, db: Session = Depends(get_read_db)) -> dict:
+    experiment = db.query(Experiment).filter(Experiment.name == name).first()
+    if experiment is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Experiment not found",
+        )
+    arms = [str(arm["name"]) for arm in experiment.arms]
+    return arm_stats(get_redis(), db, experiment.name, arms)
+
+
+def jackpot_value() -> dict:
+    return {"value": jackpot.value(get_redis())}
+
+
+def _require_admin(token: str | None) -> None:
+    if not ADMIN_TOKEN or not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+
+def export_spins(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    fmt: str = Query("ndjson", alias="format"),
+    gzip: bool = True,
+    after_id: int = 0,
+    user_id: int | None = None,
+    source: str = "db",
+    x_admin_token: str | None = Header(None),
+) -> StreamingResponse:
+    """Выгрузка спинов для регулятора; продолжение — after_id = последний spin_id."""
+
+    _require_admin(x_admin_token)
+    if fmt not in EXPORT_FORMATS or source not in EXPORT_SOURCES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of {EXPORT_FORMATS}, source one of {EXPORT_SOURCES}",
+        )
+    rows = iter_spins(start, end, after_id, user_id, source)
+    filename = f"spins_{after_id}.{fmt}" + (".gz" if gzip else "")
+    if gzip:
+        media_type = "application/gzip"
+    else:
+        media_type = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    return StreamingResponse(
+        stream_export(rows, fmt, gzip, header=after_id == 0),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+async def profile_worker(
+    seconds: float = 10.0,
+    interval_ms: float = 5.0,
+    x_admin_token: str | None = Header(None),
+) -> Response:
+    """Сэмплирует стеки этого воркера seconds секунд; ответ — collapsed stacks."""
 
-@app.post("/spin", response_model=SpinResponse)
-def spin_slot(request: SpinRequest, db: Session = Depends(get_db)) -> SpinResponse:
-    return process_spin(request.user_id, request.bet, db, request.client_seed)
+    _require_admin(x_admin_token)
+    if seconds <= 0 or interval_ms < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="seconds must be positive and interval_ms >= 1",
+        )
+    loop = asyncio.get_running_loop()
+    collapsed = await loop.run_in_executor(None, profiler.run, seconds, interval_ms / 1000)
+    if collapsed is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Profiler already running",
+        )
+    return Response(
+        content=collapsed,
+        media_type="text/plain",
+        headers={"X-Worker-Pid": str(os.getpid())},
+    )
 
 
-@app.post("/pf/rotate/{user_id}", response_model=PFRotationResponse)
-def rotate_server_seed(user_id: int, db: Session = Depends(get_db)) -> PFRotationResponse:
+def rotate_server_seed(user_id: int, db: Session = Depends(get_user_db)) -> PFRotationResponse:
     pf_state = (
         db.query(ProvablyFairState)
         .filter(ProvablyFairState.user_id == user_id)
@@ -791,7 +936,33 @@ def rotate_server_seed(user_id: int, db: Session = Depends(get_db)) -> PFRotatio
     )
 
 
-@app.websocket("/ws")
+WS_CHANNELS = ("bigwins", "jackpot")
+WS_INVALID_JSON = frame({"type": "error", "detail": "Invalid JSON"})
+WS_UNKNOWN_CHANNEL = frame({"type": "error", "detail": "Unknown channel"})
+WS_UNSUPPORTED_ACTION = frame({"type": "error", "detail": "Unsupported action"})
+WS_IDENTIFIED = frame({"type": "identified"})
+WS_SPIN_RESULT = Frame("spin_result")
+
+
+def ws_spin(user_id: int, bet: float, message: dict) -> SpinResponse:
+    """Спин из WebSocket. Синхронный, как /spin: вызывается через threadpool,
+    иначе ожидание дубля по ключу идемпотентности блокировало бы event loop.
+    """
+
+    db = router.session(user_id)
+    try:
+        return process_spin_idempotent(
+            user_id,
+            bet,
+            db,
+            message.get("client_seed"),
+            message.get("idempotency_key"),
+            message.get("game_id"),
+        )
+    finally:
+        db.close()
+
+
 async def websocket_endpoint(websocket: WebSocket) -> None:
     await websocket.accept()
     try:
@@ -799,26 +970,54 @@ async def websocket_endpoint(websocket: WebSocket) -> None:
             try:
                 message = await websocket.receive_json()
             except ValueError:
-                await websocket.send_json({"type": "error", "detail": "Invalid JSON"})
+                await websocket.send_text(WS_INVALID_JSON)
                 continue
 
             action = message.get("action")
+            if action == "subscribe":
+                channel = message.get("channel")
+                if channel not in WS_CHANNELS:
+                    await websocket.send_text(WS_UNKNOWN_CHANNEL)
+                    continue
+                hub.subscribe(channel, websocket)
+                await websocket.send_json({"type": "subscribed", "channel": channel})
+                if channel == "jackpot":
+                    await websocket.send_json(
+                        {"type": "jackpot", "payload": {"value": jackpot.value(get_redis())}}
+                    )
+                continue
+
+            if action == "identify":
+                hub.register_user(int(message.get("user_id", 1)), websocket)
+                await websocket.send_text(WS_IDENTIFIED)
+                continue
+
+            if action == "leaderboard":
+                try:
+                    page = get_leaderboard(
+                        get_redis(),
+                        message.get("board", "wins"),
+                        message.get("period", "day"),
+                        int(message.get("offset", 0)),
+                        int(message.get("limit", 20)),
+                    )
+                except ValueError as exc:
+                    await websocket.send_json({"type": "error", "detail": str(exc)})
+                    continue
+                await websocket.send_json({"type": "leaderboard", "payload": page})
+                continue
+
             if action != "spin":
-                await websocket.send_json(
-                    {"type": "error", "detail": "Unsupported action"}
-                )
+                await websocket.send_text(WS_UNSUPPORTED_ACTION)
                 continue
 
             user_id = int(message.get("user_id", 1))
             bet = float(message.get("bet", 0))
+            hub.register_user(user_id, websocket)
 
-            db = SessionLocal()
             try:
-                client_seed = message.get("client_seed")
-                result = process_spin(user_id, bet, db, client_seed)
-                await websocket.send_json(
-                    {"type": "spin_result", "payload": result.dict()}
-                )
+                result = await run_in_threadpool(ws_spin, user_id, bet, message)
+                await send_encoded(websocket, WS_SPIN_RESULT.wrap(encode_model(result)))
             except HTTPException as exc:
                 await websocket.send_json(
                     {
@@ -827,7 +1026,99 @@ async def websocket_endpoint(websocket: WebSocket) -> None:
                         "status_code": exc.status_code,
                     }
                 )
-            finally:
-                db.close()
     except WebSocketDisconnect:
         return
+    finally:
+        hub.unsubscribe_all(websocket)
+
+
+def create_app() -> FastAPI:
+    """Собирает приложение: middleware, маршруты и хуки жизненного цикла.
+
+    Импорт main дёшев — тяжёлая сборка маршрутов происходит только здесь,
+    поэтому CLI-утилиты могут импортировать process_spin без FastAPI-приложения.
+    """
+
+    app = FastAPI(
+        title="Casino Slot Backend",
+        version="0.1.0",
+        default_response_class=FastJSONResponse,
+    )
+
+    instrument_engine(engine)
+    if read_engine is not engine:
+        instrument_engine(read_engine)
+    if router.enabled:
+        for shard_engine in router.engines():
+            instrument_engine(shard_engine)
+
+    app.add_middleware(ServerTimingMiddleware)
+    # Внутри CORS, чтобы ответы 429 тоже несли CORS-заголовки
+    app.add_middleware(RateLimitMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.add_event_handler("startup", start_worker)
+    app.add_event_handler("startup", bind_ws_hub)
+    app.add_event_handler("shutdown", stop_worker)
+
+    app.add_api_route("/", root_page, methods=["GET"])
+    app.add_api_route("/app", frontend_root, methods=["GET"])
+    app.add_api_route("/app/{path:path}", frontend_file, methods=["GET", "HEAD"])
+    app.add_api_route("/music/{path:path}", music_file, methods=["GET", "HEAD"])
+    app.add_api_route("/debug/music", debug_music, methods=["GET"])
+
+    app.add_api_route("/health", health, methods=["GET"], response_model=HealthResponse)
+    app.add_api_route(
+        "/register", register_user, methods=["POST"], response_model=RegisterResponse
+    )
+    app.add_api_route(
+        "/login", login_user, methods=["POST"], response_model=RegisterResponse
+    )
+    app.add_api_route("/spin", spin_slot, methods=["POST"], response_model=SpinResponse)
+    app.add_api_route(
+        "/pf/rotate/{user_id}",
+        rotate_server_seed,
+        methods=["POST"],
+        response_model=PFRotationResponse,
+    )
+
+    app.add_api_route(
+        "/users/{user_id}/spins",
+        spin_history,
+        methods=["GET"],
+        response_model=SpinHistoryResponse,
+    )
+    app.add_api_route(
+        "/users/{user_id}/stats",
+        user_stats,
+        methods=["GET"],
+        response_model=UserStatsResponse,
+    )
+    app.add_api_route("/leaderboard/{board}", leaderboard, methods=["GET"])
+    app.add_api_route("/feed/bigwins", bigwin_feed, methods=["GET"])
+    app.add_api_route("/jackpot", jackpot_value, methods=["GET"])
+    app.add_api_route("/experiments/{name}/stats", experiment_stats, methods=["GET"])
+    app.add_api_route("/reports/ggr", ggr_rollup, methods=["GET"])
+    app.add_api_route("/reports/active-users", active_users_rollup, methods=["GET"])
+    app.add_api_route("/reports/users/{user_id}", user_rollup, methods=["GET"])
+    app.add_api_route("/admin/profile", profile_worker, methods=["POST"])
+    app.add_api_route("/admin/export/spins", export_spins, methods=["GET"])
+
+    app.add_api_websocket_route("/ws", websocket_endpoint)
+    return app
+
+
+def __getattr__(name: str):
+    # `uvicorn main:app` и production.py получают приложение лениво,
+    # один раз на процесс.
+    if name == "app":
+        app = create_app()
+        globals()["app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, JSON, DateTime
+from sqlalchemy import BigInteger, Boolean, Column, Integer, Float, String, JSON, DateTime, UniqueConstraint
 from database import Base
 from datetime import datetime
 
@@ -7,17 +7,21 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True, nullable=False)
     password = Column(String, nullable=False)
-    balance = Column(Float, default=0.0)
+    balance = Column(Float, default=0.0)  # Зеркало кошелька, обновляется при компакции (см. wallet.py)
+    initial_balance = Column(Float, nullable=True)  # Для сверки баланса с историей спинов
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class Spin(Base):
     __tablename__ = "spins"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer)
+    user_id = Column(Integer, index=True)
     bet = Column(Float)
     win = Column(Float)
     symbols = Column(String)  # JSON строка с исходами
     pf_data = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=True)
+    arm = Column(String, nullable=True)  # "эксперимент:плечо", если игрок в эксперименте
+    game_id = Column(String, nullable=True)  # id игры из games.json; NULL — спины до реестра игр
 
 class BonusMeter(Base):
     __tablename__ = "bonus_meters"
@@ -42,6 +46,7 @@ class ReelWeights(Base):
     id = Column(Integer, primary_key=True)
     bet_amount = Column(Float)
     reels = Column(JSON)  # Динамические веса
+    arm = Column(String, nullable=True, index=True)  # None — основная таблица
 
 class ProvablyFairState(Base):
     __tablename__ = "provably_fair_state"
@@ -49,4 +54,62 @@ class ProvablyFairState(Base):
     user_id = Column(Integer, unique=True, index=True)
     server_seed = Column(String)
     server_seed_hash = Column(String)
-    nonce = Column(Integer, default=0)
\ No newline at end of file
+    nonce = Column(Integer, default=0)
+
+class RollupBetTier(Base):
+    __tablename__ = "rollup_bet_tier"
+    __table_args__ = (UniqueConstraint("period", "bucket_start", "bet_amount"),)
+    id = Column(Integer, primary_key=True)
+    period = Column(String, nullable=False)  # hour | day
+    bucket_start = Column(DateTime, nullable=False, index=True)
+    bet_amount = Column(Float, nullable=False)
+    spins = Column(Integer, default=0)
+    total_bet = Column(Float, default=0.0)
+    total_win = Column(Float, default=0.0)
+
+class RollupUser(Base):
+    __tablename__ = "rollup_user"
+    __table_args__ = (UniqueConstraint("period", "bucket_start", "user_id"),)
+    id = Column(Integer, primary_key=True)
+    period = Column(String, nullable=False)
+    bucket_start = Column(DateTime, nullable=False, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    spins = Column(Integer, default=0)
+    total_bet = Column(Float, default=0.0)
+    total_win = Column(Float, default=0.0)
+
+class RollupWatermark(Base):
+    __tablename__ = "rollup_watermarks"
+    name = Column(String, primary_key=True)
+    last_spin_id = Column(Integer, default=0, nullable=False)
+
+class Experiment(Base):
+    __tablename__ = "experiments"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+    salt = Column(String, nullable=False)
+    arms = Column(JSON, nullable=False)  # [{"name": "control", "weight": 50}, ...]
+    active = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class WalletEntry(Base):
+    __tablename__ = "wallet_entries"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    amount = Column(BigInteger, nullable=False)  # В копейках: < 0 списание, > 0 зачисление
+    kind = Column(String, nullable=False)  # opening | bet | win | jackpot
+    spin_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class WalletSnapshot(Base):
+    __tablename__ = "wallet_snapshots"
+    user_id = Column(Integer, primary_key=True)
+    balance = Column(BigInteger, default=0, nullable=False)  # В копейках, с учётом записей до last_entry_id
+    last_entry_id = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class UserDirectory(Base):
+    """username -> user_id в основной БД; при шардировании выдаёт глобальные id."""
+    __tablename__ = "user_directory"
+    user_id = Column(Integer, primary_key=True)
+    username = Column(String, unique=True, index=True, nullable=False)
@@ -0,0 +1,323 @@
+"""Подбор целочисленных весов барабанов под целевой RTP для каждого тира ставок.
+
+    python optimizer.py --tier 1:0.94 --tier 10:0.96 --hit-min 0.05 --hit-max 0.2 \\
+        --max-std 3.0 --workers 8 --verify-spins 2000000
+    python optimizer.py --tier 1:0.95 --insert     # сразу записать в reel_weights
+    python optimizer.py --tier 1:0.97 --insert --arm rtp97:test   # таблица плеча эксперимента
+
+Каждый процесс пула запускает локальный поиск (hill climbing с уменьшающимся
+шагом) из случайной стартовой точки; кандидаты оцениваются точной формулой
+(simulator.exact_stats), победитель по тиру дополнительно проверяется
+векторной симуляцией. Целевой RTP включает долю джекпота при ставке тира
+(jackpot.expected_rtp) и бонусных фриспинов из bonus_rules
+(simulator.bonus_stake_rate), так что барабаны добирают только остаток.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from bonus_rules import BonusRule, load_bonus_rules
+from jackpot import jackpot
+from simulator import exact_stats, simulate
+from slot_engine import DEFAULT_REELS_MATRIX, SYMBOL_PAYOUTS, ReelMatrix
+
+
+class SearchSpec:
+    __slots__ = (
+        "symbols",
+        "payouts",
+        "target_rtp",
+        "rtp_tolerance",
+        "hit_band",
+        "std_band",
+        "weight_range",
+        "iterations",
+        "jackpot_rtp",
+        "bet_amount",
+        "rules",
+    )
+
+    def __init__(
+        self,
+        symbols: Sequence[Sequence[str]],
+        payouts: Dict[str, float],
+        target_rtp: float,
+        rtp_tolerance: float,
+        hit_band: Tuple[float, float],
+        std_band: Tuple[float, float],
+        weight_range: Tuple[int, int],
+        iterations: int,
+        jackpot_rtp: float = 0.0,
+        bet_amount: float = 1.0,
+        rules: Sequence[BonusRule] = (),
+    ) -> None:
+        self.symbols = [list(reel) for reel in symbols]
+        self.payouts = payouts
+        self.target_rtp = target_rtp
+        self.rtp_tolerance = rtp_tolerance
+        self.hit_band = hit_band
+        self.std_band = std_band
+        self.weight_range = weight_range
+        self.iterations = iterations
+        self.jackpot_rtp = jackpot_rtp
+        self.bet_amount = bet_amount
+        self.rules = list(rules)
+
+
+def _to_matrix(symbols: Sequence[Sequence[str]], weights: Sequence[Sequence[int]]) -> ReelMatrix:
+    return [
+        [{"symbol": symbol, "weight": int(weight)} for symbol, weight in zip(reel_symbols, reel_weights)]
+        for reel_symbols, reel_weights in zip(symbols, weights)
+    ]
+
+
+def _penalty(stats: Dict[str, float], spec: SearchSpec) -> float:
+    """0 — таблица удовлетворяет всем ограничениям."""
+
+    penalty = max(abs(stats["rtp"] - spec.target_rtp) - spec.rtp_tolerance, 0.0)
+    hit_min, hit_max = spec.hit_band
+    penalty += max(hit_min - stats["hit_frequency"], 0.0)
+    penalty += max(stats["hit_frequency"] - hit_max, 0.0)
+    std_min, std_max = spec.std_band
+    # σ измеряется в ставках и на порядок крупнее RTP — масштабируем
+    penalty += 0.01 * max(std_min - stats["std_dev"], 0.0)
+    penalty += 0.01 * max(stats["std_dev"] - std_max, 0.0)
+    return penalty
+
+
+def _objective(stats: Dict[str, float], spec: SearchSpec) -> float:
+    # Среди допустимых предпочитаем точнее попавшие в целевой RTP
+    return _penalty(stats, spec) * 1000.0 + abs(stats["rtp"] - spec.target_rtp)
+
+
+def search(task: Tuple[float, SearchSpec, int]) -> Dict[str, Any]:
+    """Один локальный поиск; выполняется в процессе пула."""
+
+    bet_amount, spec, seed = task
+    rng = random.Random(seed)
+    low, high = spec.weight_range
+    weights = [[rng.randint(low, high) for _ in reel] for reel in spec.symbols]
+
+    def evaluate(candidate: List[List[int]]) -> Tuple[float, Dict[str, float]]:
+        stats = exact_stats(
+            _to_matrix(spec.symbols, candidate),
+            spec.payouts,
+            spec.jackpot_rtp,
+            spec.rules,
+            spec.bet_amount,
+        )
+        return _objective(stats, spec), stats
+
+    best_score, best_stats = evaluate(weights)
+    step = max((high - low) // 4, 1)
+    stale = 0
+
+    for _ in range(spec.iterations):
+        reel_index = rng.randrange(len(weights))
+        cell_index = rng.randrange(len(weights[reel_index]))
+        old = weights[reel_index][cell_index]
+        new = min(max(old + rng.choice((-1, 1)) * rng.randint(1, step), low), high)
+        if new == old:
+            continue
+
+        weights[reel_index][cell_index] = new
+        score, stats = evaluate(weights)
+        if score < best_score:
+            best_score, best_stats = score, stats
+            stale = 0
+            if _penalty(stats, spec) == 0.0 and abs(stats["rtp"] - spec.target_rtp) < 1e-5:
+                break
+        else:
+            weights[reel_index][cell_index] = old
+            stale += 1
+            if stale > 200:
+                step = max(step // 2, 1)
+                stale = 0
+
+    return {
+        "bet_amount": bet_amount,
+        "seed": seed,
+        "score": best_score,
+        "compliant": _penalty(best_stats, spec) == 0.0,
+        "reels": _to_matrix(spec.symbols, weights),
+        "stats": best_stats,
+    }
+
+
+def optimize(
+    tiers: Sequence[Tuple[float, float]],
+    template: Optional[ReelMatrix] = None,
+    paytable: Optional[Dict[str, float]] = None,
+    rtp_tolerance: float = 0.002,
+    hit_band: Tuple[float, float] = (0.0, 1.0),
+    std_band: Tuple[float, float] = (0.0, math.inf),
+    weight_range: Tuple[int, int] = (1, 200),
+    iterations: int = 5000,
+    restarts: int = 16,
+    workers: Optional[int] = None,
+    seed: int = 0,
+    with_jackpot: bool = True,
+    rules: Optional[Sequence[BonusRule]] = None,
+) -> List[Dict[str, Any]]:
+    """rules — правила бонусных фриспинов (None — load_bonus_rules(), [] — без бонусов)."""
+
+    template = template or DEFAULT_REELS_MATRIX
+    rules = load_bonus_rules() if rules is None else rules
+    symbols = [[cell["symbol"] for cell in reel] for reel in template]
+    tasks = []
+    for bet_amount, target_rtp in tiers:
+        spec = SearchSpec(
+            symbols,
+            paytable or SYMBOL_PAYOUTS,
+            target_rtp,
+            rtp_tolerance,
+            hit_band,
+            std_band,
+            weight_range,
+            iterations,
+            jackpot.expected_rtp(bet_amount) if with_jackpot else 0.0,
+            bet_amount,
+            rules,
+        )
+        for _ in range(restarts):
+            tasks.append((bet_amount, spec, seed * 1_000_003 + len(tasks)))
+
+    with Pool(processes=workers or os.cpu_count()) as pool:
+        results = pool.map(search, tasks)
+
+    best: Dict[float, Dict[str, Any]] = {}
+    for result in results:
+        current = best.get(result["bet_amount"])
+        if current is None or result["score"] < current["score"]:
+            best[result["bet_amount"]] = result
+
+    output = []
+    for bet_amount, target_rtp in tiers:
+        result = best[bet_amount]
+        output.append(
+            {
+                "bet_amount": bet_amount,
+                "reels": result["reels"],
+                "compliant": result["compliant"],
+                "target": {
+                    "rtp": target_rtp,
+                    "rtp_tolerance": rtp_tolerance,
+                    "hit_frequency": list(hit_band),
+                    "std_dev": [std_band[0], None if math.isinf(std_band[1]) else std_band[1]],
+                },
+                "stats": result["stats"],
+            }
+        )
+    return output
+
+
+def insert_tables(tables: Sequence[Dict[str, Any]], arm: Optional[str] = None) -> List[int]:
+    """Записывает только прошедшие проверку таблицы как строки ReelWeights.
+
+    arm — тег плеча эксперимента ("эксперимент:плечо"); None — основные тиры.
+    """
+
+    from database import SessionLocal
+    from models import ReelWeights
+
+    db = SessionLocal()
+    try:
+        rows = [
+            ReelWeights(bet_amount=table["bet_amount"], reels=table["reels"], arm=arm)
+            for table in tables
+            if table["compliant"]
+        ]
+        db.add_all(rows)
+        db.commit()
+        return [row.id for row in rows]
+    finally:
+        db.close()
+
+
+def _parse_tier(value: str) -> Tuple[float, float]:
+    bet, _, rtp = value.partition(":")
+    return float(bet), float(rtp)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tier", action="append", type=_parse_tier, required=True,
+                        help="BET:TARGET_RTP, например 1:0.95")
+    parser.add_argument("--template", help="JSON с раскладкой символов по барабанам")
+    parser.add_argument("--paytable", help="JSON {symbol: multiplier}")
+    parser.add_argument("--rtp-tolerance", type=float, default=0.002)
+    parser.add_argument("--hit-min", type=float, default=0.0)
+    parser.add_argument("--hit-max", type=float, default=1.0)
+    parser.add_argument("--min-std", type=float, default=0.0)
+    parser.add_argument("--max-std", type=float, default=math.inf)
+    parser.add_argument("--min-weight", type=int, default=1)
+    parser.add_argument("--max-weight", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--restarts", type=int, default=16)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verify-spins", type=int, default=0,
+                        help="перепроверить победителей векторной симуляцией")
+    parser.add_argument("--insert", action="store_true")
+    parser.add_argument("--arm", help="записать как таблицы плеча эксперимента")
+    parser.add_argument("--no-jackpot", action="store_true",
+                        help="не учитывать долю джекпота в целевом RTP")
+    parser.add_argument("--no-bonus", action="store_true",
+                        help="не учитывать бонусные фриспины в целевом RTP")
+    args = parser.parse_args(argv)
+
+    def _load(path: Optional[str]) -> Any:
+        if not path:
+            return None
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+
+    rules = [] if args.no_bonus else load_bonus_rules()
+    tables = optimize(
+        args.tier,
+        template=_load(args.template),
+        paytable=_load(args.paytable),
+        rtp_tolerance=args.rtp_tolerance,
+        hit_band=(args.hit_min, args.hit_max),
+        std_band=(args.min_std, args.max_std),
+        weight_range=(args.min_weight, args.max_weight),
+        iterations=args.iterations,
+        restarts=args.restarts,
+        workers=args.workers,
+        seed=args.seed,
+        with_jackpot=not args.no_jackpot,
+        rules=rules,
+    )
+
+    if args.verify_spins:
+        # Немного игроков с длинными сессиями: счётчики бонусов должны
+        # успеть сработать много раз, иначе rtp_bonus занижен
+        players = 200
+        for table in tables:
+            table["simulated"] = simulate(
+                table["reels"],
+                bet=table["bet_amount"],
+                players=players,
+                paytable=args.paytable and _load(args.paytable),
+                spins=max(args.verify_spins // players, 1),
+                rules=rules,
+                seed=args.seed,
+                with_jackpot=not args.no_jackpot,
+            )
+
+    if args.insert:
+        for table, row_id in zip([t for t in tables if t["compliant"]], insert_tables(tables, args.arm)):
+            table["reel_weights_id"] = row_id
+
+    print(json.dumps(tables, indent=2))
+    return 0 if all(table["compliant"] for table in tables) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from integrations import get_redis, redis_url
+
+
+logger = logging.getLogger(__name__)
+
+RedisLike = Any
+
+# Правило: (ключ, токенов в секунду, ёмкость ведра). Ключ "ip" или "user".
+Rule = Tuple[str, float, int]
+
+# Лимиты по умолчанию; переопределяются JSON в RATE_LIMITS:
+#   {"POST /spin": [["ip", 20, 40], ["user", 5, 10]], "POST /login": []}
+DEFAULT_LIMITS: Dict[str, List[Rule]] = {
+    "POST /register": [("ip", 0.2, 5)],
+    "POST /login": [("ip", 1.0, 10)],
+    "POST /spin": [("ip", 20.0, 40), ("user", 5.0, 10)],
+}
+RATE_LIMIT_LOCAL_MAX = int(os.getenv("RATE_LIMIT_LOCAL_MAX", "50000"))
+# За доверенным прокси берём клиента из X-Forwarded-For
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+# Тело больше этого не разбираем в поисках user_id
+MAX_INSPECT_BODY = 16 * 1024
+
+KEY_PREFIX = "rl:"
+
+
+def load_limits() -> Dict[str, List[Rule]]:
+    limits = dict(DEFAULT_LIMITS)
+    raw = os.getenv("RATE_LIMITS")
+    if raw:
+        try:
+            for route, rules in json.loads(raw).items():
+                limits[route] = [(str(kind), float(rate), int(burst)) for kind, rate, burst in rules]
+        except (TypeError, ValueError) as exc:
+            logger.warning("Invalid RATE_LIMITS, using defaults: %s", exc)
+            limits = dict(DEFAULT_LIMITS)
+    return limits
+
+
+# Ведро в hash {tokens, ts}; время берём у Redis, чтобы часы воркеров не влияли.
+# ARGV: rate (токенов/с), burst. Возвращает {1, 0} или {0, ждать_мс}.
+_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait_ms = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, wait_ms}
+"""
+
+
+class LocalBuckets:
+    """Приблизительные вёдра в памяти воркера, LRU по числу ключей.
+
+    Воркер видит только свою долю трафика, поэтому пустое локальное ведро
+    означает, что клиент превысил лимит даже без учёта остальных воркеров —
+    такой запрос можно отбить, не ходя в Redis.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int, now: Optional[float] = None) -> float:
+        """Списывает токен; возвращает 0 или сколько секунд ждать."""
+
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(burst), now]
+                if len(self._buckets) > self.max_entries:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return (1 - tokens) / rate
+            bucket[0] = tokens - 1
+            return 0.0
+
+
+class RateLimiter:
+    """Token bucket на Redis (Lua, атомарно между воркерами) с локальной предпроверкой.
+
+    Без Redis или при его ошибке работают только локальные вёдра — лимит
+    становится «на воркер», но трафик не режется из-за сбоя Redis.
+    """
+
+    def __init__(self, limits: Dict[str, List[Rule]], max_local_entries: int) -> None:
+        self.limits = limits
+        self.local = LocalBuckets(max_local_entries)
+        self._redis = None
+        self._redis_checked = False
+        self._script = None
+
+    def rules_for(self, method: str, path: str) -> List[Rule]:
+        return self.limits.get(f"{method} {path}", [])
+
+    def _client(self):
+        if not self._redis_checked:
+            self._redis_checked = True
+            if get_redis() is not None:
+                try:
+                    import redis.asyncio as redis_async
+
+                    self._redis = redis_async.Redis.from_url(redis_url(), decode_responses=True)
+                    self._script = self._redis.register_script(_BUCKET_LUA)
+                except ImportError:  # pragma: no cover
+                    self._redis = None
+        return self._redis
+
+    async def check(self, route: str, subjects: List[Tuple[Rule, str]]) -> float:
+        """Проверяет все правила маршрута; 0 — пропустить, иначе Retry-After в секундах."""
+
+        # Сначала дешёвые локальные вёдра: явный перебор отбиваем без сети
+        for (kind, rate, burst), subject in subjects:
+            wait = self.local.take(f"{route}:{kind}:{subject}", rate, burst)
+            if wait:
+                return wait
+
+        if self._client() is None:
+            return 0.0
+        for (kind, rate, burst), subject in subjects:
+            try:
+                allowed, wait_ms = await self._script(
+                    keys=[f"{KEY_PREFIX}{route}:{kind}:{subject}"], args=[rate, burst]
+                )
+            except Exception as exc:  # pragma: no cover
+                logger.warning("Rate limiter Redis check failed: %s", exc)
+                return 0.0
+            if not int(allowed):
+                return int(wait_ms) / 1000
+        return 0.0
+
+
+def _client_ip(scope: Dict[str, Any]) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _user_from_body(body: bytes) -> Optional[str]:
+    if not body or len(body) > MAX_INSPECT_BODY:
+        return None
+    try:
+        user_id = json.loads(body).get("user_id")
+    except (AttributeError, ValueError):
+        return None
+    return None if user_id is None else str(user_id)
+
+
+class RateLimitMiddleware:
+    """ASGI middleware: режет перебор до роутинга, зависимостей и пула БД.
+
+    user_id для правил "user" берётся из JSON-тела; тело читается один раз
+    и отдаётся приложению заново.
+    """
+
+    def __init__(self, app: Any, limiter: Optional[RateLimiter] = None) -> None:
+        self.app = app
+        self.limiter = limiter or rate_limiter
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = f"{scope['method']} {scope['path']}"
+        rules = self.limiter.rules_for(scope["method"], scope["path"])
+        if not rules:
+            await self.app(scope, receive, send)
+            return
+
+        subjects: List[Tuple[Rule, str]] = []
+        if any(rule[0] == "user" for rule in rules):
+            chunks = []
+            while True:
+                message = await receive()
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body = b"".join(chunks)
+            replayed = False
+
+            async def receive_replay():
+                nonlocal replayed
+                if not replayed:
+                    replayed = True
+                    return {"type": "http.request", "body": body, "more_body": False}
+                return await receive()
+
+            receive = receive_replay
+            user = _user_from_body(body)
+        else:
+            user = None
+
+        for rule in rules:
+            if rule[0] == "ip":
+                subjects.append((rule, _client_ip(scope)))
+            elif rule[0] == "user" and user is not None:
+                subjects.append((rule, user))
+
+        wait = await self.limiter.check(route, subjects)
+        if wait:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"retry-after", str(max(1, int(wait + 0.999))).encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": b'{"detail":"Too many requests"}'})
+            return
+        await self.app(scope, receive, send)
+
+
+rate_limiter = RateLimiter(load_limits(), RATE_LIMIT_LOCAL_MAX)
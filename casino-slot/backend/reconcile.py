@@ -0,0 +1,311 @@
+"""Сверка баланса игрока с историей спинов: initial_balance + Σ(win − bet).
+
+    python reconcile.py --workers 8 --checkpoint recon.json > recon_report.json
+    python reconcile.py --checkpoint recon.json            # продолжить прерванный прогон
+    python reconcile.py --archive-dir ./archive            # учесть архивные сегменты
+
+Пользователи режутся на диапазоны id, диапазоны обрабатываются в пуле
+процессов. Каждый диапазон читается одной read-only транзакцией
+REPEATABLE READ (баланс и спины из одного снимка, без блокировок) через
+серверный курсор, суммы копятся точно (Decimal), поэтому дрейф float
+в балансе виден отдельно от настоящих расхождений. Чтение идёт с реплики,
+если она задана. Не запускать одновременно с archive.py.
+
+Баланс берётся из кошелька (снимок + хвост журнала, см. wallet.py), а для
+игроков без счёта в кошельке — из users.balance.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from decimal import Decimal, getcontext
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+
+from database import DATABASE_REPLICA_URL, DATABASE_URL, build_engine
+from models import Spin, User, WalletEntry, WalletSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+RANGE_SIZE = int(os.getenv("RECONCILE_RANGE_SIZE", "10000"))
+STREAM_BATCH = int(os.getenv("RECONCILE_STREAM_BATCH", "20000"))
+DEFAULT_TOLERANCE = 0.005  # полкопейки
+# Границы корзин для гистограммы величины дрейфа
+DRIFT_BUCKETS = (1e-9, 1e-6, 1e-3)
+
+_engine = None
+_archive = None
+
+
+def _init_worker(url: str, archive_dir: Optional[str]) -> None:
+    global _engine, _archive
+    # Decimal(float) даёт до ~55 значащих цифр — точности по умолчанию (28) мало
+    getcontext().prec = 80
+    _engine = build_engine(url, "RECONCILE", read_only=True)
+    _archive = None
+    if archive_dir:
+        from archive import ArchiveReader
+
+        _archive = ArchiveReader(archive_dir)
+
+
+def _drift_bucket(drift: float) -> str:
+    for bound in DRIFT_BUCKETS:
+        if drift < bound:
+            return f"<{bound:g}"
+    return f">={DRIFT_BUCKETS[-1]:g}"
+
+
+def reconcile_range(task: Tuple[int, int, float]) -> Dict[str, Any]:
+    """Выполняется в процессе пула: сверяет пользователей с id из [low, high)."""
+
+    low, high, tolerance = task
+    started = time.perf_counter()
+    ledger: Dict[int, List[Any]] = {}  # user_id -> [spins, Σbet, Σwin]
+
+    with _engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        with conn.begin():
+            users = conn.execute(
+                select(User.id, User.balance, User.initial_balance).where(
+                    User.id >= low, User.id < high
+                )
+            ).all()
+            snapshots = {
+                user_id: balance
+                for user_id, balance in conn.execute(
+                    select(WalletSnapshot.user_id, WalletSnapshot.balance).where(
+                        WalletSnapshot.user_id >= low, WalletSnapshot.user_id < high
+                    )
+                )
+            }
+            tails = dict(
+                conn.execute(
+                    select(WalletEntry.user_id, func.sum(WalletEntry.amount))
+                    .join(WalletSnapshot, WalletSnapshot.user_id == WalletEntry.user_id)
+                    .where(
+                        WalletEntry.user_id >= low,
+                        WalletEntry.user_id < high,
+                        WalletEntry.id > WalletSnapshot.last_entry_id,
+                    )
+                    .group_by(WalletEntry.user_id)
+                ).all()
+            )
+
+            # Серверный курсор: строки приходят пачками по STREAM_BATCH
+            stream = conn.execution_options(stream_results=True, yield_per=STREAM_BATCH)
+            result = stream.execute(
+                select(Spin.user_id, Spin.bet, Spin.win).where(
+                    Spin.user_id >= low, Spin.user_id < high
+                )
+            )
+            zero = Decimal(0)
+            for partition in result.partitions():
+                for user_id, bet, win in partition:
+                    entry = ledger.get(user_id)
+                    if entry is None:
+                        entry = ledger[user_id] = [0, zero, zero]
+                    entry[0] += 1
+                    # Decimal(float) точен: суммируем без ошибок округления
+                    entry[1] += Decimal(bet or 0.0)
+                    entry[2] += Decimal(win or 0.0)
+
+    if _archive is not None:
+        cents = Decimal(100)
+        for user_id, (spins, bet, win) in _archive.user_range_totals(low, high).items():
+            entry = ledger.setdefault(user_id, [0, Decimal(0), Decimal(0)])
+            entry[0] += spins
+            entry[1] += Decimal(bet) / cents
+            entry[2] += Decimal(win) / cents
+
+    mismatches: List[Dict[str, Any]] = []
+    unknown_initial = 0
+    drift_histogram: Dict[str, int] = {}
+    max_drift = 0.0
+    sum_drift = 0.0
+    spins_total = 0
+
+    for user_id, balance, initial in users:
+        spins, bet, win = ledger.pop(user_id, (0, Decimal(0), Decimal(0)))
+        spins_total += spins
+        if initial is None:
+            # Пользователь создан до initial_balance — проверить нечего
+            unknown_initial += 1
+            continue
+        expected = Decimal(initial) + win - bet
+        if user_id in snapshots:
+            # Кошелёк в копейках: переводим точно, без float
+            exact = (Decimal(snapshots[user_id]) + Decimal(tails.get(user_id) or 0)) / 100
+            balance = float(exact)
+        else:
+            exact = Decimal(balance or 0.0)
+        drift = float(exact - expected)
+        magnitude = abs(drift)
+        max_drift = max(max_drift, magnitude)
+        sum_drift += magnitude
+        bucket = _drift_bucket(magnitude) if magnitude else "0"
+        drift_histogram[bucket] = drift_histogram.get(bucket, 0) + 1
+        if magnitude > tolerance:
+            mismatches.append(
+                {
+                    "user_id": user_id,
+                    "balance": balance,
+                    "expected": float(expected),
+                    "difference": drift,
+                    "initial_balance": initial,
+                    "spins": spins,
+                }
+            )
+
+    # Спины пользователей, которых нет в users
+    orphans = [
+        {"user_id": user_id, "spins": spins, "net": float(win - bet)}
+        for user_id, (spins, bet, win) in ledger.items()
+    ]
+
+    return {
+        "range": [low, high],
+        "users": len(users),
+        "spins": spins_total + sum(orphan["spins"] for orphan in orphans),
+        "unknown_initial": unknown_initial,
+        "max_drift": max_drift,
+        "sum_abs_drift": sum_drift,
+        "drift_histogram": drift_histogram,
+        "mismatches": mismatches,
+        "orphan_spins": orphans,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def _load_checkpoint(path: Optional[str]) -> Dict[str, Any]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _save_checkpoint(path: Optional[str], state: Dict[str, Any]) -> None:
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh)
+    os.replace(tmp, path)
+
+
+def _summarize(state: Dict[str, Any]) -> Dict[str, Any]:
+    ranges = list(state["done"].values())
+    histogram: Dict[str, int] = {}
+    for item in ranges:
+        for bucket, count in item["drift_histogram"].items():
+            histogram[bucket] = histogram.get(bucket, 0) + count
+    mismatches = [m for item in ranges for m in item["mismatches"]]
+    mismatches.sort(key=lambda m: abs(m["difference"]), reverse=True)
+    return {
+        "started_at": state["started_at"],
+        "max_user_id": state["max_user_id"],
+        "range_size": state["range_size"],
+        "tolerance": state["tolerance"],
+        "ranges_done": len(ranges),
+        "ranges_total": state["ranges_total"],
+        "complete": len(ranges) == state["ranges_total"],
+        "users": sum(item["users"] for item in ranges),
+        "spins": sum(item["spins"] for item in ranges),
+        "unknown_initial": sum(item["unknown_initial"] for item in ranges),
+        "mismatch_count": len(mismatches),
+        "max_drift": max((item["max_drift"] for item in ranges), default=0.0),
+        "sum_abs_drift": sum(item["sum_abs_drift"] for item in ranges),
+        "drift_histogram": histogram,
+        "mismatches": mismatches,
+        "orphan_spins": [o for item in ranges for o in item["orphan_spins"]],
+    }
+
+
+def run(
+    workers: Optional[int] = None,
+    range_size: int = RANGE_SIZE,
+    tolerance: float = DEFAULT_TOLERANCE,
+    checkpoint: Optional[str] = None,
+    archive_dir: Optional[str] = None,
+    url: Optional[str] = None,
+) -> Dict[str, Any]:
+    url = url or DATABASE_REPLICA_URL or DATABASE_URL
+    state = _load_checkpoint(checkpoint)
+    if not state:
+        engine = build_engine(url, "RECONCILE")
+        with engine.connect() as conn:
+            max_id = conn.execute(select(func.max(User.id))).scalar() or 0
+            max_spin_user = conn.execute(select(func.max(Spin.user_id))).scalar() or 0
+        engine.dispose()
+        max_id = max(max_id, max_spin_user)
+        state = {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "max_user_id": max_id,
+            "range_size": range_size,
+            "tolerance": tolerance,
+            "ranges_total": max_id // range_size + 1,
+            "done": {},
+        }
+        _save_checkpoint(checkpoint, state)
+
+    # Диапазоны и допуск берём из чекпойнта, чтобы продолжение совпало с началом
+    size = state["range_size"]
+    tasks = [
+        (low, low + size, state["tolerance"])
+        for low in range(0, state["max_user_id"] + 1, size)
+        if str(low) not in state["done"]
+    ]
+
+    with Pool(
+        processes=workers or os.cpu_count(),
+        initializer=_init_worker,
+        initargs=(url, archive_dir),
+    ) as pool:
+        for result in pool.imap_unordered(reconcile_range, tasks):
+            state["done"][str(result["range"][0])] = result
+            _save_checkpoint(checkpoint, state)
+            logger.info(
+                "Range %s..%s: %s users, %s spins, %s mismatches in %.1fs",
+                result["range"][0],
+                result["range"][1],
+                result["users"],
+                result["spins"],
+                len(result["mismatches"]),
+                result["seconds"],
+            )
+
+    return _summarize(state)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--range-size", type=int, default=RANGE_SIZE)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--checkpoint", help="JSON-файл прогресса; с ним прогон можно продолжить")
+    parser.add_argument("--archive-dir", help="каталог сегментов archive.py")
+    parser.add_argument("--database-url", help="по умолчанию реплика, иначе DATABASE_URL")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    report = run(
+        workers=args.workers,
+        range_size=args.range_size,
+        tolerance=args.tolerance,
+        checkpoint=args.checkpoint,
+        archive_dir=args.archive_dir,
+        url=args.database_url,
+    )
+    print(json.dumps(report, indent=2))
+    return 0 if report["mismatch_count"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
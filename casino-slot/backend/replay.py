@@ -0,0 +1,463 @@
+"""Контрфактический прогон реальных спинов на кандидатных таблицах весов.
+
+    python replay.py --start 2026-01-01 --end 2026-02-01 --candidate current \\
+        --candidate arm:rtp97:test --candidate file:reels.json --workers 8
+    python replay.py --start 2026-01-01 --end 2026-02-01 --candidate ids:12,13,14 \\
+        --cohort activity --seed 7 > replay.json
+
+Берутся платные спины основной игры за период в реальном порядке игроков
+(ставка, игрок, id) и заново разыгрываются на каждом кандидате: исход
+считается из фиксированного тестового сида, а не из PF-сидов игроков,
+и один и тот же поток случайных чисел идёт во все кандидаты (common
+random numbers), так что разница между кандидатами — эффект весов, а не
+шума. Тир выбирается по ставке так же, как в ReelTableCache.
+
+Игроки делятся на диапазоны id × шарды; каждый диапазон — задача пула
+процессов со своим серверным курсором, строки идут кусками по
+REPLAY_CHUNK_ROWS (куски режутся по границе игрока). Отчёт: RTP, hold
+и GGR по кандидатам и когортам, плюс траектории баланса — средний
+накопленный результат игрока и доля игроков в плюсе после N спинов.
+Кандидат "actual" — фактические выигрыши из БД для сравнения.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, or_, select
+
+from models import ReelWeights, Spin
+
+
+logger = logging.getLogger(__name__)
+
+REPLAY_CHUNK_ROWS = int(os.getenv("REPLAY_CHUNK_ROWS", "500000"))
+CHECKPOINTS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+COHORT_BANDS = {
+    "bet": (1.0, 5.0, 20.0, 100.0),  # средняя ставка игрока за период
+    "activity": (100.0, 1000.0, 10000.0),  # спинов за период
+    "all": (),
+}
+
+# (имя, ставки тиров, матрицы тиров)
+Candidate = Tuple[str, List[float], List[Any]]
+
+
+def _source_urls() -> List[str]:
+    """Реплики шардов (или шарды), без шардирования — реплика или основная БД."""
+
+    from database import DATABASE_REPLICA_URL, DATABASE_URL
+    from sharding import DATABASE_SHARD_REPLICA_URLS, DATABASE_SHARD_URLS
+
+    if DATABASE_SHARD_URLS:
+        return list(DATABASE_SHARD_REPLICA_URLS or DATABASE_SHARD_URLS)
+    return [DATABASE_REPLICA_URL or DATABASE_URL]
+
+
+def load_candidate(spec: str) -> Candidate:
+    """current | arm:<тег> | ids:1,2,3 | file:<reels.json>."""
+
+    kind, _, value = spec.partition(":")
+    if kind == "file":
+        with open(value, "r", encoding="utf-8") as fh:
+            return spec, [0.0], [json.load(fh)]
+
+    from database import ReadSessionLocal
+
+    db = ReadSessionLocal()
+    try:
+        query = db.query(ReelWeights.bet_amount, ReelWeights.reels)
+        if kind == "current":
+            query = query.filter(ReelWeights.arm.is_(None))
+        elif kind == "arm":
+            query = query.filter(ReelWeights.arm == value)
+        elif kind == "ids":
+            query = query.filter(ReelWeights.id.in_([int(item) for item in value.split(",")]))
+        else:
+            raise ValueError(f"Unknown candidate {spec}")
+        rows = query.order_by(ReelWeights.bet_amount.asc(), ReelWeights.id.asc()).all()
+    finally:
+        db.close()
+
+    bets: List[float] = []
+    matrices: List[Any] = []
+    for bet_amount, reels in rows:
+        if not reels or bet_amount is None or (bets and bets[-1] == bet_amount):
+            continue  # как в ReelTableCache: при дублях ставки побеждает первая строка
+        bets.append(float(bet_amount))
+        matrices.append(reels)
+    if not matrices:
+        if kind != "current":
+            raise ValueError(f"Candidate {spec} has no reel tables")
+        from slot_engine import DEFAULT_REELS_MATRIX
+
+        # Без строк ReelWeights прод играет на DEFAULT_REELS_MATRIX
+        bets, matrices = [0.0], [DEFAULT_REELS_MATRIX]
+    return spec, bets, matrices
+
+
+class _Tiers:
+    """Кандидат, собранный в FeatureEngine по тирам ставок основной игры."""
+
+    def __init__(self, candidate: Candidate) -> None:
+        from features import FeatureEngine
+        from games import DEFAULT_GAME_ID, get_game
+        from slot_engine import CompiledReels, GameEngine
+
+        game = get_game(DEFAULT_GAME_ID)
+        self.name, bets, matrices = candidate
+        self.bets = np.array(bets)
+        self.engines = [
+            FeatureEngine(
+                GameEngine(
+                    game.game_id,
+                    game.version,
+                    CompiledReels(matrix),
+                    game.rows,
+                    game.lines,
+                    game.pays,
+                    game.wild,
+                    game.features,
+                )
+            )
+            for matrix in matrices
+        ]
+
+    def wins(self, bets: np.ndarray, values: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        from features import random_draws
+
+        tiers = np.maximum(np.searchsorted(self.bets, bets, side="right") - 1, 0)
+        wins = np.zeros(len(bets))
+        for tier in np.unique(tiers):
+            selected = tiers == tier
+            engine = self.engines[tier]
+            grids = engine.draw_grids(
+                int(selected.sum()), lambda _count: values[selected].reshape(-1)
+            )
+            # Каскады, если они есть у игры, досыпаются из того же тестового потока
+            wins[selected], _ = engine.play(grids, bets[selected], random_draws(rng))
+        return wins
+
+
+class _Totals:
+    """Аддитивные суммы задачи: складываются между процессами."""
+
+    def __init__(self, candidates: int, cohorts: int) -> None:
+        shape = (candidates, cohorts)
+        self.users = np.zeros(cohorts, dtype=np.int64)
+        self.spins = np.zeros(cohorts, dtype=np.int64)
+        self.bet = np.zeros(cohorts)
+        self.win = np.zeros(shape)
+        self.final_net = np.zeros(shape)
+        self.final_profit = np.zeros(shape, dtype=np.int64)
+        self.reached = np.zeros((cohorts, len(CHECKPOINTS)), dtype=np.int64)
+        self.net = np.zeros((candidates, cohorts, len(CHECKPOINTS)))
+        self.profit = np.zeros((candidates, cohorts, len(CHECKPOINTS)), dtype=np.int64)
+
+    def add(self, other: "_Totals") -> None:
+        for name, value in vars(other).items():
+            getattr(self, name).__iadd__(value)
+
+
+def _replay_chunk(
+    users: np.ndarray,
+    bets: np.ndarray,
+    actual: np.ndarray,
+    tiers: Sequence[_Tiers],
+    bands: np.ndarray,
+    cohort_kind: str,
+    values_per_spin: int,
+    rng: np.random.Generator,
+    totals: _Totals,
+) -> None:
+    count = len(users)
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    spins = np.diff(np.r_[starts, count])
+    owner = np.repeat(np.arange(len(starts)), spins)
+    position = np.arange(count) - starts[owner] + 1
+    stake = np.add.reduceat(bets, starts)
+
+    if cohort_kind == "bet":
+        cohort_user = np.searchsorted(bands, stake / spins, side="right")
+    elif cohort_kind == "activity":
+        cohort_user = np.searchsorted(bands, spins, side="right")
+    else:
+        cohort_user = np.zeros(len(starts), dtype=np.int64)
+    cohort = cohort_user[owner]
+
+    np.add.at(totals.users, cohort_user, 1)
+    np.add.at(totals.spins, cohort_user, spins)
+    np.add.at(totals.bet, cohort_user, stake)
+
+    checkpoint = np.searchsorted(CHECKPOINTS, position)
+    on_checkpoint = checkpoint < len(CHECKPOINTS)
+    on_checkpoint[on_checkpoint] = (
+        np.asarray(CHECKPOINTS)[checkpoint[on_checkpoint]] == position[on_checkpoint]
+    )
+    marks = (cohort[on_checkpoint], checkpoint[on_checkpoint])
+    np.add.at(totals.reached, marks, 1)
+
+    # Общий для всех кандидатов поток: CRN
+    values = rng.integers(
+        0,
+        np.iinfo(np.uint64).max,
+        size=(count, values_per_spin),
+        dtype=np.uint64,
+        endpoint=True,
+    )
+    last = starts + spins - 1
+    for index, wins in enumerate(
+        [actual] + [candidate.wins(bets, values, rng) for candidate in tiers]
+    ):
+        net = wins - bets
+        running = np.cumsum(net)
+        # Накопленный результат внутри игрока: сдвиг на сумму до его первого спина
+        running -= (running[starts] - net[starts])[owner]
+        np.add.at(totals.win[index], cohort_user, np.add.reduceat(wins, starts))
+        np.add.at(totals.final_net[index], cohort_user, running[last])
+        np.add.at(totals.final_profit[index], cohort_user, running[last] > 0)
+        np.add.at(totals.net[index], marks, running[on_checkpoint])
+        np.add.at(totals.profit[index], marks, running[on_checkpoint] > 0)
+
+
+def _replay_task(task: Dict[str, Any]) -> _Totals:
+    from database import build_engine
+
+    tiers = [_Tiers(candidate) for candidate in task["candidates"]]
+    bands = np.asarray(COHORT_BANDS[task["cohort"]])
+    values_per_spin = tiers[0].engines[0].reel_count * tiers[0].engines[0].rows
+    totals = _Totals(len(tiers) + 1, len(bands) + 1)
+    # Отдельный фиксированный поток на задачу: результат не зависит от порядка пула
+    rng = np.random.default_rng([task["seed"], task["index"]])
+
+    query = (
+        select(Spin.user_id, Spin.bet, Spin.win)
+        .where(
+            Spin.user_id >= task["low"],
+            Spin.user_id < task["high"],
+            Spin.bet > 0,
+            or_(Spin.game_id.is_(None), Spin.game_id == task["game_id"]),
+        )
+        .order_by(Spin.user_id, Spin.id)
+    )
+    if task["start"] is not None:
+        query = query.where(Spin.created_at >= task["start"])
+    if task["end"] is not None:
+        query = query.where(Spin.created_at < task["end"])
+
+    engine = build_engine(task["url"], "REPLAY", read_only=True)
+    pending: List[Tuple[int, float, float]] = []
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=REPLAY_CHUNK_ROWS
+            ).execute(query)
+            for partition in result.partitions():
+                pending.extend(partition)
+                # Режем по границе игрока, хвост уходит в следующий кусок
+                cut = len(pending)
+                while cut > 0 and pending[cut - 1][0] == pending[-1][0]:
+                    cut -= 1
+                if cut:
+                    _replay_rows(pending[:cut], tiers, bands, task, values_per_spin, rng, totals)
+                    pending = pending[cut:]
+        if pending:
+            _replay_rows(pending, tiers, bands, task, values_per_spin, rng, totals)
+    finally:
+        engine.dispose()
+    return totals
+
+
+def _replay_rows(
+    rows: List[Tuple[int, float, float]],
+    tiers: Sequence[_Tiers],
+    bands: np.ndarray,
+    task: Dict[str, Any],
+    values_per_spin: int,
+    rng: np.random.Generator,
+    totals: _Totals,
+) -> None:
+    data = np.array(rows, dtype=float)
+    _replay_chunk(
+        data[:, 0].astype(np.int64),
+        data[:, 1],
+        np.nan_to_num(data[:, 2]),
+        tiers,
+        bands,
+        task["cohort"],
+        values_per_spin,
+        rng,
+        totals,
+    )
+
+
+def _user_ranges(
+    url: str, start: Optional[datetime], end: Optional[datetime], partitions: int
+) -> List[Tuple[int, int]]:
+    from database import build_engine
+
+    engine = build_engine(url, "REPLAY", read_only=True)
+    try:
+        query = select(func.min(Spin.user_id), func.max(Spin.user_id))
+        if start is not None:
+            query = query.where(Spin.created_at >= start)
+        if end is not None:
+            query = query.where(Spin.created_at < end)
+        with engine.connect() as conn:
+            low, high = conn.execute(query).one()
+    finally:
+        engine.dispose()
+    if low is None:
+        return []
+    step = max((high - low + 1 + partitions - 1) // partitions, 1)
+    return [(edge, min(edge + step, high + 1)) for edge in range(low, high + 1, step)]
+
+
+def _cohort_labels(kind: str) -> List[str]:
+    bands = COHORT_BANDS[kind]
+    if not bands:
+        return ["all"]
+    edges = ["0", *(f"{edge:g}" for edge in bands)]
+    return [f"{low}-{high}" for low, high in zip(edges, edges[1:])] + [f"{edges[-1]}+"]
+
+
+def _ratio(numerator: float, denominator: float) -> Optional[float]:
+    return float(numerator / denominator) if denominator else None
+
+
+def report(totals: _Totals, names: Sequence[str], cohort_kind: str) -> Dict[str, Any]:
+    labels = _cohort_labels(cohort_kind)
+    out: Dict[str, Any] = {}
+    for index, name in enumerate(names):
+        bet, win = float(totals.bet.sum()), float(totals.win[index].sum())
+        cohorts = {}
+        for cohort, label in enumerate(labels):
+            users = int(totals.users[cohort])
+            if not users:
+                continue
+            cohort_bet, cohort_win = float(totals.bet[cohort]), float(totals.win[index, cohort])
+            cohorts[label] = {
+                "users": users,
+                "spins": int(totals.spins[cohort]),
+                "bet": round(cohort_bet, 2),
+                "win": round(cohort_win, 2),
+                "rtp": _ratio(cohort_win, cohort_bet),
+                "hold": _ratio(cohort_bet - cohort_win, cohort_bet),
+                "trajectory": [
+                    {
+                        "spin": spin,
+                        "players": int(totals.reached[cohort, point]),
+                        "mean_net": _ratio(
+                            totals.net[index, cohort, point], totals.reached[cohort, point]
+                        ),
+                        "in_profit": _ratio(
+                            totals.profit[index, cohort, point], totals.reached[cohort, point]
+                        ),
+                    }
+                    for point, spin in enumerate(CHECKPOINTS)
+                    if totals.reached[cohort, point]
+                ],
+                "end_of_period": {
+                    "mean_net": _ratio(totals.final_net[index, cohort], users),
+                    "in_profit": _ratio(totals.final_profit[index, cohort], users),
+                },
+            }
+        out[name] = {
+            "bet": round(bet, 2),
+            "win": round(win, 2),
+            "ggr": round(bet - win, 2),
+            "rtp": _ratio(win, bet),
+            "hold": _ratio(bet - win, bet),
+            "cohorts": cohorts,
+        }
+    return out
+
+
+def replay(
+    candidates: Sequence[Candidate],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    cohort: str = "bet",
+    seed: int = 0,
+    workers: Optional[int] = None,
+    partitions: Optional[int] = None,
+) -> Dict[str, Any]:
+    from games import DEFAULT_GAME_ID
+
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers * 4
+    tasks = []
+    for url in _source_urls():
+        for low, high in _user_ranges(url, start, end, partitions):
+            tasks.append(
+                {
+                    "index": len(tasks),
+                    "url": url,
+                    "low": low,
+                    "high": high,
+                    "start": start,
+                    "end": end,
+                    "game_id": DEFAULT_GAME_ID,
+                    "candidates": list(candidates),
+                    "cohort": cohort,
+                    "seed": seed,
+                }
+            )
+
+    started = time.perf_counter()
+    totals = _Totals(len(candidates) + 1, len(COHORT_BANDS[cohort]) + 1)
+    with Pool(processes=min(workers, max(len(tasks), 1))) as pool:
+        for part in pool.imap_unordered(_replay_task, tasks):
+            totals.add(part)
+    elapsed = time.perf_counter() - started
+
+    spins = int(totals.spins.sum())
+    logger.info(
+        "Replayed %s spins in %.1fs (%.0f spins/s)", spins, elapsed, spins / max(elapsed, 1e-9)
+    )
+    return {
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+        "seed": seed,
+        "cohort": cohort,
+        "users": int(totals.users.sum()),
+        "spins": spins,
+        "seconds": round(elapsed, 1),
+        "candidates": report(totals, ["actual", *(name for name, _, _ in candidates)], cohort),
+    }
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--start", type=_parse_date)
+    parser.add_argument("--end", type=_parse_date)
+    parser.add_argument("--candidate", action="append", required=True,
+                        help="current | arm:<тег> | ids:1,2 | file:<reels.json>")
+    parser.add_argument("--cohort", choices=sorted(COHORT_BANDS), default="bet")
+    parser.add_argument("--seed", type=int, default=0, help="фиксированный тестовый сид")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--partitions", type=int, help="диапазонов игроков на шард")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    candidates = [load_candidate(spec) for spec in args.candidate]
+    result = replay(
+        candidates, args.start, args.end, args.cohort, args.seed, args.workers, args.partitions
+    )
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
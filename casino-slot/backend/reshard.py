@@ -0,0 +1,239 @@
+"""Перенос пользователей между шардами при изменении DATABASE_SHARD_URLS.
+
+    python reshard.py sequences --urls pg1,pg2,pg3
+    python reshard.py copy --from-urls pg1,pg2 --to-urls pg1,pg2,pg3
+    python reshard.py copy --from-urls pg1,pg2 --to-urls pg1,pg2,pg3 --final
+    python reshard.py delete --from-urls pg1,pg2 --to-urls pg1,pg2,pg3
+
+Порядок: sequences на новых шардах; copy онлайн (можно повторять —
+спины докопируются по id, мелкие таблицы перезапишутся); окно
+обслуживания: остановить спины, copy --final (перенос баланса кошелька),
+переключить DATABASE_SHARD_URLS на новый список; затем delete.
+
+Переезжают только игроки, у которых jump_hash дал другой шард (при
+N -> N+1 это ~1/(N+1) игроков). Журнал кошелька не копируется: на
+старом шарде пишется transfer_out на весь баланс, на новом — счёт с
+записью transfer_in, поэтому id записей на шарде остаются монотонными
+для компакции. Rollup-агрегаты не переносятся — после переезда их
+стоит пересобрать. Только PostgreSQL.
+"""
+
+import argparse
+import json
+import logging
+import sys
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.orm import Session
+
+from database import build_engine
+from models import ProvablyFairState, SessionData, Spin, User, WalletEntry, WalletSnapshot
+from sharding import SHARD_ID_STRIDE, jump_hash
+from wallet import wallet
+
+
+logger = logging.getLogger(__name__)
+
+USER_BATCH = 1000
+SPIN_BATCH = 20000
+
+# Строки, которые целиком перезаписываются при каждом copy; id у
+# session_data / provably_fair_state локальные для шарда, поэтому не копируем
+MUTABLE_TABLES = (SessionData, ProvablyFairState)
+
+
+def _urls(raw: str) -> List[str]:
+    return [url.strip() for url in raw.split(",") if url.strip()]
+
+
+def init_sequences(urls: Sequence[str]) -> List[Dict[str, Any]]:
+    """Шаг SHARD_ID_STRIDE для spins.id: на шарде i id ≡ i (mod шаг)."""
+
+    result = []
+    for index, url in enumerate(urls):
+        engine = build_engine(url, "RESHARD")
+        with engine.begin() as conn:
+            current = conn.execute(select(func.max(Spin.id))).scalar() or 0
+            start = (current // SHARD_ID_STRIDE + 1) * SHARD_ID_STRIDE + index
+            conn.execute(
+                text(
+                    f"ALTER SEQUENCE spins_id_seq INCREMENT BY {SHARD_ID_STRIDE} "
+                    f"RESTART WITH {start}"
+                )
+            )
+        engine.dispose()
+        result.append({"shard": index, "next_spin_id": start})
+    return result
+
+
+def _moved_users(
+    conn: Any, source: int, sources: Sequence[str], targets: Sequence[str]
+) -> Dict[int, int]:
+    moved = {}
+    for (user_id,) in conn.execute(select(User.id)):
+        target = jump_hash(user_id, len(targets))
+        if targets[target] != sources[source]:
+            moved[user_id] = target
+    return moved
+
+
+def _copy_users(src: Any, dst: Any, user_ids: List[int]) -> int:
+    # users: id глобальный (user_directory), перезаписываем целиком
+    users = [dict(row._mapping) for row in src.execute(select(User).where(User.id.in_(user_ids)))]
+    dst.execute(delete(User).where(User.id.in_(user_ids)))
+    if users:
+        dst.execute(insert(User), users)
+    for model in MUTABLE_TABLES:
+        rows = [
+            {key: value for key, value in row._mapping.items() if key != "id"}
+            for row in src.execute(select(model).where(model.user_id.in_(user_ids)))
+        ]
+        dst.execute(delete(model).where(model.user_id.in_(user_ids)))
+        if rows:
+            dst.execute(insert(model), rows)
+
+    # spins неизменяемы и имеют глобальные id: докопируем то, чего ещё нет
+    copied = 0
+    last_copied = dict(
+        dst.execute(
+            select(Spin.user_id, func.max(Spin.id))
+            .where(Spin.user_id.in_(user_ids))
+            .group_by(Spin.user_id)
+        ).all()
+    )
+    floor = min((last_copied.get(user_id, 0) for user_id in user_ids), default=0)
+    result = src.execution_options(stream_results=True, yield_per=SPIN_BATCH).execute(
+        select(Spin).where(Spin.user_id.in_(user_ids), Spin.id > floor).order_by(Spin.id)
+    )
+    for partition in result.partitions():
+        rows = [
+            dict(row._mapping)
+            for row in partition
+            if row.id > last_copied.get(row.user_id, 0)
+        ]
+        if rows:
+            dst.execute(insert(Spin), rows)
+            copied += len(rows)
+    return copied
+
+
+def _transfer_wallets(src_session: Any, dst_session: Any, user_ids: List[int]) -> int:
+    moved = 0
+    for user_id in user_ids:
+        if dst_session.get(WalletSnapshot, user_id) is not None:
+            continue  # уже перенесён прошлым запуском
+        balance = wallet.stored_balance(src_session, user_id)
+        if balance is None:
+            continue
+        src_session.add(WalletEntry(user_id=user_id, amount=-balance, kind="transfer_out"))
+        dst_session.add(WalletSnapshot(user_id=user_id, balance=0, last_entry_id=0))
+        dst_session.add(WalletEntry(user_id=user_id, amount=balance, kind="transfer_in"))
+        moved += 1
+    # Сначала новый шард: при сбое между коммитами повтор увидит снимок и
+    # пропустит игрока, а недостающий transfer_out найдёт reconcile
+    dst_session.commit()
+    src_session.commit()
+    return moved
+
+
+def copy_users(
+    sources: Sequence[str], targets: Sequence[str], final: bool = False
+) -> List[Dict[str, Any]]:
+    report = []
+    source_engines = [build_engine(url, "RESHARD") for url in sources]
+    target_engines = {url: build_engine(url, "RESHARD") for url in set(targets)}
+    try:
+        for index, source_engine in enumerate(source_engines):
+            with source_engine.connect() as conn:
+                moved = _moved_users(conn, index, sources, targets)
+            by_target: Dict[int, List[int]] = {}
+            for user_id, target in moved.items():
+                by_target.setdefault(target, []).append(user_id)
+
+            for target, user_ids in sorted(by_target.items()):
+                target_engine = target_engines[targets[target]]
+                spins = wallets = 0
+                for offset in range(0, len(user_ids), USER_BATCH):
+                    chunk = sorted(user_ids[offset : offset + USER_BATCH])
+                    with source_engine.connect() as src, target_engine.begin() as dst:
+                        spins += _copy_users(src, dst, chunk)
+                    if final:
+                        with Session(source_engine) as src_session:
+                            with Session(target_engine) as dst_session:
+                                wallets += _transfer_wallets(src_session, dst_session, chunk)
+                report.append(
+                    {
+                        "from": index,
+                        "to": target,
+                        "users": len(user_ids),
+                        "spins_copied": spins,
+                        "wallets_transferred": wallets,
+                    }
+                )
+                logger.info(
+                    "Shard %s -> %s: %s users, %s spins", index, target, len(user_ids), spins
+                )
+    finally:
+        for engine in [*source_engines, *target_engines.values()]:
+            engine.dispose()
+    return report
+
+
+def delete_moved(sources: Sequence[str], targets: Sequence[str]) -> List[Dict[str, Any]]:
+    """Удаляет со старых шардов строки переехавших игроков (кроме журнала кошелька)."""
+
+    report = []
+    for index, url in enumerate(sources):
+        engine = build_engine(url, "RESHARD")
+        try:
+            with engine.connect() as conn:
+                user_ids = sorted(_moved_users(conn, index, sources, targets))
+            deleted = 0
+            for offset in range(0, len(user_ids), USER_BATCH):
+                chunk = user_ids[offset : offset + USER_BATCH]
+                with engine.begin() as conn:
+                    for model in (Spin, *MUTABLE_TABLES):
+                        deleted += conn.execute(
+                            delete(model).where(model.user_id.in_(chunk))
+                        ).rowcount
+                    conn.execute(delete(WalletSnapshot).where(WalletSnapshot.user_id.in_(chunk)))
+                    deleted += conn.execute(delete(User).where(User.id.in_(chunk))).rowcount
+            report.append({"shard": index, "users": len(user_ids), "rows_deleted": deleted})
+        finally:
+            engine.dispose()
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sequences_cmd = commands.add_parser("sequences")
+    sequences_cmd.add_argument("--urls", required=True)
+
+    for name in ("copy", "delete"):
+        command = commands.add_parser(name)
+        command.add_argument("--from-urls", required=True, help="текущий DATABASE_SHARD_URLS")
+        command.add_argument("--to-urls", required=True, help="новый DATABASE_SHARD_URLS")
+        if name == "copy":
+            command.add_argument(
+                "--final", action="store_true", help="перенести кошельки (спины остановлены)"
+            )
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    if args.command == "sequences":
+        result = init_sequences(_urls(args.urls))
+    elif args.command == "copy":
+        result = copy_users(_urls(args.from_urls), _urls(args.to_urls), args.final)
+    else:
+        result = delete_moved(_urls(args.from_urls), _urls(args.to_urls))
+
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
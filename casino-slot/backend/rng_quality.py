@@ -0,0 +1,432 @@
+"""Статистическая проверка provably-fair генератора (равномерность и независимость).
+
+    python rng_quality.py --nonces 20000000 --workers 8 > rng_report.json
+    python rng_quality.py --reels reels.json --alpha 0.0001
+
+Выходы считаются тем же способом, что и в slot_engine (sha256 от
+"server:client:nonce:reel", первые 8 байт, mod сумма весов), пачками
+в пуле процессов. Каждая пачка сразу сворачивается NumPy в аддитивные
+суммы, поэтому память не зависит от числа розыгрышей. Код выхода 1,
+если хотя бы один тест не прошёл.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from slot_engine import DEFAULT_REELS_MATRIX, CompiledReels, ReelMatrix
+
+
+RAW_BINS = 256
+GAP_INTERVAL = 0.1  # «попадание» для gap-теста: u < 0.1
+GAP_MAX = 30  # гэпы длиннее складываются в один хвостовой бакет
+CHUNK_NONCES = 250_000
+SELF_CHECK_NONCES = 2000
+
+
+class ReelSpec:
+    __slots__ = ("symbols", "codes", "cumulative", "total", "expected")
+
+    def __init__(self, reel: Sequence[Dict[str, Any]]) -> None:
+        symbols: List[str] = []
+        for cell in reel:
+            if cell["symbol"] not in symbols:
+                symbols.append(cell["symbol"])
+        weights = np.array([int(cell["weight"]) for cell in reel], dtype=np.int64)
+        if weights.sum() <= 0:
+            weights = np.ones(len(reel), dtype=np.int64)
+        self.symbols = symbols
+        self.codes = np.array([symbols.index(cell["symbol"]) for cell in reel])
+        self.cumulative = np.cumsum(weights).astype(np.uint64)
+        self.total = int(weights.sum())
+        expected = np.zeros(len(symbols))
+        for code, weight in zip(self.codes, weights):
+            expected[code] += weight / self.total
+        self.expected = expected
+
+    def to_symbols(self, raw: np.ndarray) -> np.ndarray:
+        targets = raw % np.uint64(self.total)
+        return self.codes[np.searchsorted(self.cumulative, targets, side="right")]
+
+
+def _hash_chunk(
+    server_seed: str, client_seed: str, start: int, count: int, reels: int
+) -> np.ndarray:
+    """Сырые 64-битные значения формы (count, reels), порядок по nonce."""
+
+    # Префикс сидов хэшируется один раз, дальше копируется состояние sha256
+    base = hashlib.sha256(f"{server_seed}:{client_seed}:".encode("utf-8"))
+    suffixes = [f":{reel}".encode("utf-8") for reel in range(reels)]
+    out = bytearray(count * reels * 8)
+    pos = 0
+    for nonce in range(start, start + count):
+        head = base.copy()
+        head.update(str(nonce).encode("ascii"))
+        for suffix in suffixes:
+            digest = head.copy()
+            digest.update(suffix)
+            out[pos:pos + 8] = digest.digest()[:8]
+            pos += 8
+    return np.frombuffer(bytes(out), dtype=">u8").astype(np.uint64).reshape(count, reels)
+
+
+def _gap_partial(hits: np.ndarray) -> Dict[str, Any]:
+    positions = np.flatnonzero(hits)
+    if positions.size == 0:
+        return {
+            "head": None,
+            "tail": int(hits.size),
+            "hist": np.zeros(GAP_MAX + 1, dtype=np.int64),
+        }
+    gaps = np.minimum(np.diff(positions) - 1, GAP_MAX)
+    return {
+        "head": int(positions[0]),
+        "tail": int(hits.size - positions[-1] - 1),
+        "hist": np.bincount(gaps, minlength=GAP_MAX + 1).astype(np.int64),
+    }
+
+
+def analyze_chunk(task: Tuple[str, str, int, int, List[ReelSpec]]) -> Dict[str, Any]:
+    """Выполняется в процессе пула: хэширует пачку и считает частичные суммы."""
+
+    server_seed, client_seed, start, count, specs = task
+    raw = _hash_chunk(server_seed, client_seed, start, count, len(specs))
+    uniform = raw.astype(np.float64) / 2.0 ** 64
+    codes = [spec.to_symbols(raw[:, index]) for index, spec in enumerate(specs)]
+
+    reels = []
+    for index, spec in enumerate(specs):
+        u = uniform[:, index]
+        above = u >= 0.5
+        reels.append(
+            {
+                "raw_hist": np.bincount(
+                    (raw[:, index] >> np.uint64(56)).astype(np.int64), minlength=RAW_BINS
+                ),
+                "symbol_counts": np.bincount(codes[index], minlength=len(spec.symbols)),
+                "sum": float(u.sum()),
+                "sum_sq": float((u * u).sum()),
+                "sum_lag": float((u[:-1] * u[1:]).sum()),
+                "first": float(u[0]),
+                "last": float(u[-1]),
+                "above": int(above.sum()),
+                "changes": int((above[1:] != above[:-1]).sum()),
+                "first_above": bool(above[0]),
+                "last_above": bool(above[-1]),
+                "gap": _gap_partial(u < GAP_INTERVAL),
+            }
+        )
+
+    pairs = {}
+    for i in range(len(specs)):
+        for j in range(i + 1, len(specs)):
+            width = len(specs[j].symbols)
+            joint = np.bincount(
+                codes[i] * width + codes[j], minlength=len(specs[i].symbols) * width
+            )
+            pairs[f"{i}-{j}"] = {
+                "sum_xy": float((uniform[:, i] * uniform[:, j]).sum()),
+                "joint": joint.reshape(len(specs[i].symbols), width),
+            }
+
+    return {"count": count, "reels": reels, "pairs": pairs}
+
+
+class Accumulator:
+    """Склеивает частичные суммы пачек в порядке nonce."""
+
+    def __init__(self, specs: List[ReelSpec]) -> None:
+        self.specs = specs
+        self.n = 0
+        self.reels = [
+            {
+                "raw_hist": np.zeros(RAW_BINS, dtype=np.int64),
+                "symbol_counts": np.zeros(len(spec.symbols), dtype=np.int64),
+                "sum": 0.0,
+                "sum_sq": 0.0,
+                "sum_lag": 0.0,
+                "last": None,
+                "above": 0,
+                "runs": 0,
+                "last_above": None,
+                "gap_hist": np.zeros(GAP_MAX + 1, dtype=np.int64),
+                "gap_tail": None,
+            }
+            for spec in specs
+        ]
+        self.pairs: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, part: Dict[str, Any]) -> None:
+        for acc, chunk in zip(self.reels, part["reels"]):
+            acc["raw_hist"] += chunk["raw_hist"]
+            acc["symbol_counts"] += chunk["symbol_counts"]
+            acc["sum"] += chunk["sum"]
+            acc["sum_sq"] += chunk["sum_sq"]
+            acc["sum_lag"] += chunk["sum_lag"]
+            if acc["last"] is not None:
+                acc["sum_lag"] += acc["last"] * chunk["first"]
+            acc["last"] = chunk["last"]
+
+            acc["above"] += chunk["above"]
+            acc["runs"] += chunk["changes"] + 1
+            if acc["last_above"] is not None and acc["last_above"] == chunk["first_above"]:
+                acc["runs"] -= 1  # серия продолжается через границу пачек
+            acc["last_above"] = chunk["last_above"]
+
+            gap = chunk["gap"]
+            acc["gap_hist"] += gap["hist"]
+            if gap["head"] is None:
+                if acc["gap_tail"] is not None:
+                    acc["gap_tail"] += gap["tail"]
+            else:
+                if acc["gap_tail"] is not None:
+                    acc["gap_hist"][min(acc["gap_tail"] + gap["head"], GAP_MAX)] += 1
+                acc["gap_tail"] = gap["tail"]
+
+        for key, chunk in part["pairs"].items():
+            acc = self.pairs.setdefault(
+                key, {"sum_xy": 0.0, "joint": np.zeros_like(chunk["joint"])}
+            )
+            acc["sum_xy"] += chunk["sum_xy"]
+            acc["joint"] += chunk["joint"]
+        self.n += part["count"]
+
+
+def _gamma_q(a: float, x: float) -> float:
+    """Регуляризованная верхняя неполная гамма-функция Q(a, x)."""
+
+    if x <= 0:
+        return 1.0
+    log_prefix = -x + a * math.log(x) - math.lgamma(a)
+    if x < a + 1:
+        term = total = 1.0 / a
+        ap = a
+        for _ in range(10000):
+            ap += 1
+            term *= x / ap
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    # Непрерывная дробь (метод Лентца)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 10000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(log_prefix) * h
+
+
+def chi2_sf(statistic: float, df: int) -> float:
+    return _gamma_q(df / 2.0, statistic / 2.0)
+
+
+def normal_two_sided(z: float) -> float:
+    return math.erfc(abs(z) / math.sqrt(2.0))
+
+
+def _chi_square(observed: np.ndarray, expected_probs: np.ndarray) -> Tuple[float, int, float]:
+    observed = observed.astype(np.float64).ravel()
+    expected = expected_probs.ravel() * observed.sum()
+    mask = expected > 0
+    statistic = float((((observed - expected) ** 2)[mask] / expected[mask]).sum())
+    df = int(mask.sum()) - 1
+    return statistic, df, chi2_sf(statistic, df)
+
+
+def _result(name: str, statistic: float, p_value: float, alpha: float, **extra: Any) -> Dict[str, Any]:
+    return {
+        "test": name,
+        "statistic": statistic,
+        "p_value": p_value,
+        "passed": p_value >= alpha,
+        **extra,
+    }
+
+
+def evaluate(acc: Accumulator, alpha: float) -> List[Dict[str, Any]]:
+    n = acc.n
+    results: List[Dict[str, Any]] = []
+    gap_probs = np.array(
+        [GAP_INTERVAL * (1 - GAP_INTERVAL) ** g for g in range(GAP_MAX)]
+        + [(1 - GAP_INTERVAL) ** GAP_MAX]
+    )
+
+    for index, (spec, reel) in enumerate(zip(acc.specs, acc.reels)):
+        tag = {"reel": index}
+
+        statistic, df, p_value = _chi_square(reel["raw_hist"], np.full(RAW_BINS, 1.0 / RAW_BINS))
+        results.append(_result("raw_uniformity_chi2", statistic, p_value, alpha, df=df, **tag))
+
+        statistic, df, p_value = _chi_square(reel["symbol_counts"], spec.expected)
+        results.append(
+            _result(
+                "symbol_frequency_chi2",
+                statistic,
+                p_value,
+                alpha,
+                df=df,
+                observed={s: int(c) for s, c in zip(spec.symbols, reel["symbol_counts"])},
+                expected={s: float(p) for s, p in zip(spec.symbols, spec.expected)},
+                **tag,
+            )
+        )
+
+        mean = reel["sum"] / n
+        variance = reel["sum_sq"] / n - mean * mean
+        lag_cov = reel["sum_lag"] / (n - 1) - mean * mean
+        r = lag_cov / variance if variance > 0 else 0.0
+        results.append(
+            _result("serial_correlation_lag1", r, normal_two_sided(r * math.sqrt(n)), alpha, **tag)
+        )
+
+        n1 = reel["above"]
+        n2 = n - n1
+        expected_runs = 2.0 * n1 * n2 / n + 1
+        runs_var = (expected_runs - 1) * (expected_runs - 2) / (n - 1)
+        z = (reel["runs"] - expected_runs) / math.sqrt(runs_var) if runs_var > 0 else 0.0
+        results.append(
+            _result("runs_above_below_median", z, normal_two_sided(z), alpha, runs=reel["runs"], **tag)
+        )
+
+        statistic, df, p_value = _chi_square(reel["gap_hist"], gap_probs)
+        results.append(
+            _result("gap", statistic, p_value, alpha, df=df, interval=[0.0, GAP_INTERVAL], **tag)
+        )
+
+    for key, pair in acc.pairs.items():
+        i, j = (int(part) for part in key.split("-"))
+        mean_i = acc.reels[i]["sum"] / n
+        mean_j = acc.reels[j]["sum"] / n
+        var_i = acc.reels[i]["sum_sq"] / n - mean_i ** 2
+        var_j = acc.reels[j]["sum_sq"] / n - mean_j ** 2
+        r = (pair["sum_xy"] / n - mean_i * mean_j) / math.sqrt(var_i * var_j)
+        results.append(
+            _result("cross_reel_correlation", r, normal_two_sided(r * math.sqrt(n)), alpha, reels=[i, j])
+        )
+
+        joint = pair["joint"].astype(np.float64)
+        expected = np.outer(joint.sum(axis=1), joint.sum(axis=0)) / joint.sum()
+        mask = expected > 0
+        statistic = float((((joint - expected) ** 2)[mask] / expected[mask]).sum())
+        df = (joint.shape[0] - 1) * (joint.shape[1] - 1)
+        results.append(
+            _result(
+                "cross_reel_symbol_independence_chi2",
+                statistic,
+                chi2_sf(statistic, df),
+                alpha,
+                df=df,
+                reels=[i, j],
+            )
+        )
+
+    return results
+
+
+def self_check(matrix: ReelMatrix, specs: List[ReelSpec], server_seed: str, client_seed: str) -> bool:
+    """Убеждаемся, что проверяем ровно то, что выдаёт движок."""
+
+    compiled = CompiledReels(matrix)
+    raw = _hash_chunk(server_seed, client_seed, 0, SELF_CHECK_NONCES, len(specs))
+    ours = [spec.to_symbols(raw[:, index]) for index, spec in enumerate(specs)]
+    for nonce in range(SELF_CHECK_NONCES):
+        engine = compiled.spin_provably_fair(server_seed, client_seed, nonce)
+        if engine != [specs[i].symbols[ours[i][nonce]] for i in range(len(specs))]:
+            return False
+    return True
+
+
+def run(
+    matrix: Optional[ReelMatrix] = None,
+    nonces: int = 10_000_000,
+    server_seed: Optional[str] = None,
+    client_seed: str = "rng-quality",
+    alpha: float = 1e-4,
+    workers: Optional[int] = None,
+    chunk: int = CHUNK_NONCES,
+) -> Dict[str, Any]:
+    matrix = matrix or DEFAULT_REELS_MATRIX
+    server_seed = server_seed or os.urandom(32).hex()
+    specs = [ReelSpec(reel) for reel in matrix]
+
+    started = time.perf_counter()
+    tasks = [
+        (server_seed, client_seed, start, min(chunk, nonces - start), specs)
+        for start in range(0, nonces, chunk)
+    ]
+    acc = Accumulator(specs)
+    with Pool(processes=workers or os.cpu_count()) as pool:
+        for part in pool.imap(analyze_chunk, tasks):
+            acc.add(part)
+    elapsed = time.perf_counter() - started
+
+    results = evaluate(acc, alpha)
+    engine_match = self_check(matrix, specs, server_seed, client_seed)
+    return {
+        "server_seed": server_seed,
+        "client_seed": client_seed,
+        "nonces": nonces,
+        "reels": len(specs),
+        "draws": nonces * len(specs),
+        "alpha": alpha,
+        "elapsed_seconds": elapsed,
+        "draws_per_second": nonces * len(specs) / elapsed if elapsed else 0.0,
+        "engine_match": engine_match,
+        "passed": engine_match and all(result["passed"] for result in results),
+        "tests": results,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reels", help="JSON-файл с матрицей барабанов (как ReelWeights.reels)")
+    parser.add_argument("--nonces", type=int, default=10_000_000)
+    parser.add_argument("--server-seed")
+    parser.add_argument("--client-seed", default="rng-quality")
+    parser.add_argument("--alpha", type=float, default=1e-4,
+                        help="уровень значимости на один тест")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk", type=int, default=CHUNK_NONCES)
+    args = parser.parse_args(argv)
+
+    matrix = None
+    if args.reels:
+        with open(args.reels, "r", encoding="utf-8") as fh:
+            matrix = json.load(fh)
+
+    report = run(
+        matrix,
+        nonces=args.nonces,
+        server_seed=args.server_seed,
+        client_seed=args.client_seed,
+        alpha=args.alpha,
+        workers=args.workers,
+        chunk=args.chunk,
+    )
+    print(json.dumps(report, indent=2))
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
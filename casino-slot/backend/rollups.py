@@ -0,0 +1,331 @@
+"""Часовые и дневные агрегаты по спинам (GGR по тирам ставок, активность игроков).
+
+    python rollups.py            # догнать watermark и выйти (на всех шардах)
+
+Воркеры API запускают тот же проход в фоне (lifecycle). Каждый проход
+берёт только спины с id выше watermark, поэтому стоимость не зависит от
+размера таблицы spins; отчёты читают только rollup-таблицы. При
+шардировании у каждого шарда свои rollup-таблицы и watermark, отчёты
+сливаются через merge_ggr / merge_active_users.
+"""
+
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import RollupBetTier, RollupUser, RollupWatermark, Spin
+
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "5000"))
+ROLLUP_INTERVAL_SECONDS = float(os.getenv("ROLLUP_INTERVAL_SECONDS", "60"))
+# Спины моложе лага не трогаем: транзакция с меньшим id может ещё не закоммититься
+ROLLUP_LAG_SECONDS = float(os.getenv("ROLLUP_LAG_SECONDS", "5"))
+
+WATERMARK_NAME = "spins"
+PERIODS = ("hour", "day")
+
+Totals = List[float]  # [spins, total_bet, total_win]
+
+
+def bucket_start(period: str, moment: datetime) -> datetime:
+    if period == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown period: {period}")
+
+
+def _watermark(db: Session) -> int:
+    row = db.get(RollupWatermark, WATERMARK_NAME)
+    if row is not None:
+        return row.last_spin_id
+    try:
+        db.add(RollupWatermark(name=WATERMARK_NAME, last_spin_id=0))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+    return 0
+
+
+def _add(totals: Dict[Any, Totals], key: Any, bet: float, win: float) -> None:
+    current = totals.setdefault(key, [0, 0.0, 0.0])
+    current[0] += 1
+    current[1] += bet
+    current[2] += win
+
+
+def _merge(
+    db: Session,
+    model: Any,
+    column: str,
+    totals: Dict[Tuple[str, datetime, Any], Totals],
+) -> None:
+    buckets = list({key[1] for key in totals})
+    values = list({key[2] for key in totals})
+    existing = {
+        (row.period, row.bucket_start, getattr(row, column)): row
+        for row in db.query(model)
+        .filter(model.bucket_start.in_(buckets), getattr(model, column).in_(values))
+        .all()
+    }
+    for key, (spins, total_bet, total_win) in totals.items():
+        row = existing.get(key)
+        if row is None:
+            period, start, value = key
+            row = model(
+                period=period, bucket_start=start, spins=0, total_bet=0.0, total_win=0.0
+            )
+            setattr(row, column, value)
+            db.add(row)
+        row.spins += spins
+        row.total_bet += total_bet
+        row.total_win += total_win
+
+
+def process_new_spins(
+    db: Session, batch_size: int = ROLLUP_BATCH_SIZE, now: Optional[datetime] = None
+) -> int:
+    """Один проход: агрегирует до batch_size новых спинов и двигает watermark.
+
+    Агрегаты и watermark пишутся одной транзакцией, а watermark обновляется
+    условно (last_spin_id = старое значение) — если другой воркер успел
+    первым, транзакция откатывается и спины не учитываются дважды.
+    Возвращает число обработанных спинов.
+    """
+
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=ROLLUP_LAG_SECONDS)
+    last_id = _watermark(db)
+
+    rows = (
+        db.query(Spin.id, Spin.user_id, Spin.bet, Spin.win, Spin.created_at)
+        .filter(Spin.id > last_id)
+        .order_by(Spin.id)
+        .limit(batch_size)
+        .all()
+    )
+
+    tiers: Dict[Tuple[str, datetime, float], Totals] = {}
+    users: Dict[Tuple[str, datetime, int], Totals] = {}
+    new_last_id = last_id
+    for spin_id, user_id, bet, win, created_at in rows:
+        if created_at is not None and created_at > cutoff:
+            break
+        # Спины без created_at (записаны до появления колонки) относим к текущему часу
+        moment = created_at or now
+        bet, win = bet or 0.0, win or 0.0
+        for period in PERIODS:
+            start = bucket_start(period, moment)
+            _add(tiers, (period, start, bet), bet, win)
+            _add(users, (period, start, user_id), bet, win)
+        new_last_id = spin_id
+
+    if new_last_id == last_id:
+        db.rollback()
+        return 0
+
+    processed = sum(totals[0] for key, totals in tiers.items() if key[0] == "day")
+    try:
+        claimed = db.execute(
+            update(RollupWatermark)
+            .where(
+                RollupWatermark.name == WATERMARK_NAME,
+                RollupWatermark.last_spin_id == last_id,
+            )
+            .values(last_spin_id=new_last_id)
+        ).rowcount
+        if not claimed:
+            db.rollback()
+            return 0
+        _merge(db, RollupBetTier, "bet_amount", tiers)
+        _merge(db, RollupUser, "user_id", users)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return processed
+
+
+def run_until_caught_up(db: Session, batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    total = 0
+    while True:
+        processed = process_new_spins(db, batch_size)
+        total += processed
+        if processed < batch_size:
+            return total
+
+
+def _range(
+    period: str, start: Optional[datetime], end: Optional[datetime]
+) -> Tuple[datetime, datetime]:
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+    end = end or datetime.utcnow()
+    start = start or end - (timedelta(days=2) if period == "hour" else timedelta(days=30))
+    return bucket_start(period, start), end
+
+
+def ggr_report(
+    db: Session,
+    period: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bet_amount: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """GGR по корзинам; без bet_amount — с разбивкой по тирам и итогом корзины."""
+
+    start, end = _range(period, start, end)
+    query = db.query(RollupBetTier).filter(
+        RollupBetTier.period == period,
+        RollupBetTier.bucket_start >= start,
+        RollupBetTier.bucket_start <= end,
+    )
+    if bet_amount is not None:
+        query = query.filter(RollupBetTier.bet_amount == bet_amount)
+
+    buckets: Dict[datetime, Dict[str, Any]] = {}
+    for row in query.order_by(RollupBetTier.bucket_start, RollupBetTier.bet_amount):
+        bucket = buckets.setdefault(
+            row.bucket_start,
+            {
+                "bucket_start": row.bucket_start,
+                "spins": 0,
+                "total_bet": 0.0,
+                "total_win": 0.0,
+                "tiers": [],
+            },
+        )
+        bucket["spins"] += row.spins
+        bucket["total_bet"] += row.total_bet
+        bucket["total_win"] += row.total_win
+        bucket["tiers"].append(
+            {
+                "bet_amount": row.bet_amount,
+                "spins": row.spins,
+                "total_bet": row.total_bet,
+                "total_win": row.total_win,
+                "ggr": row.total_bet - row.total_win,
+            }
+        )
+    for bucket in buckets.values():
+        bucket["ggr"] = bucket["total_bet"] - bucket["total_win"]
+    return list(buckets.values())
+
+
+def active_users_report(
+    db: Session,
+    period: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    start, end = _range(period, start, end)
+    rows = (
+        db.query(RollupUser.bucket_start, func.count(RollupUser.user_id))
+        .filter(
+            RollupUser.period == period,
+            RollupUser.bucket_start >= start,
+            RollupUser.bucket_start <= end,
+        )
+        .group_by(RollupUser.bucket_start)
+        .order_by(RollupUser.bucket_start)
+        .all()
+    )
+    return [{"bucket_start": bucket, "active_users": count} for bucket, count in rows]
+
+
+def user_report(
+    db: Session,
+    user_id: int,
+    period: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    start, end = _range(period, start, end)
+    rows = (
+        db.query(RollupUser)
+        .filter(
+            RollupUser.period == period,
+            RollupUser.user_id == user_id,
+            RollupUser.bucket_start >= start,
+            RollupUser.bucket_start <= end,
+        )
+        .order_by(RollupUser.bucket_start)
+        .all()
+    )
+    return [
+        {
+            "bucket_start": row.bucket_start,
+            "spins": row.spins,
+            "total_bet": row.total_bet,
+            "total_win": row.total_win,
+            "net": row.total_win - row.total_bet,
+        }
+        for row in rows
+    ]
+
+
+def merge_ggr(parts: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Сливает ggr_report с нескольких шардов: корзины и тиры складываются."""
+
+    buckets: Dict[datetime, Dict[str, Any]] = {}
+    tiers: Dict[Tuple[datetime, float], Dict[str, Any]] = {}
+    for part in parts:
+        for item in part:
+            bucket = buckets.setdefault(
+                item["bucket_start"],
+                {
+                    "bucket_start": item["bucket_start"],
+                    "spins": 0,
+                    "total_bet": 0.0,
+                    "total_win": 0.0,
+                    "tiers": [],
+                },
+            )
+            bucket["spins"] += item["spins"]
+            bucket["total_bet"] += item["total_bet"]
+            bucket["total_win"] += item["total_win"]
+            for tier in item["tiers"]:
+                key = (item["bucket_start"], tier["bet_amount"])
+                merged = tiers.get(key)
+                if merged is None:
+                    merged = tiers[key] = dict(tier)
+                    bucket["tiers"].append(merged)
+                    continue
+                merged["spins"] += tier["spins"]
+                merged["total_bet"] += tier["total_bet"]
+                merged["total_win"] += tier["total_win"]
+                merged["ggr"] = merged["total_bet"] - merged["total_win"]
+    for bucket in buckets.values():
+        bucket["tiers"].sort(key=lambda tier: tier["bet_amount"])
+        bucket["ggr"] = bucket["total_bet"] - bucket["total_win"]
+    return [buckets[start] for start in sorted(buckets)]
+
+
+def merge_active_users(parts: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    # Игрок живёт ровно на одном шарде, поэтому счётчики просто складываются
+    counts: Dict[datetime, int] = {}
+    for part in parts:
+        for item in part:
+            counts[item["bucket_start"]] = counts.get(item["bucket_start"], 0) + item["active_users"]
+    return [{"bucket_start": start, "active_users": counts[start]} for start in sorted(counts)]
+
+
+def main() -> int:
+    from sharding import router
+
+    logging.basicConfig(level=logging.INFO)
+    processed = sum(router.scatter(run_until_caught_up, read=False))
+    logger.info("Rolled up %s spins", processed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
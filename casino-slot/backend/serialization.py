@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:  # pragma: no cover
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(value: Any) -> bytes:
+        return _encoder.encode(value).encode("utf-8")
+
+    loads = json.loads
+
+
+class FastJSONResponse(Response):
+    """JSON-ответ через orjson; готовые bytes отдаются как есть."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return dumps(content)
+
+
+def encode_model(model: Any) -> bytes:
+    """Поля pydantic-модели без .dict(): значения уже JSON-совместимые."""
+
+    return dumps(model.__dict__)
+
+
+def model_response(model: Any, status_code: int = 200) -> FastJSONResponse:
+    """Ответ, минуя повторную валидацию response_model в FastAPI."""
+
+    return FastJSONResponse(encode_model(model), status_code=status_code)
+
+
+class Frame:
+    """Шаблон WS-сообщения {"type": ..., "payload": ...} с заранее собранным префиксом.
+
+    Тип и обрамление кодируются один раз при импорте; на каждое сообщение
+    сериализуется только payload.
+    """
+
+    __slots__ = ("prefix",)
+
+    def __init__(self, message_type: str) -> None:
+        self.prefix = b'{"type":' + dumps(message_type) + b',"payload":'
+
+    def encode(self, payload: Any) -> bytes:
+        return self.prefix + dumps(payload) + b"}"
+
+    def wrap(self, encoded_payload: bytes) -> bytes:
+        return self.prefix + encoded_payload + b"}"
+
+
+def frame(message: Dict[str, Any]) -> str:
+    """Постоянное WS-сообщение, закодированное один раз."""
+
+    return dumps(message).decode("utf-8")
+
+
+async def send_encoded(websocket: Any, data: bytes) -> None:
+    # Текстовый кадр, как у send_json: клиенты разбирают JSON из строки
+    await websocket.send_text(data.decode("utf-8"))
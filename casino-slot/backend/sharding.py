@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Sequence, TypeVar
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import build_engine, engine, read_engine
+
+
+T = TypeVar("T")
+
+# Шарды пользовательских данных. Пусто — один шард на основном engine
+# (поведение как до шардирования). Глобальные таблицы (reel_weights,
+# experiments, bonus_meters, user_directory) всегда живут в DATABASE_URL.
+DATABASE_SHARD_URLS = [
+    url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()
+]
+DATABASE_SHARD_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DATABASE_SHARD_REPLICA_URLS", "").split(",") if url.strip()
+]
+# Шаг последовательностей id на шардах (reshard.py sequences): id спинов
+# не пересекаются между шардами, пока шардов не больше шага. id игроков
+# выдаёт user_directory в основной БД.
+SHARD_ID_STRIDE = int(os.getenv("SHARD_ID_STRIDE", "64"))
+
+# Таблицы, строки которых принадлежат пользователю и лежат на его шарде
+USER_TABLES = (
+    "users",
+    "spins",
+    "session_data",
+    "provably_fair_state",
+    "wallet_entries",
+    "wallet_snapshots",
+)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping, Veach): при N -> N+1 переезжает 1/(N+1) ключей."""
+
+    b, j = -1, 0
+    key &= 0xFFFFFFFFFFFFFFFF
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+class Shard:
+    __slots__ = ("index", "engine", "read_engine", "session", "read_session")
+
+    def __init__(self, index: int, write_engine: Any, replica_engine: Any) -> None:
+        self.index = index
+        self.engine = write_engine
+        self.read_engine = replica_engine
+        self.session = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+        self.read_session = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+
+
+class ShardRouter:
+    """Маршрутизация сессий по user_id.
+
+    Все строки пользователя (USER_TABLES) лежат на шарде jump_hash(user_id).
+    Запросы по нескольким пользователям идут через scatter(): функция
+    выполняется на каждом шарде параллельно, результаты сливает вызывающий.
+    """
+
+    def __init__(self, urls: Sequence[str], replica_urls: Sequence[str]) -> None:
+        if not urls:
+            self.shards = [Shard(0, engine, read_engine)]
+            return
+        if replica_urls and len(replica_urls) != len(urls):
+            raise ValueError("DATABASE_SHARD_REPLICA_URLS must match DATABASE_SHARD_URLS")
+        if len(urls) > SHARD_ID_STRIDE:
+            raise ValueError(f"At most {SHARD_ID_STRIDE} shards are supported")
+        shards = []
+        for index, url in enumerate(urls):
+            write_engine = build_engine(url)
+            if replica_urls:
+                replica = build_engine(replica_urls[index], "DB_READ", read_only=True)
+            elif url.startswith("sqlite"):
+                replica = write_engine
+            else:
+                replica = build_engine(url, "DB_READ", read_only=True)
+            shards.append(Shard(index, write_engine, replica))
+        self.shards = shards
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.shards) > 1 or self.shards[0].engine is not engine
+
+    @property
+    def count(self) -> int:
+        return len(self.shards)
+
+    def shard_for(self, user_id: int) -> Shard:
+        return self.shards[jump_hash(user_id, len(self.shards))]
+
+    def session(self, user_id: int) -> Session:
+        return self.shard_for(user_id).session()
+
+    def read_session(self, user_id: int) -> Session:
+        return self.shard_for(user_id).read_session()
+
+    def engines(self) -> Iterator[Any]:
+        seen = set()
+        for shard in self.shards:
+            for item in (shard.engine, shard.read_engine):
+                if id(item) not in seen:
+                    seen.add(id(item))
+                    yield item
+
+    def scatter(self, fn: Callable[[Session], T], read: bool = True) -> List[T]:
+        """Выполняет fn(session) на каждом шарде; порядок результатов — порядок шардов."""
+
+        def run(shard: Shard) -> T:
+            db = shard.read_session() if read else shard.session()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+
+        if len(self.shards) == 1:
+            return [run(self.shards[0])]
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as pool:
+            return list(pool.map(run, self.shards))
+
+    def dispose(self) -> None:
+        for item in self.engines():
+            item.dispose()
+
+
+router = ShardRouter(DATABASE_SHARD_URLS, DATABASE_SHARD_REPLICA_URLS)
+
+
+def get_user_db(user_id: int):
+    db = router.session(user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_user_read_db(user_id: int):
+    db = router.read_session(user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
@@ -0,0 +1,359 @@
+"""Векторизованный симулятор RTP на NumPy, включая бонусные фриспины.
+
+    python simulator.py --bet 1 --players 20000 --spins 2000
+    python simulator.py --reels reels.json --no-bonus --no-jackpot
+    python simulator.py --bet-mode ramp --bets 1,500   # ставка у порога бонуса
+
+Игроки симулируются параллельно (массивы длины players), по спинам идёт
+цикл — так счётчики BonusMeter ведут себя так же, как в bonus.BonusEngine.
+Джекпот — общий пул всего сервера с шансом порядка 1e-6 на спин, поэтому
+его доля RTP берётся аналитически (jackpot.expected_rtp), а не из выборки.
+"""
+
+import argparse
+import json
+import math
+import sys
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from bonus_rules import (
+    MAX_TRIGGERS_PER_SPIN,
+    SMALL_WIN_MAX_MULTIPLIER,
+    BonusRule,
+    load_bonus_rules,
+)
+from jackpot import jackpot
+from slot_engine import DEFAULT_REELS_MATRIX, SYMBOL_PAYOUTS, ReelMatrix
+
+
+class VectorReels:
+    """Матрица барабанов в виде массивов: кумулятивные веса и выплаты по кодам."""
+
+    def __init__(self, matrix: ReelMatrix, paytable: Dict[str, float] = SYMBOL_PAYOUTS) -> None:
+        symbols: List[str] = []
+        for reel in matrix:
+            for cell in reel:
+                if cell["symbol"] not in symbols:
+                    symbols.append(cell["symbol"])
+        self.symbols = symbols
+        self.reel_count = len(matrix)
+        self.payouts = np.array([paytable.get(symbol, 0.0) for symbol in symbols])
+
+        self.codes: List[np.ndarray] = []
+        self.cumulative: List[np.ndarray] = []
+        for reel in matrix:
+            weights = np.array([int(cell["weight"]) for cell in reel], dtype=np.int64)
+            if weights.sum() <= 0:
+                weights = np.ones(len(reel), dtype=np.int64)
+            self.codes.append(np.array([symbols.index(cell["symbol"]) for cell in reel]))
+            self.cumulative.append(np.cumsum(weights))
+
+    def draw(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        """n исходов -> массив кодов символов формы (n, reels)."""
+        out = np.empty((n, self.reel_count), dtype=np.int64)
+        for reel_index, (codes, cumulative) in enumerate(zip(self.codes, self.cumulative)):
+            targets = rng.integers(0, cumulative[-1], size=n)
+            out[:, reel_index] = codes[np.searchsorted(cumulative, targets, side="right")]
+        return out
+
+    def evaluate(self, outcomes: np.ndarray, bets: np.ndarray) -> np.ndarray:
+        """Векторный аналог slot_engine.calculate_win."""
+        if self.reel_count != 3:
+            return np.zeros(len(outcomes))
+        same = (outcomes[:, 0] == outcomes[:, 1]) & (outcomes[:, 1] == outcomes[:, 2])
+        return np.where(same, bets * self.payouts[outcomes[:, 0]], 0.0)
+
+
+def bonus_stake_rate(
+    rules: Sequence[BonusRule],
+    bet: float,
+    small_win_frequency: float,
+    spin_interval: float = 5.0,
+) -> float:
+    """Сумма ставок бонусных фриспинов на единицу платной ставки (долгий прогон).
+
+    Фриспины играют те же барабаны, поэтому их RTP — это base_rtp * rate.
+    Фиксированная ставка; окно средней ставки правила равно bet. Счётчики
+    двигают только платные спины, но время идёт и на фриспинах: если
+    time_meter даёт T фриспинов на спин, а остальные правила — A на платный,
+    то фриспинов на платный F = A + T * (1 + F).
+    """
+
+    paid_spins = paid_value = timed_spins = timed_value = 0.0
+    for rule in rules:
+        stake = (rule.stake if rule.stake is not None else bet) / bet
+        if rule.meter == "time_meter":
+            rate = spin_interval / (rule.threshold * 60.0)
+            timed_spins += rate * rule.free_spins
+            timed_value += rate * rule.free_spins * stake
+            continue
+        if rule.meter == "small_win_meter":
+            rate = small_win_frequency / rule.threshold
+        else:
+            rate = min(bet / rule.threshold, MAX_TRIGGERS_PER_SPIN)
+        paid_spins += rate * rule.free_spins
+        paid_value += rate * rule.free_spins * stake
+    if timed_spins >= 1.0:
+        return math.inf
+    free_per_paid = (paid_spins + timed_spins) / (1.0 - timed_spins)
+    return paid_value + timed_value * (1.0 + free_per_paid)
+
+
+def exact_stats(
+    matrix: ReelMatrix,
+    paytable: Dict[str, float] = SYMBOL_PAYOUTS,
+    jackpot_rtp: float = 0.0,
+    rules: Sequence[BonusRule] = (),
+    bet: float = 1.0,
+) -> Dict[str, float]:
+    """Точные RTP, частота выигрышей и σ выигрыша (в ставках) за один спин.
+
+    Барабаны независимы, платит только «три одинаковых», поэтому
+    P(s) = p1(s) * p2(s) * p3(s) — без симуляции. jackpot_rtp — доля
+    джекпота при ставке тира; входит в rtp, но не в частоту и σ.
+    rules — бонусные правила для ставки bet (bonus_stake_rate); их доля
+    тоже только в rtp.
+    """
+
+    stats = {
+        "rtp": jackpot_rtp,
+        "rtp_jackpot": jackpot_rtp,
+        "rtp_bonus": 0.0,
+        "hit_frequency": 0.0,
+        "std_dev": 0.0,
+        "max_multiplier": 0.0,
+    }
+    if len(matrix) != 3:
+        return stats
+
+    distributions: List[Dict[str, float]] = []
+    for reel in matrix:
+        weights = [int(cell["weight"]) for cell in reel]
+        total = sum(weights)
+        if total <= 0:
+            weights, total = [1] * len(reel), len(reel)
+        dist: Dict[str, float] = {}
+        for cell, weight in zip(reel, weights):
+            dist[cell["symbol"]] = dist.get(cell["symbol"], 0.0) + weight / total
+        distributions.append(dist)
+
+    base_rtp = 0.0
+    second_moment = 0.0
+    small_win_frequency = 0.0
+    for symbol, p1 in distributions[0].items():
+        payout = paytable.get(symbol, 0.0)
+        probability = p1 * distributions[1].get(symbol, 0.0) * distributions[2].get(symbol, 0.0)
+        if payout <= 0 or probability <= 0:
+            continue
+        base_rtp += probability * payout
+        stats["hit_frequency"] += probability
+        if payout <= SMALL_WIN_MAX_MULTIPLIER:
+            small_win_frequency += probability
+        second_moment += probability * payout * payout
+        stats["max_multiplier"] = max(stats["max_multiplier"], payout)
+
+    if rules:
+        stats["rtp_bonus"] = base_rtp * bonus_stake_rate(rules, bet, small_win_frequency)
+    stats["rtp"] += base_rtp + stats["rtp_bonus"]
+    stats["std_dev"] = math.sqrt(max(second_moment - base_rtp ** 2, 0.0))
+    return stats
+
+
+def _meter_arrays(players: int) -> Dict[str, np.ndarray]:
+    return {
+        "small_win_meter": np.zeros(players),
+        "bet_total_meter": np.zeros(players),
+        "time_seconds": np.zeros(players),
+    }
+
+
+BET_MODES = ("fixed", "mixed", "ramp")
+
+
+def _near_trigger(
+    meters: Dict[str, np.ndarray],
+    rules: Sequence[BonusRule],
+    min_bet: float,
+    spin_interval: float,
+) -> np.ndarray:
+    """Игроки, у которых порог бонуса сработает уже на следующем спине."""
+
+    near = np.zeros(len(meters["bet_total_meter"]), dtype=bool)
+    for rule in rules:
+        if rule.meter == "bet_total_meter":
+            near |= meters["bet_total_meter"] + min_bet >= rule.threshold
+        elif rule.meter == "small_win_meter":
+            near |= meters["small_win_meter"] + 1 >= rule.threshold
+        else:
+            near |= meters["time_seconds"] + spin_interval >= rule.threshold * 60.0
+    return near
+
+
+def simulate(
+    matrix: Optional[ReelMatrix] = None,
+    bet: float = 1.0,
+    players: int = 10000,
+    spins: int = 1000,
+    rules: Optional[Sequence[BonusRule]] = None,
+    spin_interval: float = 5.0,
+    seed: Optional[int] = None,
+    paytable: Optional[Dict[str, float]] = None,
+    with_jackpot: bool = True,
+    bet_mode: str = "fixed",
+    bets: Optional[Sequence[float]] = None,
+) -> Dict[str, Any]:
+    """RTP на популяции игроков.
+
+    bet_mode: fixed — все ставят bet; mixed — каждый платный спин ставка
+    случайна из bets; ramp — минимальная ставка из bets, а спин, на котором
+    сработает порог бонуса, — максимальная. mixed/ramp показывают,
+    зависит ли ценность фриспинов от того, какой ставкой взят порог.
+    """
+
+    if bet_mode not in BET_MODES:
+        raise ValueError(f"Unknown bet mode: {bet_mode}")
+    reels = VectorReels(matrix or DEFAULT_REELS_MATRIX, paytable or SYMBOL_PAYOUTS)
+    rng = np.random.default_rng(seed)
+    rules = list(rules or [])
+    bet_choices = np.array(sorted(bets) if bets else [bet], dtype=float)
+
+    meters = _meter_arrays(players)
+    windows = {
+        rule.name: (np.zeros(players), np.zeros(players)) for rule in rules if rule.stake is None
+    }
+    # Очередь фриспинов игрока: число и сумма ставок. Выигрыш линеен по ставке,
+    # поэтому спин по средней ставке очереди даёт тот же ожидаемый RTP, что и FIFO
+    free_left = np.zeros(players, dtype=np.int64)
+    free_value = np.zeros(players)
+
+    paid_spins = free_spins = hits = awards = 0
+    total_bet = base_win = bonus_win = jackpot_win = 0.0
+
+    for step in range(spins):
+        is_free = free_left > 0
+        paid = ~is_free
+        if bet_mode == "fixed":
+            base_bets = np.full(players, bet)
+        elif bet_mode == "mixed":
+            base_bets = rng.choice(bet_choices, size=players)
+        else:
+            near = _near_trigger(meters, rules, bet_choices[0], spin_interval)
+            base_bets = np.where(near, bet_choices[-1], bet_choices[0])
+        free_bets = free_value / np.maximum(free_left, 1)
+        play_bets = np.where(is_free, free_bets, base_bets)
+        stakes = np.where(paid, base_bets, 0.0)
+
+        wins = reels.evaluate(reels.draw(rng, players), play_bets)
+        free_value[is_free] -= free_bets[is_free]
+        free_left[is_free] -= 1
+
+        paid_count = int(paid.sum())
+        paid_spins += paid_count
+        free_spins += players - paid_count
+        hits += int((wins > 0).sum())
+        total_bet += float(stakes.sum())
+        base_win += float(wins[paid].sum())
+        bonus_win += float(wins[is_free].sum())
+        if with_jackpot:
+            jackpot_win += float(
+                (np.minimum(stakes / jackpot.reference_bet, 1.0) / jackpot.hit_odds).sum()
+            ) * jackpot.expected_pool()
+
+        if not rules:
+            continue
+
+        small = paid & (wins > 0) & (wins <= base_bets * SMALL_WIN_MAX_MULTIPLIER)
+        meters["small_win_meter"] += small
+        meters["bet_total_meter"] += stakes
+        if step > 0:
+            # Время идёт и во время фриспинов, засчитывается на следующем платном
+            meters["time_seconds"] += spin_interval
+        for window_stake, window_spins in windows.values():
+            window_stake += stakes
+            window_spins += paid
+
+        for rule in rules:
+            field = "time_seconds" if rule.meter == "time_meter" else rule.meter
+            scale = 60.0 if rule.meter == "time_meter" else 1.0
+            times = np.floor(meters[field] / (rule.threshold * scale)).astype(np.int64)
+            times[~paid] = 0
+            triggered = times > 0
+            if not triggered.any():
+                continue
+            awards += int(triggered.sum())
+            meters[field] -= times * rule.threshold * scale
+            if rule.stake is not None:
+                award_stake = np.full(players, rule.stake)
+            else:
+                window_stake, window_spins = windows[rule.name]
+                award_stake = window_stake / np.maximum(window_spins, 1)
+                window_stake[triggered] = 0.0
+                window_spins[triggered] = 0.0
+            count = np.minimum(times, MAX_TRIGGERS_PER_SPIN) * rule.free_spins
+            free_left += count
+            free_value += count * award_stake
+
+    rtp_base = base_win / total_bet if total_bet else 0.0
+    rtp_bonus = bonus_win / total_bet if total_bet else 0.0
+    # Фриспины в пул не вносят и джекпот не разыгрывают — доля только от платных
+    rtp_jackpot = jackpot_win / total_bet if total_bet else 0.0
+    return {
+        "bet": bet,
+        "bet_mode": bet_mode,
+        "mean_bet": total_bet / paid_spins if paid_spins else 0.0,
+        "players": players,
+        "spins_per_player": spins,
+        "paid_spins": paid_spins,
+        "free_spins": free_spins,
+        "bonus_awards": awards,
+        "hit_rate": hits / (paid_spins + free_spins) if spins else 0.0,
+        "rtp_base": rtp_base,
+        "rtp_bonus": rtp_bonus,
+        "rtp_jackpot": rtp_jackpot,
+        "rtp_total": rtp_base + rtp_bonus + rtp_jackpot,
+        "free_spins_per_1000_paid": 1000.0 * free_spins / paid_spins if paid_spins else 0.0,
+    }
+
+
+def _load_matrix(path: Optional[str]) -> Optional[ReelMatrix]:
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reels", help="JSON-файл с матрицей барабанов (как ReelWeights.reels)")
+    parser.add_argument("--bet", type=float, default=1.0)
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--spins", type=int, default=1000)
+    parser.add_argument("--spin-interval", type=float, default=5.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--no-bonus", action="store_true")
+    parser.add_argument("--no-jackpot", action="store_true")
+    parser.add_argument("--bet-mode", choices=BET_MODES, default="fixed")
+    parser.add_argument("--bets", type=lambda value: [float(item) for item in value.split(",")],
+                        help="ставки для mixed/ramp через запятую, например 1,5,25,500")
+    args = parser.parse_args(argv)
+
+    report = simulate(
+        _load_matrix(args.reels),
+        bet=args.bet,
+        players=args.players,
+        spins=args.spins,
+        rules=[] if args.no_bonus else load_bonus_rules(),
+        spin_interval=args.spin_interval,
+        seed=args.seed,
+        with_jackpot=not args.no_jackpot,
+        bet_mode=args.bet_mode,
+        bets=args.bets,
+    )
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
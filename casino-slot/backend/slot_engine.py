@@ -1,11 +1,22 @@
-import random
-from typing import List, Dict, Any, Optional
+from __future__ import annotations
+
+from bisect import bisect_right
 import hashlib
 
+# typing тянет за собой re/enum/contextlib (~10 мс холодного импорта),
+# поэтому нужен только type checker'у. Бюджет см. import_profile.py.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import List, Dict, Any, Optional, Tuple
+
+    ReelCell = Dict[str, Any]
+    ReelMatrix = List[List[ReelCell]]
+else:
+    ReelCell = dict
+    ReelMatrix = list
+
 
 Symbol = str
-ReelCell = Dict[str, Any]
-ReelMatrix = List[List[ReelCell]]
 
 
 SYMBOL_PAYOUTS: Dict[str, float] = {
@@ -76,8 +87,215 @@ def provably_fair_spin_reels(
     return result
 
 
+class CompiledReels:
+    """Матрица барабанов с заранее посчитанными кумулятивными весами.
+
+    Даёт тот же результат, что и provably_fair_spin_reels, но без
+    пересчёта весов и линейного поиска на каждом спине.
+    """
+
+    __slots__ = ("matrix", "reels")
+
+    def __init__(self, matrix: ReelMatrix) -> None:
+        self.matrix = matrix
+        # (символы, кумулятивные веса или None для равномерного выбора, сумма)
+        reels: List[Tuple[Tuple[Symbol, ...], Optional[Tuple[int, ...]], int]] = []
+        for reel in matrix:
+            symbols = tuple(cell["symbol"] for cell in reel)
+            cumulative: List[int] = []
+            total = 0
+            for cell in reel:
+                total += int(cell["weight"])
+                cumulative.append(total)
+            if total <= 0:
+                reels.append((symbols, None, len(reel)))
+            else:
+                reels.append((symbols, tuple(cumulative), total))
+        self.reels = tuple(reels)
+
+    def spin_provably_fair(
+        self, server_seed: str, client_seed: str, nonce: int
+    ) -> List[Symbol]:
+        result: List[Symbol] = []
+        prefix = f"{server_seed}:{client_seed}:{nonce}:"
+        for reel_index, (symbols, cumulative, total) in enumerate(self.reels):
+            digest = hashlib.sha256(f"{prefix}{reel_index}".encode("utf-8")).digest()
+            target = int.from_bytes(digest[:8], byteorder="big") % total
+            if cumulative is None:
+                result.append(symbols[target])
+            else:
+                result.append(symbols[bisect_right(cumulative, target)])
+        return result
+
+
+DEFAULT_COMPILED_REELS = CompiledReels(DEFAULT_REELS_MATRIX)
+
+
+class GameEngine:
+    """Скомпилированная игра: барабаны, окно rows×reels, линии и таблица выплат.
+
+    Неизменяема после сборки и разделяется всеми запросами. Символы спина —
+    плоский список по барабанам (барабан 0: ряды 0..rows-1, барабан 1, ...);
+    при rows == 1 это ровно результат CompiledReels.spin_provably_fair.
+    Ряд 0 выводится из того же sha256, что и раньше, ряды r > 0 — из
+    "{server}:{client}:{nonce}:{reel}:{r}".
+    """
+
+    __slots__ = (
+        "game_id",
+        "version",
+        "reels",
+        "rows",
+        "lines",
+        "pays",
+        "wild",
+        "features",
+        "_feature_engine",
+    )
+
+    def __init__(
+        self,
+        game_id: str,
+        version: str,
+        reels: CompiledReels,
+        rows: int,
+        lines: Tuple[Tuple[int, ...], ...],
+        pays: Dict[Symbol, Tuple[float, ...]],
+        wild: Optional[Symbol] = None,
+        features: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.game_id = game_id
+        self.version = version
+        self.reels = reels
+        self.rows = rows
+        self.lines = lines
+        # pays[symbol][count] — множитель ставки на линию за count подряд слева
+        self.pays = pays
+        self.wild = wild
+        self.features = features or {}
+        self._feature_engine = None
+
+    @property
+    def reel_count(self) -> int:
+        return len(self.reels.reels)
+
+    def spin(
+        self,
+        server_seed: str,
+        client_seed: str,
+        nonce: int,
+        reels: Optional[CompiledReels] = None,
+    ) -> List[Symbol]:
+        """reels — подмена весов (тир ставки / плечо эксперимента) той же формы."""
+
+        reels = reels or self.reels
+        if self.rows == 1:
+            return reels.spin_provably_fair(server_seed, client_seed, nonce)
+        result: List[Symbol] = []
+        prefix = f"{server_seed}:{client_seed}:{nonce}:"
+        for reel_index, (symbols, cumulative, total) in enumerate(reels.reels):
+            for row in range(self.rows):
+                suffix = f"{reel_index}" if row == 0 else f"{reel_index}:{row}"
+                digest = hashlib.sha256(f"{prefix}{suffix}".encode("utf-8")).digest()
+                target = int.from_bytes(digest[:8], byteorder="big") % total
+                if cumulative is None:
+                    result.append(symbols[target])
+                else:
+                    result.append(symbols[bisect_right(cumulative, target)])
+        return result
+
+    def evaluate(self, symbols: List[Symbol], bet: float) -> float:
+        """Сумма выигрышей по линиям; ставка делится поровну между линиями."""
+
+        if bet <= 0 or len(symbols) != self.reel_count * self.rows:
+            return 0.0
+        line_bet = bet / len(self.lines)
+        rows, wild, pays = self.rows, self.wild, self.pays
+        total = 0.0
+        for line in self.lines:
+            target = None
+            count = 0
+            for reel_index, row in enumerate(line):
+                symbol = symbols[reel_index * rows + row]
+                if target is None and symbol != wild:
+                    target = symbol
+                if symbol == target or symbol == wild:
+                    count += 1
+                else:
+                    break
+            # Линия из одних wild платит как wild
+            table = pays.get(target if target is not None else wild)
+            if table and count < len(table):
+                total += line_bet * table[count]
+        return total
+
+    @property
+    def has_features(self) -> bool:
+        return bool(self.features.get("cascade") or self.features.get("free_spins"))
+
+    @property
+    def free_spin_config(self) -> Dict[str, Any]:
+        """Блок free_spins из features: awards, multiplier, retrigger, max_total."""
+
+        return self.features.get("free_spins") or {}
+
+    def feature_engine(self):
+        """features.FeatureEngine этой игры; NumPy грузится только для игр с фичами."""
+
+        if self._feature_engine is None:
+            from features import FeatureEngine
+
+            self._feature_engine = FeatureEngine(self)
+        return self._feature_engine
+
+    def play(
+        self,
+        server_seed: str,
+        client_seed: str,
+        nonce: int,
+        bet: float,
+        reels: Optional[CompiledReels] = None,
+        multiplier: float = 1.0,
+    ) -> SpinOutcome:
+        """Полный раунд: спин, каскады с provably-fair досыпкой, скаттеры.
+
+        multiplier — множитель фриспина, с которым он был начислен.
+        """
+
+        symbols = self.spin(server_seed, client_seed, nonce, reels)
+        if not self.has_features or bet <= 0:
+            return SpinOutcome(symbols, self.evaluate(symbols, bet) * multiplier)
+
+        from features import play_spin
+
+        win, cascades, free_spins = play_spin(
+            self.feature_engine(), symbols, bet, server_seed, client_seed, nonce, multiplier
+        )
+        return SpinOutcome(symbols, win, cascades, free_spins)
+
+
+class SpinOutcome:
+    """Итог раунда: исходное окно, выигрыш с каскадами, окна после досыпок, фриспины."""
+
+    __slots__ = ("symbols", "win", "cascades", "free_spins")
+
+    def __init__(
+        self,
+        symbols: List[Symbol],
+        win: float,
+        cascades: Optional[List[List[Symbol]]] = None,
+        free_spins: int = 0,
+    ) -> None:
+        self.symbols = symbols
+        self.win = win
+        self.cascades = cascades or []
+        self.free_spins = free_spins
+
+
 def spin_reels(reels_matrix: Optional[ReelMatrix] = None) -> List[Symbol]:
     """Крутит барабаны и возвращает выпавший символ на каждом барабане."""
+    import random
+
     matrix = reels_matrix or DEFAULT_REELS_MATRIX
     result: List[Symbol] = []
 
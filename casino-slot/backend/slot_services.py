@@ -1,63 +1,169 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Optional
+import os
+import threading
+import time
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
 
 from sqlalchemy.orm import Session
 
-from models import ReelWeights
-from slot_engine import DEFAULT_REELS_MATRIX, ReelMatrix
+from database import SessionLocal
+from experiments import ExperimentConfig
+from models import Experiment, ReelWeights
+from slot_engine import DEFAULT_COMPILED_REELS, CompiledReels, ReelMatrix
 
 
 RedisLike = Any
 
+TierTable = Tuple[Tuple[float, ...], Tuple[CompiledReels, ...]]
+
+
+class ReelTableCache:
+    """In-process кэш всех строк ReelWeights, скомпилированных в CompiledReels.
+
+    Таблица весов маленькая, поэтому держим её целиком в памяти воркера и
+    перечитываем из БД раз в ttl_seconds. Поиск тира — bisect по ставкам.
+    Вместе с тирами кэшируются активный эксперимент и таблицы его плеч
+    (строки ReelWeights с arm = "эксперимент:плечо").
+
+    reel_weights и experiments — глобальные таблицы основной БД, поэтому
+    перечитываются через свою сессию SessionLocal, а не через сессию
+    запроса: на шардах их копии пустые.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0) -> None:
+        self.ttl_seconds = ttl_seconds
+        self._base: TierTable = ((), ())
+        self._arms: Dict[str, TierTable] = {}
+        self._experiment: Optional[ExperimentConfig] = None
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def experiment(self) -> Optional[ExperimentConfig]:
+        return self._experiment
+
+    def load(self, db: Session) -> int:
+        rows = (
+            db.query(ReelWeights.bet_amount, ReelWeights.reels, ReelWeights.arm)
+            .order_by(ReelWeights.bet_amount.asc(), ReelWeights.id.asc())
+            .all()
+        )
+        tables: Dict[Optional[str], Tuple[List[float], List[CompiledReels]]] = {}
+        for bet_amount, reels, arm in rows:
+            if not reels or bet_amount is None:
+                continue
+            bets, tiers = tables.setdefault(arm, ([], []))
+            if bets and bets[-1] == bet_amount:
+                # При дублях ставки побеждает первая строка
+                continue
+            bets.append(float(bet_amount))
+            tiers.append(CompiledReels(reels))
+
+        experiment = None
+        row = (
+            db.query(Experiment)
+            .filter(Experiment.active.is_(True))
+            .order_by(Experiment.id.desc())
+            .first()
+        )
+        if row is not None:
+            experiment = ExperimentConfig(row.name, row.salt, row.arms)
+
+        frozen = {arm: (tuple(bets), tuple(tiers)) for arm, (bets, tiers) in tables.items()}
+        base = frozen.pop(None, ((), ()))
+        # Атомарная подмена: читатели видят либо старую, либо новую таблицу
+        self._base, self._arms, self._experiment = base, frozen, experiment
+        self._loaded_at = time.monotonic()
+        return len(base[1]) + sum(len(tiers) for _, tiers in frozen.values())
+
+    def reload(self) -> int:
+        db = SessionLocal()
+        try:
+            return self.load(db)
+        finally:
+            db.close()
+
+    def is_stale(self) -> bool:
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > self.ttl_seconds
+        )
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    def resolve(self, bet: float) -> CompiledReels:
+        """Порядок приоритета:
+        1) Точный матч по bet_amount
+        2) Наибольший bet_amount <= bet
+        3) Наименьший bet_amount > bet
+        4) DEFAULT_REELS_MATRIX
+        """
+
+        if self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    self.reload()
+        return self._pick(self._base, bet)
+
+    @staticmethod
+    def _pick(table: TierTable, bet: float) -> CompiledReels:
+        bets, tiers = table
+        if not tiers:
+            return DEFAULT_COMPILED_REELS
+        index = bisect_right(bets, bet) - 1
+        return tiers[max(index, 0)]
+
+    def resolve_for_user(
+        self, bet: float, user_id: int
+    ) -> Tuple[CompiledReels, Optional[str]]:
+        """Как resolve, но с учётом плеча эксперимента. Возвращает (барабаны, тег плеча).
+
+        Плечо без своих таблиц (обычно control) играет на основных тирах.
+        """
+
+        base = self.resolve(bet)
+        experiment = self._experiment
+        if experiment is None:
+            return base, None
+        tag = experiment.tag(user_id)
+        table = self._arms.get(tag)
+        if table is None:
+            return base, tag
+        return self._pick(table, bet), tag
+
+
+reel_cache = ReelTableCache(float(os.getenv("REEL_CACHE_TTL", "60")))
+
+
+def get_compiled_reels_for_bet(bet: float) -> CompiledReels:
+    return reel_cache.resolve(bet)
+
+
+def get_compiled_reels_for_user(
+    bet: float, user_id: int
+) -> Tuple[CompiledReels, Optional[str]]:
+    return reel_cache.resolve_for_user(bet, user_id)
+
 
 def get_reels_matrix_for_bet(
-    db: Session, bet: float, redis_client: Optional[RedisLike] = None
+    db: Session,
+    bet: float,
+    redis_client: Optional[RedisLike] = None,
+    user_id: Optional[int] = None,
 ) -> ReelMatrix:
     """Возвращает матрицу барабанов для заданной ставки.
 
-    Порядок приоритета:
-    1) Точный матч по bet_amount
-    2) Наибольший bet_amount <= bet
-    3) Наименьший bet_amount > bet
-    4) DEFAULT_REELS_MATRIX
+    db и redis_client оставлены для совместимости: таблицы весов живут
+    в памяти воркера и перечитываются из основной БД (см. ReelTableCache).
+    С user_id учитывается плечо активного эксперимента.
     """
 
-    cache_key = f"reels:bet:{bet}"
-    if redis_client is not None:
-        try:
-            cached = redis_client.get(cache_key)
-        except Exception:
-            cached = None
-        if cached:
-            try:
-                return json.loads(cached)
-            except json.JSONDecodeError:
-                pass
-
-    query = db.query(ReelWeights)
-
-    reel_row = (
-        query.filter(ReelWeights.bet_amount == bet).first()
-        or query.filter(ReelWeights.bet_amount <= bet)
-        .order_by(ReelWeights.bet_amount.desc())
-        .first()
-        or query.filter(ReelWeights.bet_amount > bet)
-        .order_by(ReelWeights.bet_amount.asc())
-        .first()
-    )
-
-    if reel_row is not None and reel_row.reels:
-        matrix = reel_row.reels
-        if redis_client is not None:
-            try:
-                redis_client.setex(cache_key, 60, json.dumps(matrix))
-            except Exception:
-                pass
-        return matrix
-
-    return DEFAULT_REELS_MATRIX
+    if user_id is None:
+        return reel_cache.resolve(bet).matrix
+    return reel_cache.resolve_for_user(bet, user_id)[0].matrix
 
 
 def acquire_spin_lock(
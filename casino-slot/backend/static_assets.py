@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from email.utils import formatdate
+from typing import Dict, Iterable, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import RedirectResponse, Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # type: ignore
+
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+MIN_COMPRESS_SIZE = 1024
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("audio/mpeg", ".mp3")
+
+
+class StaticAsset:
+    """Файл, целиком загруженный в память, с заранее сжатыми вариантами."""
+
+    __slots__ = ("body", "media_type", "etag", "last_modified", "encoded")
+
+    def __init__(
+        self, body: bytes, media_type: str, mtime: Optional[float] = None
+    ) -> None:
+        self.body = body
+        self.media_type = media_type
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.last_modified = formatdate(mtime, usegmt=True) if mtime else None
+        # encoding -> (тело, etag варианта)
+        self.encoded: Dict[str, Tuple[bytes, str]] = {}
+
+        base_type = media_type.split(";")[0]
+        if base_type not in COMPRESSIBLE_TYPES or len(body) < MIN_COMPRESS_SIZE:
+            return
+
+        gz = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(gz) < len(body):
+            self.encoded["gzip"] = (gz, f'"{digest}-gz"')
+        if brotli is not None:
+            br = brotli.compress(body, quality=11)
+            if len(br) < len(body):
+                self.encoded["br"] = (br, f'"{digest}-br"')
+
+    @classmethod
+    def from_file(cls, path: str) -> "StaticAsset":
+        with open(path, "rb") as fh:
+            body = fh.read()
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type == "application/javascript":
+            media_type += "; charset=utf-8"
+        return cls(body, media_type, os.path.getmtime(path))
+
+
+def _accepted_encodings(header: str) -> Iterable[str]:
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        yield token.strip().lower()
+
+
+def _etag_matches(header: str, asset: StaticAsset) -> bool:
+    if header.strip() == "*":
+        return True
+    base = asset.etag.strip('"')
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"').split("-")[0] == base:
+            return True
+    return False
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Разбирает одиночный диапазон bytes=a-b. Возвращает (start, end) включительно.
+
+    None — заголовок не поддерживается (отдаём файл целиком),
+    (-1, -1) — диапазон невыполним (416).
+    """
+
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_s, sep, end_s = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not start_s:
+            length = int(end_s)
+            if length <= 0:
+                return (-1, -1)
+            return (max(size - length, 0), size - 1)
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if end < start:
+        return None
+    if start >= size:
+        return (-1, -1)
+    return (start, min(end, size - 1))
+
+
+def asset_response(
+    asset: StaticAsset, request: Request, cache_control: str
+) -> Response:
+    headers = {
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if asset.last_modified:
+        headers["Last-Modified"] = asset.last_modified
+    if asset.encoded:
+        headers["Vary"] = "Accept-Encoding"
+
+    body = asset.body
+    etag = asset.etag
+    range_header = request.headers.get("range")
+    if not range_header:
+        accepted = set(_accepted_encodings(request.headers.get("accept-encoding", "")))
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in asset.encoded:
+                body, etag = asset.encoded[encoding]
+                headers["Content-Encoding"] = encoding
+                break
+    headers["ETag"] = etag
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, asset):
+        headers.pop("Content-Encoding", None)
+        return Response(status_code=304, headers=headers)
+
+    # media_type уже с charset; через параметр Response Starlette
+    # дописал бы к text/* второй "; charset=utf-8"
+    headers["Content-Type"] = asset.media_type
+
+    if range_header:
+        if_range = request.headers.get("if-range")
+        byte_range = None
+        if not if_range or if_range.strip() == asset.etag:
+            byte_range = _parse_range(range_header, len(body))
+        if byte_range == (-1, -1):
+            headers["Content-Range"] = f"bytes */{len(body)}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            return Response(
+                content=memoryview(body)[start : end + 1].tobytes(),
+                status_code=206,
+                headers=headers,
+            )
+
+    return Response(content=body, headers=headers)
+
+
+class AssetStore:
+    """Каталог статики, загруженный в память при старте воркера."""
+
+    def __init__(self, directory: str, max_age: int, html: bool = False) -> None:
+        self.directory = directory
+        self.html = html
+        self.cache_control = f"public, max-age={max_age}"
+        self._assets: Dict[str, StaticAsset] = {}
+
+    def load(self) -> int:
+        assets: Dict[str, StaticAsset] = {}
+        if not os.path.isdir(self.directory):
+            logger.warning("Static directory %s does not exist", self.directory)
+            self._assets = assets
+            return 0
+
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                full_path = os.path.join(root, name)
+                rel_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                asset = StaticAsset.from_file(full_path)
+                assets[rel_path] = asset
+                if self.html and name == "index.html":
+                    dir_path = os.path.dirname(rel_path)
+                    assets[f"{dir_path}/" if dir_path else ""] = asset
+
+        self._assets = assets
+        return len(assets)
+
+    def get(self, path: str) -> Optional[StaticAsset]:
+        asset = self._assets.get(path)
+        if asset is None and self.html:
+            asset = self._assets.get(f"{path.rstrip('/')}/")
+        return asset
+
+    def response(self, path: str, request: Request) -> Response:
+        asset = self.get(path)
+        if asset is None:
+            return Response(status_code=404, content="Not Found", media_type="text/plain")
+        if self.html and path and not path.endswith("/") and path not in self._assets:
+            # Каталог без слеша: как StaticFiles(html=True), чтобы работали
+            # относительные ссылки из index.html.
+            url = request.url.replace(path=request.url.path + "/")
+            return RedirectResponse(str(url), status_code=307)
+        return asset_response(asset, request, self.cache_control)
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from sqlalchemy import event
+
+
+timing_logger = logging.getLogger("timing")
+
+# Запросы медленнее порога пишутся в лог целиком (0 — логировать все)
+TIMING_LOG_THRESHOLD_MS = float(os.getenv("TIMING_LOG_THRESHOLD_MS", "250"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_MAX_DEPTH = 128
+
+# Словарь стадий текущего запроса: имя -> [секунды, вызовы]. Ставится
+# middleware; sync-роуты из threadpool видят его через копию контекста.
+_stages: ContextVar[Optional[Dict[str, list]]] = ContextVar("request_stages", default=None)
+
+
+def record(name: str, seconds: float) -> None:
+    stages = _stages.get()
+    if stages is None:
+        return
+    entry = stages.get(name)
+    if entry is None:
+        stages[name] = [seconds, 1]
+    else:
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Добавляет длительность блока к стадии name текущего запроса."""
+
+    if _stages.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def instrument_engine(engine: Any) -> None:
+    """Время всех SQL-запросов движка идёт в стадию "db"."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _stages.get() is not None:
+            conn.info.setdefault("timing_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("timing_started")
+        if started:
+            record("db", time.perf_counter() - started.pop())
+
+
+def _header(stages: Dict[str, list], total: float) -> bytes:
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, (seconds, _) in stages.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: заголовок Server-Timing и строка лога по стадиям запроса."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stages: Dict[str, list] = {}
+        token = _stages.set(stages)
+        started = time.perf_counter()
+        status_code = 0
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.append((b"server-timing", _header(stages, time.perf_counter() - started)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _stages.reset(token)
+            total_ms = (time.perf_counter() - started) * 1000
+            if total_ms >= TIMING_LOG_THRESHOLD_MS:
+                timing_logger.info(
+                    json.dumps(
+                        {
+                            "method": scope["method"],
+                            "path": scope["path"],
+                            "status": status_code,
+                            "total_ms": round(total_ms, 2),
+                            "stages": {
+                                name: {"ms": round(seconds * 1000, 2), "calls": calls}
+                                for name, (seconds, calls) in stages.items()
+                            },
+                        }
+                    )
+                )
+
+
+class SamplingProfiler:
+    """Сэмплирующий профайлер на sys._current_frames для всех потоков воркера.
+
+    Пока профилирование выключено, никакой работы не делается; во время
+    прогона отдельный поток раз в interval снимает стеки. Результат —
+    collapsed stacks (формат flamegraph.pl / speedscope).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float, interval: float) -> Optional[str]:
+        """Блокирует на seconds секунд; None — профайлер уже запущен."""
+
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._sample(min(seconds, PROFILE_MAX_SECONDS), interval)
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _sample(seconds: float, interval: float) -> str:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                frames = []
+                while frame is not None and len(frames) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+profiler = SamplingProfiler()
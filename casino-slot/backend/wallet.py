@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import RollupWatermark, User, WalletEntry, WalletSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+RedisLike = Any
+
+# Кэш живёт фиксированное время с момента загрузки из БД (TTL не продлевается),
+# поэтому расхождение кэша с журналом после сбоя лечится само.
+WALLET_CACHE_TTL = int(os.getenv("WALLET_CACHE_TTL", "300"))
+WALLET_COMPACT_INTERVAL = float(os.getenv("WALLET_COMPACT_INTERVAL", "60"))
+WALLET_COMPACT_BATCH = int(os.getenv("WALLET_COMPACT_BATCH", "10000"))
+# Записи моложе лага не сворачиваем: транзакция с меньшим id может ещё не закоммититься
+WALLET_COMPACT_LAG_SECONDS = float(os.getenv("WALLET_COMPACT_LAG_SECONDS", "5"))
+
+MINOR_UNITS = 100
+CACHE_KEY = "wallet:%s"
+WATERMARK_NAME = "wallet_entries"  # last_spin_id здесь — id последней свёрнутой записи
+
+
+def to_minor(amount: float) -> int:
+    return int(round(amount * MINOR_UNITS))
+
+
+def from_minor(amount: int) -> float:
+    return amount / MINOR_UNITS
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, balance: int) -> None:
+        super().__init__(f"Insufficient balance: {balance}")
+        self.balance = balance
+
+
+# Условное списание: nil — баланса нет в кэше, {0, баланс} — не хватает
+_DEBIT_LUA = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    return nil
+end
+local amount = tonumber(ARGV[1])
+if tonumber(current) < amount then
+    return {0, tonumber(current)}
+end
+return {1, redis.call('DECRBY', KEYS[1], amount)}
+"""
+
+# Зачисление только в уже загруженный кэш: пустой ключ перечитается из БД
+_CREDIT_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+
+class Wallet:
+    """Кошелёк игрока: append-only журнал в копейках + снимок + кэш в Redis.
+
+    Баланс = WalletSnapshot.balance + Σ WalletEntry.amount с id > last_entry_id.
+    Спин не переписывает строку users: он добавляет записи в журнал, а
+    проверка «хватает ли денег» — атомарный Lua по кэшу wallet:{user_id}.
+    Без Redis проверка идёт по БД под блокировкой строки снимка.
+    Снимки и зеркало users.balance периодически догоняются compact().
+    """
+
+    def __init__(self, cache_ttl: int = WALLET_CACHE_TTL) -> None:
+        self.cache_ttl = cache_ttl
+        self._scripts: dict = {}
+
+    def _script(self, redis_client: RedisLike, name: str, source: str):
+        script = self._scripts.get(name)
+        if script is None:
+            script = redis_client.register_script(source)
+            self._scripts[name] = script
+        return script
+
+    def open_account(self, db: Session, user_id: int, amount: int) -> None:
+        """Создаёт снимок и стартовую запись журнала (без коммита)."""
+
+        db.add(WalletSnapshot(user_id=user_id, balance=0, last_entry_id=0))
+        db.add(WalletEntry(user_id=user_id, amount=amount, kind="opening"))
+        db.flush()
+
+    def ensure_account(self, db: Session, user: User) -> None:
+        # Игроки, созданные до кошелька, переносятся по текущему users.balance
+        if db.get(WalletSnapshot, user.id) is None:
+            self.open_account(db, user.id, to_minor(user.balance or 0.0))
+
+    def stored_balance(self, db: Session, user_id: int, lock: bool = False) -> Optional[int]:
+        query = db.query(WalletSnapshot).filter(WalletSnapshot.user_id == user_id)
+        if lock:
+            query = query.with_for_update()
+        snapshot = query.first()
+        if snapshot is None:
+            return None
+        # Записи неизменяемы, поэтому хвост считаем от прочитанного last_entry_id —
+        # параллельная компакция не приведёт к двойному учёту
+        tail = (
+            db.query(func.coalesce(func.sum(WalletEntry.amount), 0))
+            .filter(
+                WalletEntry.user_id == user_id,
+                WalletEntry.id > snapshot.last_entry_id,
+            )
+            .scalar()
+        )
+        return int(snapshot.balance) + int(tail)
+
+    def balance(
+        self, redis_client: Optional[RedisLike], db: Session, user_id: int
+    ) -> Optional[int]:
+        """Баланс в копейках для чтения (UI): кэш, иначе БД; None — счёта ещё нет.
+
+        Промах кэша здесь не заполняет ключ — это делает только спин под своим
+        локом, иначе можно закэшировать баланс без ещё не закоммиченного спина.
+        """
+
+        if redis_client is not None:
+            try:
+                cached = redis_client.get(CACHE_KEY % user_id)
+            except Exception as exc:  # pragma: no cover
+                logger.warning("Wallet cache read failed: %s", exc)
+                cached = None
+            if cached is not None:
+                return int(cached)
+        return self.stored_balance(db, user_id)
+
+    def _invalidate(self, redis_client: RedisLike, user_id: int) -> None:
+        try:
+            redis_client.delete(CACHE_KEY % user_id)
+        except Exception as exc:  # pragma: no cover
+            logger.warning("Wallet cache invalidation failed: %s", exc)
+
+    def debit(
+        self, redis_client: Optional[RedisLike], db: Session, user_id: int, amount: int
+    ) -> int:
+        """Атомарно резервирует amount копеек и возвращает новый баланс.
+
+        Запись в журнал делает append(); при неудаче коммита вызывающий
+        обязан вернуть резерв через revert(). Вызывать под локом спина.
+        """
+
+        if redis_client is not None:
+            key = CACHE_KEY % user_id
+            try:
+                script = self._script(redis_client, "debit", _DEBIT_LUA)
+                result = script(keys=[key], args=[amount])
+                if result is None:
+                    stored = self.stored_balance(db, user_id) or 0
+                    redis_client.set(key, stored, nx=True, ex=self.cache_ttl)
+                    result = script(keys=[key], args=[amount])
+                if result is not None:
+                    ok, balance = int(result[0]), int(result[1])
+                    if not ok:
+                        raise InsufficientFunds(balance)
+                    return balance
+            except InsufficientFunds:
+                raise
+            except Exception as exc:  # pragma: no cover
+                logger.warning("Wallet cache debit failed, using DB: %s", exc)
+                self._invalidate(redis_client, user_id)
+
+        balance = self.stored_balance(db, user_id, lock=True) or 0
+        if balance < amount:
+            raise InsufficientFunds(balance)
+        return balance - amount
+
+    def credit(
+        self, redis_client: Optional[RedisLike], user_id: int, amount: int, current: int
+    ) -> int:
+        """Добавляет amount к кэшу (если он загружен); current — баланс до зачисления."""
+
+        if redis_client is not None and amount:
+            try:
+                script = self._script(redis_client, "credit", _CREDIT_LUA)
+                result = script(keys=[CACHE_KEY % user_id], args=[amount])
+                if result is not None:
+                    return int(result)
+            except Exception as exc:  # pragma: no cover
+                logger.warning("Wallet cache credit failed: %s", exc)
+                self._invalidate(redis_client, user_id)
+        return current + amount
+
+    def revert(self, redis_client: Optional[RedisLike], user_id: int, delta: int) -> None:
+        """Откатывает в кэше изменение delta, если транзакция спина не закоммитилась."""
+
+        if redis_client is None or not delta:
+            return
+        try:
+            script = self._script(redis_client, "credit", _CREDIT_LUA)
+            script(keys=[CACHE_KEY % user_id], args=[-delta])
+        except Exception as exc:  # pragma: no cover
+            logger.error("Wallet revert of %s for user %s failed: %s", delta, user_id, exc)
+            self._invalidate(redis_client, user_id)
+
+    def append(
+        self,
+        db: Session,
+        user_id: int,
+        entries: Iterable[Tuple[str, int]],
+        spin_id: Optional[int] = None,
+    ) -> None:
+        """Добавляет записи (kind, amount) в журнал; нулевые суммы пропускаются."""
+
+        for kind, amount in entries:
+            if amount:
+                db.add(WalletEntry(user_id=user_id, amount=amount, kind=kind, spin_id=spin_id))
+
+    def _watermark(self, db: Session) -> int:
+        row = db.get(RollupWatermark, WATERMARK_NAME)
+        if row is not None:
+            return row.last_spin_id
+        try:
+            db.add(RollupWatermark(name=WATERMARK_NAME, last_spin_id=0))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+        return 0
+
+    def compact(
+        self,
+        db: Session,
+        batch_size: int = WALLET_COMPACT_BATCH,
+        now: Optional[datetime] = None,
+    ) -> int:
+        """Сворачивает до batch_size записей журнала в снимки и зеркалит users.balance.
+
+        Watermark двигается условно, как в rollups.process_new_spins, поэтому
+        параллельные воркеры не свернут одни и те же записи дважды.
+        Возвращает число свёрнутых записей.
+        """
+
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(seconds=WALLET_COMPACT_LAG_SECONDS)
+        last_id = self._watermark(db)
+
+        rows = (
+            db.query(WalletEntry.id, WalletEntry.created_at)
+            .filter(WalletEntry.id > last_id)
+            .order_by(WalletEntry.id)
+            .limit(batch_size)
+            .all()
+        )
+        upper, processed = last_id, 0
+        for entry_id, created_at in rows:
+            if created_at is not None and created_at > cutoff:
+                break
+            upper, processed = entry_id, processed + 1
+
+        if upper == last_id:
+            db.rollback()
+            return 0
+
+        try:
+            claimed = db.execute(
+                update(RollupWatermark)
+                .where(
+                    RollupWatermark.name == WATERMARK_NAME,
+                    RollupWatermark.last_spin_id == last_id,
+                )
+                .values(last_spin_id=upper)
+            ).rowcount
+            if not claimed:
+                db.rollback()
+                return 0
+
+            tails = (
+                db.query(
+                    WalletEntry.user_id,
+                    func.sum(WalletEntry.amount),
+                    func.max(WalletEntry.id),
+                )
+                .join(WalletSnapshot, WalletSnapshot.user_id == WalletEntry.user_id)
+                .filter(
+                    WalletEntry.id > last_id,
+                    WalletEntry.id <= upper,
+                    WalletEntry.id > WalletSnapshot.last_entry_id,
+                )
+                .group_by(WalletEntry.user_id)
+                .all()
+            )
+            if tails:
+                snapshots: Dict[int, WalletSnapshot] = {
+                    row.user_id: row
+                    for row in db.query(WalletSnapshot)
+                    .filter(WalletSnapshot.user_id.in_([user_id for user_id, _, _ in tails]))
+                    .all()
+                }
+                for user_id, amount, max_id in tails:
+                    snapshot = snapshots[user_id]
+                    snapshot.balance += int(amount)
+                    snapshot.last_entry_id = max_id
+                    snapshot.updated_at = now
+                db.flush()
+                # users.balance — только зеркало для старых читателей, пишем его пачкой
+                db.execute(
+                    update(User),
+                    [
+                        {"id": user_id, "balance": from_minor(snapshot.balance)}
+                        for user_id, snapshot in snapshots.items()
+                    ],
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return processed
+
+    def compact_until_caught_up(self, db: Session, batch_size: int = WALLET_COMPACT_BATCH) -> int:
+        total = 0
+        while True:
+            processed = self.compact(db, batch_size)
+            total += processed
+            if processed < batch_size:
+                return total
+
+
+wallet = Wallet()
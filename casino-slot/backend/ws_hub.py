@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from integrations import get_redis, redis_url
+from serialization import dumps, loads
+
+
+logger = logging.getLogger(__name__)
+
+# Один канал на все воркеры: сообщение получает каждый воркер и отдаёт
+# только своим сокетам. Публикация — один PUBLISH, без опроса.
+FANOUT_CHANNEL = "ws:fanout"
+# Окно склейки частых обновлений (баланс) одного пользователя
+COALESCE_SECONDS = float(os.getenv("WS_COALESCE_MS", "50")) / 1000.0
+RECONNECT_DELAY_SECONDS = 1.0
+
+
+class ChannelHub:
+    """Подписки WebSocket-клиентов на каналы и реестр сокетов по user_id.
+
+    Сообщения от любого воркера идут через Redis pub/sub; без Redis
+    доставка работает только в пределах своего воркера. Пока подписка
+    этого воркера не поднята, свои сокеты получают сообщения напрямую.
+    """
+
+    def __init__(self) -> None:
+        self._channels: Dict[str, Set[WebSocket]] = {}
+        self._users: Dict[int, Set[WebSocket]] = {}
+        self._socket_users: Dict[WebSocket, int] = {}
+        self._pending: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Подписка на FANOUT_CHANNEL активна — своё сообщение вернётся из Redis
+        self._subscribed = False
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def subscribe(self, channel: str, websocket: WebSocket) -> None:
+        self._channels.setdefault(channel, set()).add(websocket)
+
+    def register_user(self, user_id: int, websocket: WebSocket) -> None:
+        previous = self._socket_users.get(websocket)
+        if previous == user_id:
+            return
+        if previous is not None:
+            self._discard_user(previous, websocket)
+        self._socket_users[websocket] = user_id
+        self._users.setdefault(user_id, set()).add(websocket)
+
+    def _discard_user(self, user_id: int, websocket: WebSocket) -> None:
+        sockets = self._users.get(user_id)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            del self._users[user_id]
+            self._pending.pop(user_id, None)
+
+    def unsubscribe_all(self, websocket: WebSocket) -> None:
+        for sockets in self._channels.values():
+            sockets.discard(websocket)
+        user_id = self._socket_users.pop(websocket, None)
+        if user_id is not None:
+            self._discard_user(user_id, websocket)
+
+    def subscriber_count(self, channel: str) -> int:
+        return len(self._channels.get(channel, ()))
+
+    def user_socket_count(self) -> int:
+        return len(self._socket_users)
+
+    async def _send(self, sockets: list, message: Dict[str, Any]) -> None:
+        # Кодируем один раз на сообщение, а не на каждый сокет
+        text = dumps(message).decode("utf-8")
+        results = await asyncio.gather(
+            *(ws.send_text(text) for ws in sockets), return_exceptions=True
+        )
+        for ws, result in zip(sockets, results):
+            if isinstance(result, Exception):
+                self.unsubscribe_all(ws)
+
+    async def broadcast(self, channel: str, message: Dict[str, Any]) -> None:
+        sockets = list(self._channels.get(channel, ()))
+        if sockets:
+            await self._send(sockets, message)
+
+    async def send_to_user(
+        self, user_id: int, message: Dict[str, Any], coalesce: bool = False
+    ) -> None:
+        """Отправка во все сокеты пользователя на этом воркере.
+
+        С coalesce=True сообщения одного типа, пришедшие в пределах окна,
+        схлопываются — уходит только последнее.
+        """
+
+        if user_id not in self._users:
+            return
+        if not coalesce:
+            await self._send(list(self._users[user_id]), message)
+            return
+
+        pending = self._pending.get(user_id)
+        if pending is not None:
+            pending[message.get("type", "")] = message
+            return
+        self._pending[user_id] = {message.get("type", ""): message}
+        asyncio.get_running_loop().call_later(
+            COALESCE_SECONDS, lambda: asyncio.ensure_future(self._flush_user(user_id))
+        )
+
+    async def _flush_user(self, user_id: int) -> None:
+        pending = self._pending.pop(user_id, None)
+        sockets = list(self._users.get(user_id, ()))
+        if not pending or not sockets:
+            return
+        for message in pending.values():
+            await self._send(sockets, message)
+
+    async def _dispatch(self, envelope: Dict[str, Any]) -> None:
+        message = envelope.get("message") or {}
+        if "user_id" in envelope:
+            await self.send_to_user(
+                int(envelope["user_id"]), message, bool(envelope.get("coalesce"))
+            )
+        elif "channel" in envelope:
+            await self.broadcast(envelope["channel"], message)
+
+    def _schedule(self, envelope: Dict[str, Any]) -> None:
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._dispatch(envelope), self._loop)
+        except RuntimeError as exc:  # pragma: no cover
+            logger.warning("Failed to schedule broadcast: %s", exc)
+
+    def _publish(self, envelope: Dict[str, Any]) -> None:
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                redis_client.publish(FANOUT_CHANNEL, dumps(envelope))
+                if self._subscribed:
+                    return
+            except Exception as exc:  # pragma: no cover
+                logger.warning("Fan-out publish failed, delivering locally: %s", exc)
+        self._schedule(envelope)
+
+    def publish_threadsafe(self, channel: str, message: Dict[str, Any]) -> None:
+        """Широковещательное сообщение по каналу; можно вызывать из threadpool."""
+        self._publish({"channel": channel, "message": message})
+
+    def publish_to_user(
+        self, user_id: int, message: Dict[str, Any], coalesce: bool = False
+    ) -> None:
+        """Сообщение во все сокеты пользователя на всех воркерах."""
+        self._publish({"user_id": user_id, "message": message, "coalesce": coalesce})
+
+    async def run_subscriber(self) -> None:
+        """Единственная подписка воркера на FANOUT_CHANNEL; переподключается сама."""
+
+        try:
+            import redis.asyncio as redis_async
+        except ImportError:  # pragma: no cover
+            return
+
+        while True:
+            client = None
+            try:
+                client = redis_async.Redis.from_url(redis_url(), decode_responses=True)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(FANOUT_CHANNEL)
+                self._subscribed = True
+                async for raw in pubsub.listen():
+                    try:
+                        envelope = loads(raw["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    await self._dispatch(envelope)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # pragma: no cover
+                logger.warning("Fan-out subscriber disconnected: %s", exc)
+            finally:
+                self._subscribed = False
+                if client is not None:
+                    try:
+                        await client.close()
+                    except Exception:  # pragma: no cover
+                        pass
+            await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+
+
+hub = ChannelHub()